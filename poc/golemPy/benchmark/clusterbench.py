@@ -0,0 +1,279 @@
+import sys
+import os
+benchDir = os.path.dirname( os.path.abspath( __file__ ) )
+for d in [ "..", "../golem", "../golem/core", "../golem/network", "../golem/task", "../golem/task/resource", "../golem/manager", "../golem/manager/client", "../golem/vm", "../testtasks/minilight/src", "../testtasks/pbrt" ]:
+    sys.path.append( os.path.join( benchDir, d ) )
+
+import time
+import json
+import uuid
+import random
+import shutil
+import argparse
+import tempfile
+
+from Message import initMessages
+from ClientConfigDescriptor import ClientConfigDescriptor
+from Client import Client
+from TaskBase import Task, TaskHeader
+from ProtocolStats import DIRECTION_OUT
+
+# computed by PythonVM in the scope of extraData, the result is output
+SYNTHETIC_SRC = """
+acc = 0
+for i in xrange( iterations ):
+    acc += i * i
+output = "r" * resultSize
+"""
+
+class SyntheticTask( Task ):
+    """
+    Task of numSubTasks independent subtasks without resources, each burns
+    given number of loop iterations and returns resultSize bytes
+    """
+
+    #######################
+    def __init__( self, header, numSubTasks, iterations, resultSize, bench ):
+        Task.__init__( self, header, SYNTHETIC_SRC )
+        self.numSubTasks    = numSubTasks
+        self.iterations     = iterations
+        self.resultSize     = resultSize
+        self.bench          = bench
+        self.given          = 0
+        self.finished       = 0
+
+    #######################
+    def initialize( self ):
+        pass
+
+    #######################
+    def queryExtraData( self, perfIndex ):
+        subTaskId = uuid.uuid4().hex
+        self.given += 1
+        self.bench.subTaskAssigned( self.header.taskId, subTaskId )
+        return { "iterations" : self.iterations, "resultSize" : self.resultSize }, subTaskId, self.header.taskOwnerAddress, self.header.taskOwnerPort
+
+    #######################
+    def shortExtraDataRepr( self, perfIndex ):
+        return "synthetic {} iterations".format( self.iterations )
+
+    #######################
+    def needsComputation( self ):
+        return self.given < self.numSubTasks
+
+    #######################
+    def computationStarted( self, extraData ):
+        pass
+
+    #######################
+    def computationFinished( self, subTaskId, taskResult, env = None ):
+        self.finished += 1
+        self.bench.subTaskFinished( self.header.taskId, subTaskId, len( taskResult ) if taskResult else 0 )
+
+    #######################
+    def getTotalTasks( self ):
+        return self.numSubTasks
+
+    #######################
+    def getTotalChunks( self ):
+        return self.numSubTasks
+
+    #######################
+    def getActiveTasks( self ):
+        return self.given - self.finished
+
+    #######################
+    def getActiveChunks( self ):
+        return self.given - self.finished
+
+    #######################
+    def getChunksLeft( self ):
+        return self.numSubTasks - self.finished
+
+    #######################
+    def getProgress( self ):
+        return self.finished / float( self.numSubTasks )
+
+    #######################
+    def acceptResultsDelay( self ):
+        return 0.0
+
+    #######################
+    def prepareResourceDelta( self, subTaskId, resourceHeader ):
+        return None
+
+############################
+def percentiles( samples ):
+    if not samples:
+        return None
+
+    s = sorted( samples )
+    return {    "p50"   : s[ len( s ) / 2 ],
+                "p95"   : s[ min( len( s ) - 1, int( len( s ) * 0.95 ) ) ],
+                "max"   : s[ -1 ] }
+
+class ClusterBenchmark:
+    """
+    Boots numNodes real Clients in this process and reactor on loopback,
+    all joining through the first one. After warm up the first numOwners
+    nodes submit synthetic tasks and the run ends when all subtasks are
+    computed or after timeout.
+    """
+
+    ############################
+    def __init__( self, args ):
+        self.args           = args
+        self.clients        = []
+        self.submitted      = {}    # taskId -> submit time
+        self.firstAssigned  = {}    # taskId -> time of first subtask assignment
+        self.assigned       = {}    # subTaskId -> assignment time
+        self.latencies      = []
+        self.finishedAt     = []
+        self.resultBytes    = 0
+        self.expected       = args.tasks * args.subtasks
+        self.startTime      = None
+
+    ############################
+    def run( self ):
+        from twisted.internet import reactor
+
+        initMessages()
+
+        for i in range( self.args.nodes ):
+            client = Client( self.__config( i ) )
+            client.hostAddress = u"127.0.0.1"
+            client.startNetwork()
+            self.clients.append( client )
+
+        reactor.callLater( self.args.warm_up, self.__submitTasks )
+        reactor.callLater( self.args.warm_up + self.args.timeout, self.__stop )
+        reactor.run()
+
+        return self.__report()
+
+    ############################
+    def subTaskAssigned( self, taskId, subTaskId ):
+        now = time.time()
+        self.assigned[ subTaskId ] = now
+        self.firstAssigned.setdefault( taskId, now )
+
+    ############################
+    def subTaskFinished( self, taskId, subTaskId, resultSize ):
+        now = time.time()
+        if subTaskId in self.assigned:
+            self.latencies.append( now - self.assigned[ subTaskId ] )
+        self.finishedAt.append( now )
+        self.resultBytes += resultSize
+
+        if len( self.finishedAt ) >= self.expected:
+            self.__stop()
+
+    ############################
+    def __config( self, i ):
+        cfg = ClientConfigDescriptor()
+        cfg.clientUid               = u"node{:04d}".format( i )
+        cfg.startPort               = self.args.base_port + 2 * i   # p2p port, task server takes the next one
+        cfg.endPort                 = self.args.base_port + 2 * i + 1
+        cfg.managerPort             = self.args.manager_port
+        cfg.optNumPeers             = self.args.peers
+        cfg.taskRequestInterval     = self.args.request_interval
+        cfg.estimatedPerformance    = 1000.0
+        cfg.nodeSnapshotInterval    = 3600.0
+        cfg.maxResultsSendignDelay  = 10.0
+        cfg.useDht                  = self.args.dht
+
+        if i > 0:
+            cfg.seedHost        = u"127.0.0.1"
+            cfg.seedHostPort    = self.args.base_port
+
+        return cfg
+
+    ############################
+    def __submitTasks( self ):
+        self.startTime = time.time()
+        owners = self.clients[ :max( 1, self.args.owners ) ]
+
+        for i in range( self.args.tasks ):
+            owner = owners[ i % len( owners ) ]
+            taskId = u"bench{:04d}".format( i )
+            header = TaskHeader( owner.configDesc.clientUid, taskId, u"", 0, self.args.timeout * 2 )
+            task = SyntheticTask( header, self.args.subtasks, self.args.iterations, self.args.result_size, self )
+
+            self.submitted[ taskId ] = time.time()
+            owner.taskServer.taskManager.addNewTask( task )
+
+    ############################
+    def __stop( self ):
+        from twisted.internet import reactor
+
+        if reactor.running:
+            self.endTime = time.time()
+            self.sentBytes = self.__sentBytes()
+            reactor.stop()
+
+    ############################
+    def __sentBytes( self ):
+        p2p = 0
+        task = 0
+        for c in self.clients:
+            p2p += sum( s[ "bytes" ] for ( direction, name ), s in c.p2pservice.getProtocolStats().items() if direction == DIRECTION_OUT )
+            task += sum( s[ "bytes" ] for ( direction, name ), s in c.taskServer.getProtocolStats().items() if direction == DIRECTION_OUT )
+
+        return { "p2p" : p2p, "task" : task }
+
+    ############################
+    def __report( self ):
+        elapsed = ( self.endTime - self.startTime ) if self.startTime else 0.0
+        done = len( self.finishedAt )
+
+        return {    "nodes"                     : self.args.nodes,
+                    "tasks"                     : self.args.tasks,
+                    "subtasks"                  : self.expected,
+                    "subtasksDone"              : done,
+                    "elapsed"                   : elapsed,
+                    "subtasksPerSecond"         : done / elapsed if elapsed > 0.0 else 0.0,
+                    "timeToFirstAssignment"     : percentiles( [ self.firstAssigned[ t ] - self.submitted[ t ] for t in self.firstAssigned ] ),
+                    "resultLatency"             : percentiles( self.latencies ),
+                    "resultBytes"               : self.resultBytes,
+                    "bytesSent"                 : self.sentBytes }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description = "End to end benchmark of real clients on loopback, prints JSON report" )
+    parser.add_argument( "--nodes", type = int, default = 50 )
+    parser.add_argument( "--owners", type = int, default = 1, help = "number of nodes submitting tasks" )
+    parser.add_argument( "--tasks", type = int, default = 4 )
+    parser.add_argument( "--subtasks", type = int, default = 50, help = "subtasks of every task" )
+    parser.add_argument( "--iterations", type = int, default = 100000, help = "loop iterations computed by every subtask" )
+    parser.add_argument( "--result-size", type = int, default = 64 * 1024 )
+    parser.add_argument( "--peers", type = int, default = 4, help = "optimal number of peers of every node" )
+    parser.add_argument( "--request-interval", type = float, default = 1.0, help = "task request interval of every node" )
+    parser.add_argument( "--dht", type = int, default = 0 )
+    parser.add_argument( "--base-port", type = int, default = 46000 )
+    parser.add_argument( "--manager-port", type = int, default = 45999, help = "nodes manager is not needed, connections to it just fail" )
+    parser.add_argument( "--warm-up", type = float, default = 10.0, help = "seconds before tasks are submitted" )
+    parser.add_argument( "--timeout", type = float, default = 300.0 )
+    parser.add_argument( "--work-dir", default = None, help = "directory for node data, temporary one is removed after run" )
+    parser.add_argument( "--seed", type = int, default = None )
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed( args.seed )
+
+    # nodes keep their files relative to working directory
+    workDir = args.work_dir or tempfile.mkdtemp( prefix = "clusterbench" )
+    if not os.path.exists( workDir ):
+        os.makedirs( workDir )
+    os.chdir( workDir )
+
+    # nodes are verbose, keep stdout for the report
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+
+    try:
+        report = ClusterBenchmark( args ).run()
+    finally:
+        if not args.work_dir:
+            os.chdir( benchDir )
+            shutil.rmtree( workDir, True )
+
+    stdout.write( json.dumps( report, indent = 2, sort_keys = True ) + "\n" )
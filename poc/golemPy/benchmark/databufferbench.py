@@ -0,0 +1,84 @@
+import sys
+import os
+sys.path.append( os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), "../golem/core" ) )
+
+import time
+import struct
+
+from databuffer import DataBuffer
+
+class StringSlicingDataBuffer:
+    """
+    Previous DataBuffer implementation (rebuilds the whole string on every
+    append and read), kept here as the baseline for comparison
+    """
+
+    def __init__( self ):
+        self.bufferedData = ""
+
+    def appendString( self, data ):
+        self.bufferedData = "".join( [ self.bufferedData, data ] )
+
+    def appendLenPrefixedString( self, data ):
+        self.appendString( struct.pack( "!L", len( data ) ) )
+        self.appendString( data )
+
+    def dataSize( self ):
+        return len( self.bufferedData )
+
+    def peekUInt( self ):
+        (retVal,) = struct.unpack( "!L", self.bufferedData[0:4] )
+        return retVal
+
+    def readLenPrefixedString( self ):
+        retStr = None
+
+        if self.dataSize() > 4 and self.dataSize() >= ( self.peekUInt() + 4 ):
+            numChars = self.peekUInt()
+            retStr = self.bufferedData[ 4 : 4 + numChars ]
+            self.bufferedData = self.bufferedData[ 4 + numChars: ]
+
+        return retStr
+
+############################
+def buildStream( numFrames, frameSize ):
+    db = DataBuffer()
+    frame = "x" * frameSize
+
+    for i in range( numFrames ):
+        db.appendLenPrefixedString( frame )
+
+    return db.readAll()
+
+############################
+def decodeAll( BufferType, stream ):
+    db = BufferType()
+
+    start = time.time()
+
+    # whole stream arrives in a single TCP read
+    db.appendString( stream )
+
+    numFrames = 0
+    while db.readLenPrefixedString():
+        numFrames += 1
+
+    return numFrames, time.time() - start
+
+############################
+def runBenchmark( frameSize = 512, frameCounts = [ 1000, 2000, 4000, 8000, 16000 ] ):
+    print "Frame size: {} bytes".format( frameSize )
+    print "{:>8} {:>14} {:>14} {:>14} {:>14}".format( "frames", "cursor [s]", "us/frame", "slicing [s]", "us/frame" )
+
+    for numFrames in frameCounts:
+        stream = buildStream( numFrames, frameSize )
+
+        n, cursorTime = decodeAll( DataBuffer, stream )
+        assert n == numFrames
+        n, slicingTime = decodeAll( StringSlicingDataBuffer, stream )
+        assert n == numFrames
+
+        print "{:>8} {:>14.4f} {:>14.2f} {:>14.4f} {:>14.2f}".format( numFrames, cursorTime, 1e6 * cursorTime / numFrames, slicingTime, 1e6 * slicingTime / numFrames )
+
+if __name__ == "__main__":
+    runBenchmark()
@@ -0,0 +1,147 @@
+import sys
+import os
+benchDir = os.path.dirname( os.path.abspath( __file__ ) )
+for d in [ "../golem", "../golem/core", "../golem/network" ]:
+    sys.path.append( os.path.join( benchDir, d ) )
+
+import time
+import json
+import random
+import argparse
+
+from Message import initMessages
+from ClientConfigDescriptor import ClientConfigDescriptor
+from P2PService import P2PService
+from timerqueue import TimerQueue
+
+class DhtBenchmark:
+    """
+    Runs numNodes P2PService instances with dht enabled in one process on
+    loopback. All nodes join through the first one, after warm up random
+    nodes look up random nodes and task headers stored by random owners.
+    """
+
+    ############################
+    def __init__( self, numNodes, basePort, warmUp, numLookups, optNumPeers ):
+        self.numNodes       = numNodes
+        self.basePort       = basePort
+        self.warmUp         = warmUp
+        self.numLookups     = numLookups
+        self.optNumPeers    = optNumPeers
+        self.nodes          = []
+        self.nodeLookups    = []
+        self.taskLookups    = []
+        self.pending        = 0
+        self.report         = None
+
+    ############################
+    def run( self ):
+        from twisted.internet import reactor
+
+        initMessages()
+
+        # nodes run maintenance from timers like Client does
+        self.timers = TimerQueue()
+        for i in range( self.numNodes ):
+            node = P2PService( "127.0.0.1", self.__config( i ) )
+            node.registerTimers( self.timers )
+            self.nodes.append( node )
+
+        reactor.callLater( self.warmUp, self.__storeTasks )
+        reactor.run()
+
+        return self.report
+
+    ############################
+    def __config( self, i ):
+        cfg = ClientConfigDescriptor()
+        cfg.clientUid       = u"node{:04d}".format( i )
+        cfg.startPort       = self.basePort + i
+        cfg.endPort         = self.basePort + i
+        cfg.optNumPeers     = self.optNumPeers
+        cfg.useDht          = 1
+
+        if i > 0:
+            cfg.seedHost        = u"127.0.0.1"
+            cfg.seedHostPort    = self.basePort
+
+        return cfg
+
+    ############################
+    def __storeTasks( self ):
+        from twisted.internet import reactor
+
+        self.tasks = []
+        for i in range( self.numLookups ):
+            th = { "id" : u"task{:04d}".format( i ), "address" : u"127.0.0.1", "port" : 0, "ttl" : 600.0, "clientId" : u"" }
+            random.choice( self.nodes ).dht.storeTask( th )
+            self.tasks.append( th[ "id" ] )
+
+        reactor.callLater( 2.0, self.__lookup )
+
+    ############################
+    def __lookup( self ):
+        self.pending = 2 * self.numLookups
+
+        for i in range( self.numLookups ):
+            src, dst = random.sample( self.nodes, 2 )
+            start = time.time()
+            src.dht.findNode( dst.clientUid, lambda contact, rpcs, start = start, dst = dst: self.__done( self.nodeLookups, contact is not None and contact.uid == dst.clientUid, rpcs, start ) )
+
+            src = random.choice( self.nodes )
+            start = time.time()
+            src.dht.findTask( self.tasks[ i ], lambda th, rpcs, start = start: self.__done( self.taskLookups, th is not None, rpcs, start ) )
+
+    ############################
+    def __done( self, results, found, rpcs, start ):
+        from twisted.internet import reactor
+
+        results.append( ( found, rpcs, time.time() - start ) )
+        self.pending -= 1
+
+        if self.pending == 0:
+            self.report = self.__report()
+            self.timers.cancelAll()
+            reactor.stop()
+
+    ############################
+    def __summary( self, results ):
+        if not results:
+            return None
+
+        rpcs = sorted( r for f, r, t in results )
+        times = sorted( t for f, r, t in results )
+
+        return {    "lookups"   : len( results ),
+                    "found"     : len( [ f for f, r, t in results if f ] ),
+                    "meanRpcs"  : sum( rpcs ) / float( len( rpcs ) ),
+                    "maxRpcs"   : rpcs[ -1 ],
+                    "p50Ms"     : 1e3 * times[ len( times ) / 2 ],
+                    "maxMs"     : 1e3 * times[ -1 ] }
+
+    ############################
+    def __report( self ):
+        tableSizes = [ len( n.dht.table ) for n in self.nodes ]
+
+        return {    "nodes"             : self.numNodes,
+                    "meanRoutingTable"  : sum( tableSizes ) / float( len( tableSizes ) ),
+                    "meanPeers"         : sum( len( n.peers ) for n in self.nodes ) / float( self.numNodes ),
+                    "findNode"          : self.__summary( self.nodeLookups ),
+                    "findTask"          : self.__summary( self.taskLookups ) }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description = "Dht overlay benchmark with in-process nodes on loopback, prints JSON report" )
+    parser.add_argument( "--nodes", type = int, default = 200 )
+    parser.add_argument( "--base-port", type = int, default = 45000 )
+    parser.add_argument( "--warm-up", type = float, default = 15.0, help = "seconds before lookups start" )
+    parser.add_argument( "--lookups", type = int, default = 100 )
+    parser.add_argument( "--peers", type = int, default = 3, help = "optimal number of peers of every node" )
+    args = parser.parse_args()
+
+    # nodes are verbose, keep stdout for the report
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+
+    report = DhtBenchmark( args.nodes, args.base_port, args.warm_up, args.lookups, args.peers ).run()
+
+    stdout.write( json.dumps( report, indent = 2, sort_keys = True ) + "\n" )
@@ -0,0 +1,341 @@
+import sys
+import os
+benchDir = os.path.dirname( os.path.abspath( __file__ ) )
+for d in [ "../golem", "../golem/core", "../golem/network", "../golem/task", "../golem/manager" ]:
+    sys.path.append( os.path.join( benchDir, d ) )
+
+import time
+import gc
+import json
+import argparse
+import platform
+
+from Message import *
+
+MB = 1024.0 * 1024.0
+
+PAYLOAD_SIZES       = [ 1024, 64 * 1024, 1024 * 1024 ]
+LARGE_RESULT_SIZE   = 50 * 1024 * 1024
+
+############################
+def textPayload( size ):
+    line = "    for i in range( numSamples ): color = color + trace( ray, scene, depth )\n"
+    return ( line * ( size / len( line ) + 1 ) )[ :size ]
+
+############################
+def binaryPayload( size ):
+    return os.urandom( size )
+
+############################
+def peerList( size ):
+    return [ { "address" : u"10.0.{}.{}".format( i / 256, i % 256 ), "port" : 40102, "id" : u"{:032x}".format( i ) } for i in range( max( 1, size / 64 ) ) ]
+
+############################
+def taskList( size ):
+    return [ { "id" : u"{:032x}".format( i ), "address" : u"10.0.0.1", "port" : 40103, "ttl" : 600.0, "clientId" : u"{:032x}".format( i ) } for i in range( max( 1, size / 96 ) ) ]
+
+# Builders of realistic messages with payload of about given size. Message
+# types without builder are benchmarked as constructed by default constructor
+SAMPLE_BUILDERS = {
+    MessageHello                : lambda size: MessageHello( 40102, u"0123456789abcdef0123456789abcdef", 0, 1, CODEC_BINARY, [ u"zlib" ], 16 * 1024 * 1024, [ u"contentCache" ] ),
+    MessageDisconnect           : lambda size: MessageDisconnect( u"Duplicated connection" ),
+    MessagePeers                : lambda size: MessagePeers( peerList( size ) ),
+    MessageTasks                : lambda size: MessageTasks( taskList( size ) ),
+    MessageGetTaskChanges       : lambda size: MessageGetTaskChanges( u"{:032x}".format( 1 ), 0, binaryPayload( 1200 ), 7, 12345 ),
+    MessageTaskChanges          : lambda size: MessageTaskChanges( u"{:032x}".format( 1 ), 1000, False, taskList( size ), [ u"{:032x}".format( 2 ) ] ),
+    MessageTaskAnnounce         : lambda size: MessageTaskAnnounce( taskList( 96 )[ 0 ], 6 ),
+    MessageWantToComputeTask    : lambda size: MessageWantToComputeTask( u"task-1", 1500.0 ),
+    MessageTaskToCompute        : lambda size: MessageTaskToCompute( u"subtask-1", { "startTask" : 1, "endTask" : 2, "task_data" : textPayload( size ) }, u"chunk 1 of 100", textPayload( size ), u"10.0.0.1", 40103 ),
+    MessageCannotAssignTask     : lambda size: MessageCannotAssignTask( u"task-1", u"No more subtasks in task-1" ),
+    MessageReportComputedTask   : lambda size: MessageReportComputedTask( u"subtask-1" ),
+    MessageGetTaskResult        : lambda size: MessageGetTaskResult( u"subtask-1", 0.0 ),
+    MessageTaskResult           : lambda size: MessageTaskResult( u"subtask-1", [ binaryPayload( size ) ] ),
+    MessageGetResource          : lambda size: MessageGetResource( u"subtask-1", binaryPayload( size ) ),
+    MessageResource             : lambda size: MessageResource( u"subtask-1", binaryPayload( size ) ),
+    MessageGetContent           : lambda size: MessageGetContent( [ u"{:040x}".format( i ) for i in range( 4 ) ] ),
+    MessageContent              : lambda size: MessageContent( u"{:040x}".format( 1 ), binaryPayload( size ) ),
+    MessageStreamOpen           : lambda size: MessageStreamOpen( u"subtask-1", u"result", 50 * 1024 * 1024, u"{:040x}".format( 1 ) ),
+    MessageStreamChunk          : lambda size: MessageStreamChunk( u"subtask-1", 1024 * 1024, binaryPayload( size ) ),
+    MessageStreamAck            : lambda size: MessageStreamAck( u"subtask-1", 1024 * 1024 ),
+    MessagePeerStatus           : lambda size: MessagePeerStatus( u"node-1", binaryPayload( size ) ),
+    MessageNewTask              : lambda size: MessageNewTask( binaryPayload( size ) ),
+}
+
+# Types whose size depends on payload, others are measured once
+SIZED_TYPES = [ MessagePeers, MessageTasks, MessageTaskChanges, MessageTaskToCompute, MessageTaskResult, MessageGetResource, MessageResource, MessageContent, MessageStreamChunk, MessagePeerStatus, MessageNewTask ]
+
+############################
+def percentiles( samples ):
+    s = sorted( samples )
+    pick = lambda p: s[ min( len( s ) - 1, int( p * len( s ) ) ) ]
+    return { "p50Us" : 1e6 * pick( 0.5 ), "p90Us" : 1e6 * pick( 0.9 ), "p99Us" : 1e6 * pick( 0.99 ) }
+
+############################
+def timeOperation( op, iterations, numBytes ):
+    samples = []
+
+    for i in range( iterations ):
+        start = time.time()
+        op()
+        samples.append( time.time() - start )
+
+    total = sum( samples ) or 1e-9
+
+    ret = { "iterations" : iterations, "msgsPerSec" : iterations / total, "MBPerSec" : iterations * numBytes / MB / total }
+    ret.update( percentiles( samples ) )
+    return ret
+
+############################
+def countNewObjects( op ):
+    """Number of gc tracked objects still alive after op - allocations kept by its result"""
+    gc.collect()
+    gc.disable()
+    try:
+        before = len( gc.get_objects() )
+        result = op()
+        after = len( gc.get_objects() )
+    finally:
+        gc.enable()
+
+    del result
+    return after - before - 1 # the list returned by get_objects
+
+############################
+def decodeFull( frame ):
+    msg = Message.deserializeMessage( frame )
+    msg.dictRepr() # materializes lazily decoded fields
+    return msg
+
+############################
+def iterationsFor( frameSize ):
+    return max( 3, min( 2000, int( 16 * MB / max( frameSize, 1 ) ) ) )
+
+############################
+def benchmarkMessage( msg, payloadSize, codec ):
+    frame = msg.serialize( codec )
+    view = memoryview( frame )
+    iterations = iterationsFor( len( frame ) )
+
+    return {    "type"          : msg.getType(),
+                "name"          : msg.__class__.__name__,
+                "codec"         : "binary" if codec == CODEC_BINARY else "pickle",
+                "binaryFrame"   : frame[ 0 ] == '\xc7',
+                "payloadBytes"  : payloadSize,
+                "frameBytes"    : len( frame ),
+                "encode"        : timeOperation( lambda: msg.serialize( codec ), iterations, len( frame ) ),
+                "decodeLazy"    : timeOperation( lambda: Message.deserializeMessage( view ), iterations, len( frame ) ),
+                "decode"        : timeOperation( lambda: decodeFull( view ), iterations, len( frame ) ),
+                "decodeObjects" : countNewObjects( lambda: decodeFull( view ) ) }
+
+############################
+def runCodecBenchmarks( includeLarge ):
+    initMessages()
+
+    results = []
+
+    for msgType in sorted( Message.registeredMessageTypes ):
+        cls = Message.registeredMessageTypes[ msgType ]
+        builder = SAMPLE_BUILDERS.get( cls, lambda size: cls() )
+
+        sizes = [ 0 ]
+        if cls in SIZED_TYPES:
+            sizes = list( PAYLOAD_SIZES )
+            if includeLarge and cls is MessageTaskResult:
+                sizes.append( LARGE_RESULT_SIZE )
+
+        for size in sizes:
+            msg = builder( size )
+            for codec in [ CODEC_PICKLE, CODEC_BINARY ]:
+                results.append( benchmarkMessage( msg, size, codec ) )
+                sys.stderr.write( "{} {} {}\n".format( cls.__name__, size, codec ) )
+
+    return results
+
+##############################
+##############################
+# ( connection class name, message builder, payload size, number of messages )
+LOOPBACK_CASES = [  ( "NetConnState",  MessagePing,         0,                  20000 ),
+                    ( "NetConnState",  MessageTasks,        16 * 1024,          2000 ),
+                    ( "TaskConnState", MessageStreamChunk,  64 * 1024,          1000 ),
+                    ( "TaskConnState", MessageTaskResult,   1024 * 1024,        50 ) ]
+
+class LoopbackBenchmark:
+    """
+    Sends burst of messages over loopback TCP connection between two
+    ConnectionState instances and measures delivery rate and latency
+    ( from sendMessage to _interpret of received message )
+    """
+
+    ############################
+    def __init__( self, cases, codecs ):
+        self.cases      = [ ( c, codec ) for c in cases for codec in codecs ]
+        self.results    = []
+        self.port       = None
+        self.server     = None
+        self.client     = None
+
+    ############################
+    def run( self ):
+        from twisted.internet import reactor
+
+        reactor.callWhenRunning( self.__runNext )
+        reactor.run()
+
+        return self.results
+
+    ############################
+    def connected( self, conn, isServer ):
+        if isServer:
+            self.server = conn
+        else:
+            self.client = conn
+
+        if self.server and self.client:
+            self.__send()
+
+    ############################
+    def received( self, msg ):
+        now = time.time()
+        self.latencies.append( now - self.sendTimes[ len( self.latencies ) ] )
+
+        if len( self.latencies ) == self.count:
+            self.__finish( now )
+
+    ############################
+    def __runNext( self ):
+        from twisted.internet import reactor
+        from twisted.internet.protocol import Factory, ClientFactory
+
+        if not self.cases:
+            reactor.stop()
+            return
+
+        ( self.connName, self.msgClass, self.payloadSize, self.count ), self.codec = self.cases.pop( 0 )
+        self.server = self.client = None
+
+        connClass = makeBenchConnState( self.connName )
+        bench = self
+
+        class ServerFactory( Factory ):
+            def buildProtocol( self, addr ):
+                return connClass( bench, True )
+
+        class BenchClientFactory( ClientFactory ):
+            def buildProtocol( self, addr ):
+                return connClass( bench, False )
+
+        self.port = reactor.listenTCP( 0, ServerFactory(), interface = "127.0.0.1" )
+        reactor.connectTCP( "127.0.0.1", self.port.getHost().port, BenchClientFactory() )
+
+    ############################
+    def __send( self ):
+        msg = SAMPLE_BUILDERS.get( self.msgClass, lambda size: self.msgClass() )( self.payloadSize )
+
+        self.frameBytes = len( msg.serialize( self.codec ) )
+        self.latencies  = []
+        self.sendTimes  = []
+
+        for conn in [ self.server, self.client ]:
+            conn.setCodec( self.codec )
+            conn.setFrameLimits( 64 * 1024 * 1024 )
+
+        self.start = time.time()
+        for i in range( self.count ):
+            self.sendTimes.append( time.time() )
+            self.client.sendMessage( msg )
+
+    ############################
+    def __finish( self, end ):
+        from twisted.internet import reactor
+
+        total = end - self.start
+        result = {  "connection"    : self.connName,
+                    "name"          : self.msgClass.__name__,
+                    "codec"         : "binary" if self.codec == CODEC_BINARY else "pickle",
+                    "payloadBytes"  : self.payloadSize,
+                    "frameBytes"    : self.frameBytes,
+                    "messages"      : self.count,
+                    "msgsPerSec"    : self.count / total,
+                    "MBPerSec"      : self.count * self.frameBytes / MB / total }
+        result.update( percentiles( self.latencies ) )
+        self.results.append( result )
+
+        sys.stderr.write( "{} {} {}\n".format( self.connName, self.msgClass.__name__, self.codec ) )
+
+        self.client.close()
+        self.server.close()
+        self.port.stopListening()
+        reactor.callLater( 0, self.__runNext )
+
+############################
+def makeBenchConnState( connName ):
+    from ConnectionState import ConnectionState
+    if connName == "NetConnState":
+        from NetConnState import NetConnState as base
+    else:
+        from TaskConnState import TaskConnState as base
+
+    class BenchConnState( base ):
+        def __init__( self, bench, isServer ):
+            base.__init__( self )
+            self.bench      = bench
+            self.isServer   = isServer
+
+        # sessions are not created, messages go straight to the benchmark
+        def connectionMade( self ):
+            ConnectionState.connectionMade( self )
+            self.bench.connected( self, self.isServer )
+
+        def connectionLost( self, reason ):
+            ConnectionState.connectionLost( self, reason )
+
+        def _interpret( self, msg ):
+            self.bench.received( msg )
+
+    return BenchConnState
+
+############################
+def runLoopbackBenchmarks():
+    try:
+        return LoopbackBenchmark( LOOPBACK_CASES, [ CODEC_PICKLE, CODEC_BINARY ] ).run()
+    except ImportError as ex:
+        sys.stderr.write( "Loopback benchmark skipped: {}\n".format( ex ) )
+        return None
+
+############################
+def peakRssKB():
+    try:
+        import resource
+    except ImportError:
+        return None # not available on Windows
+    return resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+
+############################
+def runBenchmark( includeLarge = True, loopback = True ):
+    report = {  "python"    : platform.python_version(),
+                "platform"  : platform.platform(),
+                "time"      : time.strftime( "%Y-%m-%d %H:%M:%S" ),
+                "messages"  : runCodecBenchmarks( includeLarge ) }
+
+    if loopback:
+        report[ "loopback" ] = runLoopbackBenchmarks()
+
+    report[ "peakRssKB" ] = peakRssKB()
+
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description = "Wire protocol benchmark, prints JSON report" )
+    parser.add_argument( "--output", help = "write report to file instead of stdout" )
+    parser.add_argument( "--no-large", action = "store_true", help = "skip {} MB result".format( int( LARGE_RESULT_SIZE / MB ) ) )
+    parser.add_argument( "--no-loopback", action = "store_true", help = "skip Twisted loopback framing benchmark" )
+    args = parser.parse_args()
+
+    report = runBenchmark( not args.no_large, not args.no_loopback )
+    out = json.dumps( report, indent = 2, sort_keys = True )
+
+    if args.output:
+        with open( args.output, "w" ) as f:
+            f.write( out )
+    else:
+        print out
@@ -43,6 +43,18 @@ class NodeConfig:
         ConfigEntry.createProperty( self.section(), "node snapshot interval",   4.0,  self, "NodeSnapshotInterval" )
         ConfigEntry.createProperty( self.section(), "add tasks",           0,     self, "AddTasks" )
         ConfigEntry.createProperty( self.section(), "maximum delay for sending task results",           3600,  self, "MaxResultsSendingDelay" )
+        ConfigEntry.createProperty( self.section(), "p2p max frame size",  4 * 1024 * 1024,     self, "P2PMaxFrameSize" )
+        ConfigEntry.createProperty( self.section(), "task max frame size", 256 * 1024 * 1024,   self, "TaskMaxFrameSize" )
+        ConfigEntry.createProperty( self.section(), "use dht",             0,     self, "UseDht" )
+        ConfigEntry.createProperty( self.section(), "use lan discovery",   0,     self, "UseLanDiscovery" )
+        ConfigEntry.createProperty( self.section(), "lan discovery group", u"239.255.77.77", self, "LanDiscoveryGroup" )
+        ConfigEntry.createProperty( self.section(), "lan discovery port",  40100, self, "LanDiscoveryPort" )
+        ConfigEntry.createProperty( self.section(), "use peer cache",      1,     self, "UsePeerCache" )
+        ConfigEntry.createProperty( self.section(), "max upload rate",     0,     self, "MaxUploadRate" )
+        ConfigEntry.createProperty( self.section(), "max peer upload rate", 0,    self, "MaxPeerUploadRate" )
+        ConfigEntry.createProperty( self.section(), "capture file",        u"",   self, "CaptureFile" )
+        ConfigEntry.createProperty( self.section(), "capture max file size", 64 * 1024 * 1024, self, "CaptureMaxFileSize" )
+        ConfigEntry.createProperty( self.section(), "capture max files",   4,     self, "CaptureMaxFiles" )
 
     ##############################
     def section( self ):
@@ -138,6 +150,42 @@ class AppConfig:
     def getMaxResultsSendingDelay( self ):
         return self._cfg.getNodeConfig().getMaxResultsSendingDelay()
 
+    def getP2PMaxFrameSize( self ):
+        return self._cfg.getNodeConfig().getP2PMaxFrameSize()
+
+    def getTaskMaxFrameSize( self ):
+        return self._cfg.getNodeConfig().getTaskMaxFrameSize()
+
+    def getUseDht( self ):
+        return self._cfg.getNodeConfig().getUseDht()
+
+    def getUseLanDiscovery( self ):
+        return self._cfg.getNodeConfig().getUseLanDiscovery()
+
+    def getLanDiscoveryGroup( self ):
+        return self._cfg.getNodeConfig().getLanDiscoveryGroup()
+
+    def getLanDiscoveryPort( self ):
+        return self._cfg.getNodeConfig().getLanDiscoveryPort()
+
+    def getUsePeerCache( self ):
+        return self._cfg.getNodeConfig().getUsePeerCache()
+
+    def getMaxUploadRate( self ):
+        return self._cfg.getNodeConfig().getMaxUploadRate()
+
+    def getMaxPeerUploadRate( self ):
+        return self._cfg.getNodeConfig().getMaxPeerUploadRate()
+
+    def getCaptureFile( self ):
+        return self._cfg.getNodeConfig().getCaptureFile()
+
+    def getCaptureMaxFileSize( self ):
+        return self._cfg.getNodeConfig().getCaptureMaxFileSize()
+
+    def getCaptureMaxFiles( self ):
+        return self._cfg.getNodeConfig().getCaptureMaxFiles()
+
     def __str__( self ):
         return str( self._cfg )
 
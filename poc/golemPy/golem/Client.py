@@ -1,5 +1,3 @@
-from twisted.internet import task, reactor
-
 from P2PService import P2PService
 from TaskServer import TaskServer
 
@@ -7,6 +5,10 @@ from TaskBase import TaskHeader
 from ExampleTasks import VRayTracingTask
 
 from hostaddress import getHostAddress
+from timerqueue import TimerQueue
+from capturelog import CaptureLog
+from PeerCache import PeerCache
+from simpleenv import SimpleEnv
 
 from NodeStateSnapshot import NodeStateSnapshot
 from Message import MessagePeerStatus
@@ -19,16 +21,15 @@ import socket
 
 class Client:
 
+    MinTimerInterval    = 0.1   # zero intervals from config would spin
+
     ############################
     def __init__(self, configDesc ):
 
         self.configDesc     = configDesc
 
-        self.lastPingTime   = 0.0
-        self.p2service      = None
+        self.p2pservice     = None
         self.taskServer     = None
-        self.lastPingTime   = time.time()
-        self.lastNSSTime    = time.time()
 
         self.lastNodeStateSnapshot = None
 
@@ -36,51 +37,63 @@ class Client:
 
         self.nodesManagerClient = None
 
-        self.doWorkTask     = task.LoopingCall(self.__doWork)
-        self.doWorkTask.start(0.1, False)
-       
+        self.timers         = TimerQueue()
+
+        self.capture        = None
+
     ############################
     def startNetwork(self ):
         print "Starting network ..."
         print "Starting p2p server ..."
         self.p2pservice = P2PService( self.hostAddress, self.configDesc )
 
-        time.sleep( 1.0 )
-
         print "Starting task server ..."
         self.taskServer = TaskServer( self.hostAddress, self.configDesc )
 
         self.p2pservice.setTaskServer( self.taskServer )
 
-        time.sleep( 0.5 )
+        if self.configDesc.captureFile:
+            print "Capturing frames to {} ...".format( SimpleEnv.envFileName( self.configDesc.captureFile ) )
+            self.capture = CaptureLog( SimpleEnv.envFileName( self.configDesc.captureFile ), self.configDesc.captureMaxFileSize, self.configDesc.captureMaxFiles )
+            self.p2pservice.setCapture( self.capture )
+            self.taskServer.setCapture( self.capture )
+
+        if self.configDesc.usePeerCache:
+            self.p2pservice.setPeerCache( PeerCache( SimpleEnv.envFileName( "peers_{}.dat".format( self.configDesc.clientUid ) ) ) )
 
         print "Starting nodes manager client ..."
         self.nodesManagerClient = NodesManagerClient( self.configDesc.clientUid, "127.0.0.1", self.configDesc.managerPort, self.taskServer.taskManager )
         self.nodesManagerClient.start()
 
+        self.p2pservice.registerTimers( self.timers )
+        self.taskServer.registerTimers( self.timers )
+
+        if self.configDesc.sendPings:
+            self.timers.callEvery( max( self.MinTimerInterval, self.configDesc.pingsInterval ), self.__pingPeers )
+
+        self.timers.callEvery( max( self.MinTimerInterval, self.configDesc.nodeSnapshotInterval ), self.__makeNodeStateSnapshot )
+
         #self.taskServer.taskManager.addNewTask( )
 
     ############################
     def stopNetwork(self):
         #FIXME: Pewnie cos tu trzeba jeszcze dodac. Zamykanie serwera i wysylanie DisconnectPackege
-        self.p2pservice         = None
-        self.taskServer         = None
-        self.nodesManagerClient = None
+        self.timers.cancelAll()
 
-    ############################
-    def __doWork(self):
         if self.p2pservice:
-            if self.configDesc.sendPings:
-                self.p2pservice.pingPeers( self.pingsInterval )
+            self.p2pservice.stop()
 
-            self.p2pservice.syncNetwork()
-            self.taskServer.syncNetwork()
+        if self.capture:
+            self.capture.close()
+            self.capture = None
 
-            if time.time() - self.lastNSSTime > self.configDesc.nodeSnapshotInterval:
-                self.__makeNodeStateSnapshot()
-                self.lastNSSTime = time.time()
+        self.p2pservice         = None
+        self.taskServer         = None
+        self.nodesManagerClient = None
 
-                #self.managerServer.sendStateMessage( self.lastNodeStateSnapshot )
+    ############################
+    def __pingPeers( self ):
+        self.p2pservice.pingPeers( self.configDesc.pingsInterval )
 
     ############################
     def __makeNodeStateSnapshot( self, isRunning = True ):
@@ -102,7 +115,12 @@ class Client:
                                                            ,    lastNetworkMessages
                                                            ,    lastTaskMessages
                                                            ,    remoteTasksProgresses  
-                                                           ,    localTasksProgresses )
+                                                           ,    localTasksProgresses
+                                                           ,    self.p2pservice.getProtocolStats()
+                                                           ,    self.taskServer.getProtocolStats()
+                                                           ,    self.p2pservice.getPeersRtt()
+                                                           ,    self.taskServer.getOwnersRtt()
+                                                           ,    self.taskServer.getBandwidthStats() )
         else:
             self.lastNodeStateSnapshot = NodeStateSnapshot( self.configDesc.clientUid, peersNum )
 
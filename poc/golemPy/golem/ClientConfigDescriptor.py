@@ -23,3 +23,21 @@ class ClientConfigDescriptor:
         self.estimatedPerformance   = 0.0
         self.nodeSnapshotInterval   = 0.0
         self.maxResultsSendingDelay = 0.0
+
+        self.p2pMaxFrameSize        = 0
+        self.taskMaxFrameSize       = 0
+
+        self.useDht                 = 0
+
+        self.useLanDiscovery        = 0     # peers in local network are found with udp multicast
+        self.lanDiscoveryGroup      = u"239.255.77.77"
+        self.lanDiscoveryPort       = 40100
+
+        self.usePeerCache           = 0     # peers are saved to node data directory and dialed first after restart
+
+        self.maxUploadRate          = 0     # bytes per second of bulk task data, 0 - no limit
+        self.maxPeerUploadRate      = 0
+
+        self.captureFile            = u""   # frames of all sessions are captured to this file, empty - no capture
+        self.captureMaxFileSize     = 64 * 1024 * 1024
+        self.captureMaxFiles        = 4
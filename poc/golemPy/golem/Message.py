@@ -5,31 +5,77 @@ sys.path.append('core')
 import abc
 from simpleserializer import SimpleSerializer
 from databuffer import DataBuffer
+from binarycodec import MessageCodec, ListType, RecordType, LazyType, LazyValue, isBinaryFrame, peekMessageType, toBytes, CodecError, UINT, FLOAT, BYTES, TEXT, OBJECT
 
-class Message:
+import struct
+
+CODEC_PICKLE    = 0
+CODEC_BINARY    = 1
+
+class LazyField( object ):
+    """
+    Attribute stored in slot slotName which is decoded from LazyValue on first access
+    """
+
+    def __init__( self, slotName ):
+        self.slotName = slotName
+
+    def __get__( self, obj, cls ):
+        if obj is None:
+            return self
+
+        value = getattr( obj, self.slotName )
+        if isinstance( value, LazyValue ):
+            value = value.get()
+            setattr( obj, self.slotName, value )
+
+        return value
+
+    def __set__( self, obj, value ):
+        setattr( obj, self.slotName, value )
+
+class Message( object ):
+
+    __slots__ = [ "type" ]
 
     registeredMessageTypes = {}
+    registeredCodecs = {}
+
+    # Sequence of ( fieldId, dictRepr key, field type ) used by the binary codec.
+    # Messages with Schema set to None are always pickled
+    Schema = None
+
+    # Bulk messages are sent after control messages and within bandwidth limits of the connection
+    Bulk = False
 
     def __init__( self, type ):
         if type not in Message.registeredMessageTypes:
             Message.registeredMessageTypes[ type ] = self.__class__
+            if self.Schema is not None:
+                Message.registeredCodecs[ type ] = MessageCodec( type, self.Schema )
 
         self.type = type
-        self.serializer = DataBuffer()
 
     def getType( self ):
         return self.type
 
     def serializeWithHeader( self ):
-        self.serializeToBuffer(self.serializer)
-        return self.serializer.readAll()
+        db = DataBuffer()
+        self.serializeToBuffer( db )
+        return db.readAll()
+
+    def serialize( self, codec = CODEC_PICKLE ):
+        if codec == CODEC_BINARY and self.type in Message.registeredCodecs:
+            try:
+                return Message.registeredCodecs[ self.type ].encode( self.dictRepr() )
+            except ( TypeError, ValueError, KeyError, OverflowError, struct.error ):
+                pass # value does not fit the schema - fall back to pickle
 
-    def serialize( self ):
         return SimpleSerializer.dumps( [ self.type, self.dictRepr() ] )
 
-    def serializeToBuffer( self, db ):
+    def serializeToBuffer( self, db, codec = CODEC_PICKLE ):
         assert isinstance( db, DataBuffer )
-        db.appendLenPrefixedString( self.serialize() )
+        db.appendLenPrefixedString( self.serialize( codec ) )
 
     @classmethod
     def deserialize( cls, db ):
@@ -51,7 +97,10 @@ class Message:
   
     @classmethod
     def deserializeMessage( cls, msg ):
-        msgRepr = SimpleSerializer.loads( msg )
+        if isBinaryFrame( msg ):
+            return cls.deserializeBinaryMessage( msg )
+
+        msgRepr = SimpleSerializer.loads( toBytes( msg ) )
 
         msgType = msgRepr[ 0 ]
         dRepr   = msgRepr[ 1 ]
@@ -61,6 +110,19 @@ class Message:
 
         return None
 
+    @classmethod
+    def deserializeBinaryMessage( cls, msg ):
+        try:
+            msgType, pos = peekMessageType( msg )
+
+            if msgType in cls.registeredCodecs:
+                dRepr = cls.registeredCodecs[ msgType ].decode( msg, pos )
+                return cls.registeredMessageTypes[ msgType ]( dictRepr = dRepr )
+        except ( CodecError, IndexError, ValueError, struct.error ) as ex:
+            print "Failed to decode binary message: {}".format( ex )
+
+        return None
+
     @abc.abstractmethod
     def dictRepr(self):
         """
@@ -69,6 +131,21 @@ class Message:
         """
         return
 
+    # Slotted objects need explicit state to be pickled with protocols 0 and 1
+    # ( node snapshots keep last messages and are pickled that way )
+    def __getstate__( self ):
+        state = {}
+        for cls in self.__class__.__mro__:
+            for slot in getattr( cls, "__slots__", [] ):
+                if hasattr( self, slot ):
+                    value = getattr( self, slot )
+                    state[ slot ] = value.get() if isinstance( value, LazyValue ) else value
+        return state
+
+    def __setstate__( self, state ):
+        for slot, value in state.items():
+            setattr( self, slot, value )
+
     def __str__( self ):
         return "{}".format( self.__class__ )
 
@@ -81,18 +158,39 @@ class MessageHello(Message):
 
     Type = 0
 
+    __slots__ = [ "protoId", "clientVer", "port", "clientUID", "codecVersion", "compression", "maxFrameSize", "features" ]
+
     PROTO_ID_STR    = u"protoId"
     CLI_VER_STR     = u"clientVer"
     PORT_STR        = u"port"
     CLIENT_UID_STR  = u"clientUID"
 
-    def __init__( self, port = 0, clientUID = None, protoId = 0, cliVer = 0, dictRepr = None ):
+    # Capabilities - older nodes do not send them
+    CODEC_VER_STR       = u"codecVersion"
+    COMPRESSION_STR     = u"compression"
+    MAX_FRAME_SIZE_STR  = u"maxFrameSize"
+    FEATURES_STR        = u"features"
+
+    Schema = (  ( 1, PROTO_ID_STR,       UINT ),
+                ( 2, CLI_VER_STR,        UINT ),
+                ( 3, PORT_STR,           UINT ),
+                ( 4, CLIENT_UID_STR,     TEXT ),
+                ( 5, CODEC_VER_STR,      UINT ),
+                ( 6, COMPRESSION_STR,    ListType( TEXT ) ),
+                ( 7, MAX_FRAME_SIZE_STR, UINT ),
+                ( 8, FEATURES_STR,       ListType( TEXT ) ) )
+
+    def __init__( self, port = 0, clientUID = None, protoId = 0, cliVer = 0, codecVersion = 0, compression = [], maxFrameSize = 0, features = [], dictRepr = None ):
         Message.__init__( self, MessageHello.Type )
         
-        self.protoId    = protoId
-        self.clientVer  = cliVer
-        self.port       = port
-        self.clientUID  = clientUID
+        self.protoId        = protoId
+        self.clientVer      = cliVer
+        self.port           = port
+        self.clientUID      = clientUID
+        self.codecVersion   = codecVersion
+        self.compression    = compression
+        self.maxFrameSize   = maxFrameSize
+        self.features       = features
 
         if dictRepr:
             self.protoId    = dictRepr[ MessageHello.PROTO_ID_STR ]
@@ -100,19 +198,32 @@ class MessageHello(Message):
             self.port       = dictRepr[ MessageHello.PORT_STR ]
             self.clientUID  = dictRepr[ MessageHello.CLIENT_UID_STR ]
 
+            self.codecVersion   = dictRepr.get( MessageHello.CODEC_VER_STR ) or 0
+            self.compression    = dictRepr.get( MessageHello.COMPRESSION_STR ) or []
+            self.maxFrameSize   = dictRepr.get( MessageHello.MAX_FRAME_SIZE_STR ) or 0
+            self.features       = dictRepr.get( MessageHello.FEATURES_STR ) or []
+
     def dictRepr(self):
         return {    MessageHello.PROTO_ID_STR : self.protoId,
                     MessageHello.CLI_VER_STR : self.clientVer,
                     MessageHello.PORT_STR : self.port,
-                    MessageHello.CLIENT_UID_STR : self.clientUID
+                    MessageHello.CLIENT_UID_STR : self.clientUID,
+                    MessageHello.CODEC_VER_STR : self.codecVersion,
+                    MessageHello.COMPRESSION_STR : self.compression,
+                    MessageHello.MAX_FRAME_SIZE_STR : self.maxFrameSize,
+                    MessageHello.FEATURES_STR : self.features
                     }
 
 class MessagePing(Message):
 
     Type = 1
 
+    __slots__ = []
+
     PING_STR = u"PING"
 
+    Schema = ()
+
     def __init__( self, dictRepr = None ):
         Message.__init__(self, MessagePing.Type)
         
@@ -126,8 +237,12 @@ class MessagePong(Message):
 
     Type = 2
 
+    __slots__ = []
+
     PONG_STR = u"PONG"
 
+    Schema = ()
+
     def __init__( self, dictRepr = None ):
         Message.__init__(self, MessagePong.Type)
         
@@ -141,8 +256,12 @@ class MessageDisconnect(Message):
 
     Type = 3
 
+    __slots__ = [ "reason" ]
+
     DISCONNECT_REASON_STR = u"DISCONNECT_REASON"
 
+    Schema = ( ( 1, DISCONNECT_REASON_STR, TEXT ), )
+
     def __init__( self, reason = -1, dictRepr = None ):
         Message.__init__( self, MessageDisconnect.Type )
 
@@ -158,8 +277,12 @@ class MessageGetPeers( Message ):
 
     Type = 4
 
+    __slots__ = []
+
     GET_PEERS_STR = u"GET_PEERS"
 
+    Schema = ()
+
     def __init__( self, dictRepr = None ):
         Message.__init__(self, MessageGetPeers.Type)
         
@@ -173,8 +296,14 @@ class MessagePeers( Message ):
 
     Type = 5
 
+    __slots__ = [ "peersArray" ]
+
     PEERS_STR = u"PEERS"
 
+    Schema = ( ( 1, PEERS_STR, ListType( RecordType( (  ( 1, "address",    TEXT ),
+                                                        ( 2, "port",       UINT ),
+                                                        ( 3, "id",         TEXT ) ) ) ) ), )
+
     def __init__( self, peersArray = [], dictRepr = None ):
         Message.__init__(self, MessagePeers.Type)
         
@@ -190,8 +319,12 @@ class MessageGetTasks( Message ):
 
     Type = 6
 
+    __slots__ = []
+
     GET_TASTKS_STR = u"GET_TASKS"
 
+    Schema = ()
+
     def __init__( self, peersArray = [], dictRepr = None ):
         Message.__init__(self, MessageGetTasks.Type)
 
@@ -205,8 +338,16 @@ class MessageTasks( Message ):
 
     Type = 7
 
+    __slots__ = [ "tasksArray" ]
+
     TASKS_STR = u"TASKS"
 
+    Schema = ( ( 1, TASKS_STR, ListType( RecordType( (  ( 1, "id",         TEXT ),
+                                                        ( 2, "address",    TEXT ),
+                                                        ( 3, "port",       UINT ),
+                                                        ( 4, "ttl",        FLOAT ),
+                                                        ( 5, "clientId",   TEXT ) ) ) ) ), )
+
     def __init__( self, tasksArray = [], dictRepr = None ):
         Message.__init__(self, MessageTasks.Type)
         
@@ -218,41 +359,367 @@ class MessageTasks( Message ):
     def dictRepr(self):
         return { MessageTasks.TASKS_STR : self.tasksArray }
 
+class MessageGetTaskChanges( Message ):
+
+    Type = 8
+
+    __slots__ = [ "epoch", "sinceVersion", "knownTasks", "filterHashes", "filterSeed" ]
+
+    EPOCH_STR           = u"EPOCH"
+    SINCE_VERSION_STR   = u"SINCE_VERSION"
+    KNOWN_TASKS_STR     = u"KNOWN_TASKS"
+    FILTER_HASHES_STR   = u"FILTER_HASHES"
+    FILTER_SEED_STR     = u"FILTER_SEED"
+
+    Schema = (  ( 1, EPOCH_STR,         TEXT ),
+                ( 2, SINCE_VERSION_STR, UINT ),
+                ( 3, KNOWN_TASKS_STR,   BYTES ),
+                ( 4, FILTER_HASHES_STR, UINT ),
+                ( 5, FILTER_SEED_STR,   UINT ) )
+
+    # Asks for task headers added or removed since version of given epoch.
+    # knownTasks is optional bloom filter of task ids requester already has
+    def __init__( self, epoch = u"", sinceVersion = 0, knownTasks = None, filterHashes = 0, filterSeed = 0, dictRepr = None ):
+        Message.__init__( self, MessageGetTaskChanges.Type )
+
+        self.epoch          = epoch
+        self.sinceVersion   = sinceVersion
+        self.knownTasks     = knownTasks
+        self.filterHashes   = filterHashes
+        self.filterSeed     = filterSeed
+
+        if dictRepr:
+            self.epoch          = dictRepr[ MessageGetTaskChanges.EPOCH_STR ]
+            self.sinceVersion   = dictRepr[ MessageGetTaskChanges.SINCE_VERSION_STR ]
+            self.knownTasks     = dictRepr.get( MessageGetTaskChanges.KNOWN_TASKS_STR )
+            self.filterHashes   = dictRepr.get( MessageGetTaskChanges.FILTER_HASHES_STR ) or 0
+            self.filterSeed     = dictRepr.get( MessageGetTaskChanges.FILTER_SEED_STR ) or 0
+
+    def dictRepr(self):
+        return {    MessageGetTaskChanges.EPOCH_STR         : self.epoch,
+                    MessageGetTaskChanges.SINCE_VERSION_STR : self.sinceVersion,
+                    MessageGetTaskChanges.KNOWN_TASKS_STR   : self.knownTasks,
+                    MessageGetTaskChanges.FILTER_HASHES_STR : self.filterHashes,
+                    MessageGetTaskChanges.FILTER_SEED_STR   : self.filterSeed }
+
+class MessageTaskChanges( Message ):
+
+    Type = 9
+
+    __slots__ = [ "epoch", "version", "full", "tasksArray", "removed" ]
+
+    EPOCH_STR       = u"EPOCH"
+    VERSION_STR     = u"VERSION"
+    FULL_STR        = u"FULL"
+    TASKS_STR       = u"TASKS"
+    REMOVED_STR     = u"REMOVED"
+
+    Schema = (  ( 1, EPOCH_STR,     TEXT ),
+                ( 2, VERSION_STR,   UINT ),
+                ( 3, FULL_STR,      UINT ),
+                ( 4, TASKS_STR,     MessageTasks.Schema[ 0 ][ 2 ] ),
+                ( 5, REMOVED_STR,   ListType( TEXT ) ) )
+
+    def __init__( self, epoch = u"", version = 0, full = False, tasksArray = [], removed = [], dictRepr = None ):
+        Message.__init__( self, MessageTaskChanges.Type )
+
+        self.epoch      = epoch
+        self.version    = version
+        self.full       = full
+        self.tasksArray = tasksArray
+        self.removed    = removed
+
+        if dictRepr:
+            self.epoch      = dictRepr[ MessageTaskChanges.EPOCH_STR ]
+            self.version    = dictRepr[ MessageTaskChanges.VERSION_STR ]
+            self.full       = bool( dictRepr[ MessageTaskChanges.FULL_STR ] )
+            self.tasksArray = dictRepr[ MessageTaskChanges.TASKS_STR ]
+            self.removed    = dictRepr[ MessageTaskChanges.REMOVED_STR ]
+
+    def dictRepr(self):
+        return {    MessageTaskChanges.EPOCH_STR    : self.epoch,
+                    MessageTaskChanges.VERSION_STR  : self.version,
+                    MessageTaskChanges.FULL_STR     : int( self.full ),
+                    MessageTaskChanges.TASKS_STR    : self.tasksArray,
+                    MessageTaskChanges.REMOVED_STR  : self.removed }
+
+class MessageTaskAnnounce( Message ):
+
+    Type = 10
+
+    __slots__ = [ "taskHeader", "hops" ]
+
+    TASK_HEADER_STR = u"TASK_HEADER"
+    HOPS_STR        = u"HOPS"
+
+    Schema = (  ( 1, TASK_HEADER_STR,   MessageTasks.Schema[ 0 ][ 2 ].itemType ),
+                ( 2, HOPS_STR,          UINT ) )
+
+    # New task pushed by its owner, peers forward it while hops is above one
+    def __init__( self, taskHeader = {}, hops = 0, dictRepr = None ):
+        Message.__init__( self, MessageTaskAnnounce.Type )
+
+        self.taskHeader = taskHeader
+        self.hops       = hops
+
+        if dictRepr:
+            self.taskHeader = dictRepr[ MessageTaskAnnounce.TASK_HEADER_STR ]
+            self.hops       = dictRepr[ MessageTaskAnnounce.HOPS_STR ]
+
+    def dictRepr(self):
+        return {    MessageTaskAnnounce.TASK_HEADER_STR : self.taskHeader,
+                    MessageTaskAnnounce.HOPS_STR        : self.hops }
+
+DHT_CONTACT = RecordType( (    ( 1, "id",         TEXT ),
+                                ( 2, "address",    TEXT ),
+                                ( 3, "port",       UINT ) ) )
+
+class MessageDhtFindNode( Message ):
+
+    Type = 11
+
+    __slots__ = [ "requestId", "senderId", "senderPort", "target" ]
+
+    REQUEST_ID_STR  = u"REQUEST_ID"
+    SENDER_ID_STR   = u"SENDER_ID"
+    SENDER_PORT_STR = u"SENDER_PORT"
+    TARGET_STR      = u"TARGET"
+
+    Schema = (  ( 1, REQUEST_ID_STR,    UINT ),
+                ( 2, SENDER_ID_STR,     TEXT ),
+                ( 3, SENDER_PORT_STR,   UINT ),
+                ( 4, TARGET_STR,        TEXT ) )
+
+    # Asks for contacts closest to target ( hex of 160 bit overlay id )
+    def __init__( self, requestId = 0, senderId = u"", senderPort = 0, target = u"", dictRepr = None ):
+        Message.__init__( self, MessageDhtFindNode.Type )
+
+        self.requestId  = requestId
+        self.senderId   = senderId
+        self.senderPort = senderPort
+        self.target     = target
+
+        if dictRepr:
+            self.requestId  = dictRepr[ MessageDhtFindNode.REQUEST_ID_STR ]
+            self.senderId   = dictRepr[ MessageDhtFindNode.SENDER_ID_STR ]
+            self.senderPort = dictRepr[ MessageDhtFindNode.SENDER_PORT_STR ]
+            self.target     = dictRepr[ MessageDhtFindNode.TARGET_STR ]
+
+    def dictRepr(self):
+        return {    MessageDhtFindNode.REQUEST_ID_STR   : self.requestId,
+                    MessageDhtFindNode.SENDER_ID_STR    : self.senderId,
+                    MessageDhtFindNode.SENDER_PORT_STR  : self.senderPort,
+                    MessageDhtFindNode.TARGET_STR       : self.target }
+
+class MessageDhtFindTask( Message ):
+
+    Type = 12
+
+    __slots__ = [ "requestId", "senderId", "senderPort", "taskId" ]
+
+    REQUEST_ID_STR  = u"REQUEST_ID"
+    SENDER_ID_STR   = u"SENDER_ID"
+    SENDER_PORT_STR = u"SENDER_PORT"
+    TASK_ID_STR     = u"TASK_ID"
+
+    Schema = (  ( 1, REQUEST_ID_STR,    UINT ),
+                ( 2, SENDER_ID_STR,     TEXT ),
+                ( 3, SENDER_PORT_STR,   UINT ),
+                ( 4, TASK_ID_STR,       TEXT ) )
+
+    # Asks for stored header of task or contacts closest to its id
+    def __init__( self, requestId = 0, senderId = u"", senderPort = 0, taskId = u"", dictRepr = None ):
+        Message.__init__( self, MessageDhtFindTask.Type )
+
+        self.requestId  = requestId
+        self.senderId   = senderId
+        self.senderPort = senderPort
+        self.taskId     = taskId
+
+        if dictRepr:
+            self.requestId  = dictRepr[ MessageDhtFindTask.REQUEST_ID_STR ]
+            self.senderId   = dictRepr[ MessageDhtFindTask.SENDER_ID_STR ]
+            self.senderPort = dictRepr[ MessageDhtFindTask.SENDER_PORT_STR ]
+            self.taskId     = dictRepr[ MessageDhtFindTask.TASK_ID_STR ]
+
+    def dictRepr(self):
+        return {    MessageDhtFindTask.REQUEST_ID_STR   : self.requestId,
+                    MessageDhtFindTask.SENDER_ID_STR    : self.senderId,
+                    MessageDhtFindTask.SENDER_PORT_STR  : self.senderPort,
+                    MessageDhtFindTask.TASK_ID_STR      : self.taskId }
+
+class MessageDhtStoreTask( Message ):
+
+    Type = 13
+
+    __slots__ = [ "requestId", "senderId", "senderPort", "taskHeader" ]
+
+    REQUEST_ID_STR  = u"REQUEST_ID"
+    SENDER_ID_STR   = u"SENDER_ID"
+    SENDER_PORT_STR = u"SENDER_PORT"
+    TASK_HEADER_STR = u"TASK_HEADER"
+
+    Schema = (  ( 1, REQUEST_ID_STR,    UINT ),
+                ( 2, SENDER_ID_STR,     TEXT ),
+                ( 3, SENDER_PORT_STR,   UINT ),
+                ( 4, TASK_HEADER_STR,   MessageTasks.Schema[ 0 ][ 2 ].itemType ) )
+
+    def __init__( self, requestId = 0, senderId = u"", senderPort = 0, taskHeader = {}, dictRepr = None ):
+        Message.__init__( self, MessageDhtStoreTask.Type )
+
+        self.requestId  = requestId
+        self.senderId   = senderId
+        self.senderPort = senderPort
+        self.taskHeader = taskHeader
+
+        if dictRepr:
+            self.requestId  = dictRepr[ MessageDhtStoreTask.REQUEST_ID_STR ]
+            self.senderId   = dictRepr[ MessageDhtStoreTask.SENDER_ID_STR ]
+            self.senderPort = dictRepr[ MessageDhtStoreTask.SENDER_PORT_STR ]
+            self.taskHeader = dictRepr[ MessageDhtStoreTask.TASK_HEADER_STR ]
+
+    def dictRepr(self):
+        return {    MessageDhtStoreTask.REQUEST_ID_STR  : self.requestId,
+                    MessageDhtStoreTask.SENDER_ID_STR   : self.senderId,
+                    MessageDhtStoreTask.SENDER_PORT_STR : self.senderPort,
+                    MessageDhtStoreTask.TASK_HEADER_STR : self.taskHeader }
+
+class MessageDhtNodes( Message ):
+
+    Type = 14
+
+    __slots__ = [ "requestId", "nodes", "taskHeader" ]
+
+    REQUEST_ID_STR  = u"REQUEST_ID"
+    NODES_STR       = u"NODES"
+    TASK_HEADER_STR = u"TASK_HEADER"
+
+    Schema = (  ( 1, REQUEST_ID_STR,    UINT ),
+                ( 2, NODES_STR,         ListType( DHT_CONTACT ) ),
+                ( 3, TASK_HEADER_STR,   MessageTasks.Schema[ 0 ][ 2 ].itemType ) )
+
+    # Answer to all dht requests, taskHeader is set if MessageDhtFindTask found it
+    def __init__( self, requestId = 0, nodes = [], taskHeader = None, dictRepr = None ):
+        Message.__init__( self, MessageDhtNodes.Type )
+
+        self.requestId  = requestId
+        self.nodes      = nodes
+        self.taskHeader = taskHeader
+
+        if dictRepr:
+            self.requestId  = dictRepr[ MessageDhtNodes.REQUEST_ID_STR ]
+            self.nodes      = dictRepr[ MessageDhtNodes.NODES_STR ]
+            self.taskHeader = dictRepr.get( MessageDhtNodes.TASK_HEADER_STR )
+
+    def dictRepr(self):
+        return {    MessageDhtNodes.REQUEST_ID_STR  : self.requestId,
+                    MessageDhtNodes.NODES_STR       : self.nodes,
+                    MessageDhtNodes.TASK_HEADER_STR : self.taskHeader }
+
+class MessageLanAnnounce( Message ):
+
+    Type = 15
+
+    __slots__ = [ "clientUid", "p2pPort", "taskPort" ]
+
+    CLIENT_UID_STR  = u"CLIENT_UID"
+    P2P_PORT_STR    = u"P2P_PORT"
+    TASK_PORT_STR   = u"TASK_PORT"
+
+    Schema = (  ( 1, CLIENT_UID_STR,    TEXT ),
+                ( 2, P2P_PORT_STR,      UINT ),
+                ( 3, TASK_PORT_STR,     UINT ) )
+
+    # Multicast to local network by starting node, only binary codec is accepted from datagrams
+    def __init__( self, clientUid = u"", p2pPort = 0, taskPort = 0, dictRepr = None ):
+        Message.__init__( self, self.Type )
+
+        self.clientUid  = clientUid
+        self.p2pPort    = p2pPort
+        self.taskPort   = taskPort
+
+        if dictRepr:
+            self.clientUid  = dictRepr[ MessageLanAnnounce.CLIENT_UID_STR ]
+            self.p2pPort    = dictRepr[ MessageLanAnnounce.P2P_PORT_STR ]
+            self.taskPort   = dictRepr[ MessageLanAnnounce.TASK_PORT_STR ]
+
+    def dictRepr(self):
+        return {    MessageLanAnnounce.CLIENT_UID_STR   : self.clientUid,
+                    MessageLanAnnounce.P2P_PORT_STR     : self.p2pPort,
+                    MessageLanAnnounce.TASK_PORT_STR    : self.taskPort }
+
+class MessageLanReply( MessageLanAnnounce ):
+
+    Type = 16
+
+    __slots__ = []
+
+    # Sent directly to announcing node by some of the nodes which heard MessageLanAnnounce
+
 TASK_MSG_BASE = 2000
 
 class MessageWantToComputeTask( Message ):
 
     Type = TASK_MSG_BASE + 1
 
+    __slots__ = [ "taskId", "perfIndex", "requestId" ]
+
     TASK_ID_STR     = u"TASK_ID"
     PERF_INDEX_STR  = u"PERF_INDEX"
+    REQUEST_ID_STR  = u"REQUEST_ID"
 
-    def __init__( self, taskId = 0, perfIndex = 0, dictRepr = None ):
+    Schema = (  ( 1, TASK_ID_STR,    TEXT ),
+                ( 2, PERF_INDEX_STR, FLOAT ),
+                ( 3, REQUEST_ID_STR, UINT ) )
+
+    # requestId is sent back in MessageTaskToCompute or MessageCannotAssignTask
+    # so that many requests can wait for answers on one connection
+    def __init__( self, taskId = 0, perfIndex = 0, requestId = None, dictRepr = None ):
         Message.__init__(self, MessageWantToComputeTask.Type)
 
         self.taskId = taskId
         self.perfIndex = perfIndex
+        self.requestId = requestId
 
         if dictRepr:
             self.taskId     = dictRepr[ MessageWantToComputeTask.TASK_ID_STR ]
             self.perfIndex  = dictRepr[ MessageWantToComputeTask.PERF_INDEX_STR ]
+            self.requestId  = dictRepr.get( MessageWantToComputeTask.REQUEST_ID_STR )
 
     def dictRepr(self):
         return {    MessageWantToComputeTask.TASK_ID_STR : self.taskId,
-                    MessageWantToComputeTask.PERF_INDEX_STR: self.perfIndex }
+                    MessageWantToComputeTask.PERF_INDEX_STR: self.perfIndex,
+                    MessageWantToComputeTask.REQUEST_ID_STR: self.requestId }
 
 class MessageTaskToCompute( Message ):
 
     Type = TASK_MSG_BASE + 2
 
+    __slots__ = [ "subTaskId", "extraData", "shortDescr", "sourceCode", "returnAddress", "returnPort", "sourceCodeHash", "extraDataHashes", "requestId" ]
+
     SUB_TASK_ID_STR = u"SUB_TASK_ID"
     EXTRA_DATA_STR  = u"EXTRA_DATA"
     SHORT_DESCR_STR  = u"SHORT_DESCR"
     SOURCE_CODE_STR = u"SOURCE_CODE"
     RETURN_ADDRESS_STR = u"RETURN_ADDRESS"
     RETURN_PORT_STR = u"RETURN_PORT"
-
-    def __init__( self, subTaskId = 0, extraData = {}, shortDescr = "", sourceCode = "", returnAddress = "", returnPort = "", dictRepr = None ):
+    SOURCE_CODE_HASH_STR = u"SOURCE_CODE_HASH"
+    EXTRA_DATA_HASHES_STR = u"EXTRA_DATA_HASHES"
+    REQUEST_ID_STR = u"REQUEST_ID"
+
+    Schema = (  ( 1, SUB_TASK_ID_STR,    TEXT ),
+                ( 2, EXTRA_DATA_STR,     OBJECT ),
+                ( 3, SHORT_DESCR_STR,    TEXT ),
+                ( 4, SOURCE_CODE_STR,    BYTES ),
+                ( 5, RETURN_ADDRESS_STR, TEXT ),
+                ( 6, RETURN_PORT_STR,    UINT ),
+                ( 7, SOURCE_CODE_HASH_STR,  TEXT ),
+                ( 8, EXTRA_DATA_HASHES_STR, OBJECT ),
+                ( 9, REQUEST_ID_STR,        UINT ) )
+
+    # sourceCodeHash and extraDataHashes ( extraData key -> content hash ) are set when
+    # source code and large extraData values are sent by reference to the content cache
+    def __init__( self, subTaskId = 0, extraData = {}, shortDescr = "", sourceCode = "", returnAddress = "", returnPort = "", sourceCodeHash = None, extraDataHashes = {}, requestId = None, dictRepr = None ):
         Message.__init__(self, MessageTaskToCompute.Type)
 
         self.subTaskId = subTaskId
@@ -261,6 +728,9 @@ class MessageTaskToCompute( Message ):
         self.sourceCode = sourceCode
         self.returnAddress = returnAddress
         self.returnPort = returnPort
+        self.sourceCodeHash = sourceCodeHash
+        self.extraDataHashes = extraDataHashes
+        self.requestId = requestId
 
         if dictRepr:
             self.subTaskId  = dictRepr[ MessageTaskToCompute.SUB_TASK_ID_STR ]
@@ -269,6 +739,9 @@ class MessageTaskToCompute( Message ):
             self.sourceCode = dictRepr[ MessageTaskToCompute.SOURCE_CODE_STR ]
             self.returnAddress = dictRepr[ MessageTaskToCompute.RETURN_ADDRESS_STR ]
             self.returnPort = dictRepr[ MessageTaskToCompute.RETURN_PORT_STR ]
+            self.sourceCodeHash = dictRepr.get( MessageTaskToCompute.SOURCE_CODE_HASH_STR )
+            self.extraDataHashes = dictRepr.get( MessageTaskToCompute.EXTRA_DATA_HASHES_STR ) or {}
+            self.requestId = dictRepr.get( MessageTaskToCompute.REQUEST_ID_STR )
 
     def dictRepr(self):
         return {    MessageTaskToCompute.SUB_TASK_ID_STR: self.subTaskId,
@@ -276,35 +749,52 @@ class MessageTaskToCompute( Message ):
                     MessageTaskToCompute.SHORT_DESCR_STR : self.shortDescr,
                     MessageTaskToCompute.SOURCE_CODE_STR: self.sourceCode,
                     MessageTaskToCompute.RETURN_ADDRESS_STR: self.returnAddress,
-                    MessageTaskToCompute.RETURN_PORT_STR: self.returnPort }
+                    MessageTaskToCompute.RETURN_PORT_STR: self.returnPort,
+                    MessageTaskToCompute.SOURCE_CODE_HASH_STR: self.sourceCodeHash,
+                    MessageTaskToCompute.EXTRA_DATA_HASHES_STR: self.extraDataHashes or None,
+                    MessageTaskToCompute.REQUEST_ID_STR: self.requestId }
 
 class MessageCannotAssignTask( Message ):
     
     Type = TASK_MSG_BASE + 3
 
+    __slots__ = [ "taskId", "reason", "requestId" ]
+
     REASON_STR      = u"REASON"
     TASK_ID_STR     = u"TASK_ID"
+    REQUEST_ID_STR  = u"REQUEST_ID"
 
-    def __init__( self, taskId = 0, reason = "", dictRepr = None ):
+    Schema = (  ( 1, TASK_ID_STR,    TEXT ),
+                ( 2, REASON_STR,     TEXT ),
+                ( 3, REQUEST_ID_STR, UINT ) )
+
+    def __init__( self, taskId = 0, reason = "", requestId = None, dictRepr = None ):
         Message.__init__(self, MessageCannotAssignTask.Type)
 
         self.taskId = taskId
         self.reason = reason
+        self.requestId = requestId
 
         if dictRepr:
             self.taskId      = dictRepr[ MessageCannotAssignTask.TASK_ID_STR ]
             self.reason     = dictRepr[ MessageCannotAssignTask.REASON_STR ]
+            self.requestId  = dictRepr.get( MessageCannotAssignTask.REQUEST_ID_STR )
 
     def dictRepr(self):
         return {    MessageCannotAssignTask.TASK_ID_STR : self.taskId,
-                    MessageCannotAssignTask.REASON_STR: self.reason }
+                    MessageCannotAssignTask.REASON_STR: self.reason,
+                    MessageCannotAssignTask.REQUEST_ID_STR: self.requestId }
 
 class MessageReportComputedTask( Message ):
 
     Type = TASK_MSG_BASE + 4
 
+    __slots__ = [ "subTaskId" ]
+
     SUB_TASK_ID_STR = u"SUB_TASK_ID"
 
+    Schema = ( ( 1, SUB_TASK_ID_STR, TEXT ), )
+
     def __init__( self, subTaskId = 0, dictRepr = None ):
         Message.__init__(self, MessageReportComputedTask.Type)
 
@@ -320,9 +810,14 @@ class MessageGetTaskResult( Message ):
 
     Type = TASK_MSG_BASE + 5
 
+    __slots__ = [ "subTaskId", "delay" ]
+
     SUB_TASK_ID_STR = u"SUB_TASK_ID"
     DELAY_STR       = u"DELAY"
 
+    Schema = (  ( 1, SUB_TASK_ID_STR, TEXT ),
+                ( 2, DELAY_STR,       FLOAT ) )
+
     def __init__( self, subTaskId = 0, delay = 0.0, dictRepr = None ):
         Message.__init__(self, MessageGetTaskResult.Type)
 
@@ -340,10 +835,17 @@ class MessageGetTaskResult( Message ):
 class MessageTaskResult( Message ):
 
     Type = TASK_MSG_BASE + 6
+    Bulk = True
+
+    __slots__ = [ "subTaskId", "_result" ]
+    result = LazyField( "_result" )
 
     SUB_TASK_ID_STR = u"SUB_TASK_ID"
     RESULT_STR      = u"RESULT"
 
+    Schema = (  ( 1, SUB_TASK_ID_STR, TEXT ),
+                ( 2, RESULT_STR,      LazyType( OBJECT ) ) )
+
     def __init__( self, subTaskId = 0, result = None, dictRepr = None ):
         Message.__init__(self, MessageTaskResult.Type)
 
@@ -362,9 +864,14 @@ class MessageGetResource( Message ):
 
     Type = TASK_MSG_BASE + 8
 
+    __slots__ = [ "subTaskId", "resourceHeader" ]
+
     SUB_TASK_ID_STR     = u"SUB_TASK_ID"
     RESOURCE_HEADER_STR = u"RESOURCE_HEADER"
 
+    Schema = (  ( 1, SUB_TASK_ID_STR,     TEXT ),
+                ( 2, RESOURCE_HEADER_STR, BYTES ) )
+
     def __init__( self, subTaskId = 0, resourceHeader = None , dictRepr = None ):
         Message.__init__(self, MessageGetResource.Type)
 
@@ -384,9 +891,15 @@ class MessageResource( Message ):
 
     Type = TASK_MSG_BASE + 9
 
+    __slots__ = [ "subTaskId", "_resource" ]
+    resource = LazyField( "_resource" )
+
     SUB_TASK_ID_STR = u"SUB_TASK_ID"
     RESOURCE_STR    = u"RESOURCE"
 
+    Schema = (  ( 1, SUB_TASK_ID_STR, TEXT ),
+                ( 2, RESOURCE_STR,    LazyType( OBJECT ) ) )
+
     def __init__( self, subTaskId = 0, resource = None , dictRepr = None ):
         Message.__init__(self, MessageResource.Type)
 
@@ -402,6 +915,150 @@ class MessageResource( Message ):
                     MessageResource.RESOURCE_STR: self.resource
                }
 
+class MessageGetContent( Message ):
+
+    Type = TASK_MSG_BASE + 10
+
+    __slots__ = [ "hashes" ]
+
+    HASHES_STR = u"HASHES"
+
+    Schema = ( ( 1, HASHES_STR, ListType( TEXT ) ), )
+
+    def __init__( self, hashes = [], dictRepr = None ):
+        Message.__init__(self, MessageGetContent.Type)
+
+        self.hashes = hashes
+
+        if dictRepr:
+            self.hashes = dictRepr[ MessageGetContent.HASHES_STR ] or []
+
+    def dictRepr(self):
+        return { MessageGetContent.HASHES_STR : self.hashes }
+
+class MessageContent( Message ):
+
+    Type = TASK_MSG_BASE + 11
+    Bulk = True
+
+    __slots__ = [ "hash", "data" ]
+
+    HASH_STR = u"HASH"
+    DATA_STR = u"DATA"
+
+    Schema = (  ( 1, HASH_STR, TEXT ),
+                ( 2, DATA_STR, BYTES ) )
+
+    # data is None if the sender does not have the requested content any more
+    def __init__( self, hash = u"", data = None, dictRepr = None ):
+        Message.__init__(self, MessageContent.Type)
+
+        self.hash = hash
+        self.data = data
+
+        if dictRepr:
+            self.hash = dictRepr[ MessageContent.HASH_STR ]
+            self.data = dictRepr[ MessageContent.DATA_STR ]
+
+    def dictRepr(self):
+        return {    MessageContent.HASH_STR : self.hash,
+                    MessageContent.DATA_STR : self.data }
+
+class MessageStreamOpen( Message ):
+
+    Type = TASK_MSG_BASE + 12
+
+    __slots__ = [ "streamId", "kind", "size", "hash" ]
+
+    STREAM_ID_STR   = u"STREAM_ID"
+    KIND_STR        = u"KIND"
+    SIZE_STR        = u"SIZE"
+    HASH_STR        = u"HASH"
+
+    Schema = (  ( 1, STREAM_ID_STR, TEXT ),
+                ( 2, KIND_STR,      TEXT ),
+                ( 3, SIZE_STR,      UINT ),
+                ( 4, HASH_STR,      TEXT ) )
+
+    def __init__( self, streamId = u"", kind = u"", size = 0, hash = u"", dictRepr = None ):
+        Message.__init__(self, MessageStreamOpen.Type)
+
+        self.streamId   = streamId
+        self.kind       = kind
+        self.size       = size
+        self.hash       = hash
+
+        if dictRepr:
+            self.streamId   = dictRepr[ MessageStreamOpen.STREAM_ID_STR ]
+            self.kind       = dictRepr[ MessageStreamOpen.KIND_STR ]
+            self.size       = dictRepr[ MessageStreamOpen.SIZE_STR ]
+            self.hash       = dictRepr[ MessageStreamOpen.HASH_STR ]
+
+    def dictRepr(self):
+        return {    MessageStreamOpen.STREAM_ID_STR : self.streamId,
+                    MessageStreamOpen.KIND_STR      : self.kind,
+                    MessageStreamOpen.SIZE_STR      : self.size,
+                    MessageStreamOpen.HASH_STR      : self.hash }
+
+class MessageStreamChunk( Message ):
+
+    Type = TASK_MSG_BASE + 13
+    Bulk = True
+
+    __slots__ = [ "streamId", "offset", "data" ]
+
+    STREAM_ID_STR   = u"STREAM_ID"
+    OFFSET_STR      = u"OFFSET"
+    DATA_STR        = u"DATA"
+
+    Schema = (  ( 1, STREAM_ID_STR, TEXT ),
+                ( 2, OFFSET_STR,    UINT ),
+                ( 3, DATA_STR,      BYTES ) )
+
+    def __init__( self, streamId = u"", offset = 0, data = "", dictRepr = None ):
+        Message.__init__(self, MessageStreamChunk.Type)
+
+        self.streamId   = streamId
+        self.offset     = offset
+        self.data       = data
+
+        if dictRepr:
+            self.streamId   = dictRepr[ MessageStreamChunk.STREAM_ID_STR ]
+            self.offset     = dictRepr[ MessageStreamChunk.OFFSET_STR ]
+            self.data       = dictRepr[ MessageStreamChunk.DATA_STR ]
+
+    def dictRepr(self):
+        return {    MessageStreamChunk.STREAM_ID_STR    : self.streamId,
+                    MessageStreamChunk.OFFSET_STR       : self.offset,
+                    MessageStreamChunk.DATA_STR         : self.data }
+
+class MessageStreamAck( Message ):
+
+    Type = TASK_MSG_BASE + 14
+
+    __slots__ = [ "streamId", "offset" ]
+
+    STREAM_ID_STR   = u"STREAM_ID"
+    OFFSET_STR      = u"OFFSET"
+
+    Schema = (  ( 1, STREAM_ID_STR, TEXT ),
+                ( 2, OFFSET_STR,    UINT ) )
+
+    # offset is the number of bytes receiver has already stored
+    def __init__( self, streamId = u"", offset = 0, dictRepr = None ):
+        Message.__init__(self, MessageStreamAck.Type)
+
+        self.streamId   = streamId
+        self.offset     = offset
+
+        if dictRepr:
+            self.streamId   = dictRepr[ MessageStreamAck.STREAM_ID_STR ]
+            self.offset     = dictRepr[ MessageStreamAck.OFFSET_STR ]
+
+    def dictRepr(self):
+        return {    MessageStreamAck.STREAM_ID_STR  : self.streamId,
+                    MessageStreamAck.OFFSET_STR     : self.offset }
+
 
 
 MANAGER_MSG_BASE = 1000
@@ -410,9 +1067,14 @@ class MessagePeerStatus( Message ):
 
     Type = MANAGER_MSG_BASE + 1
 
+    __slots__ = [ "id", "data" ]
+
     ID_STR      = u"ID"
     DATA_STR    = u"DATA"
 
+    Schema = (  ( 1, ID_STR,   TEXT ),
+                ( 2, DATA_STR, BYTES ) )
+
     def __init__( self, id = "", data = "", dictRepr = None ):
         Message.__init__(self, MessagePeerStatus.Type)
 
@@ -432,8 +1094,13 @@ class MessagePeerStatus( Message ):
 class MessageNewTask( Message ):
     Type = MANAGER_MSG_BASE + 2
 
+    __slots__ = [ "_data" ]
+    data = LazyField( "_data" )
+
     DATA_STR    = u"DATA"
 
+    Schema = ( ( 1, DATA_STR, LazyType( BYTES ) ), )
+
     def __init__( self, data = "", dictRepr = None ):
         Message.__init__(self, MessageNewTask.Type)
 
@@ -451,8 +1118,12 @@ class MessageNewTask( Message ):
 class MessageKillNode( Message ):
     Type = MANAGER_MSG_BASE + 3
 
+    __slots__ = []
+
     KILL_STR    = u"KILL"
 
+    Schema = ()
+
     def __init__( self, dictRepr = None ):
         Message.__init__(self, MessageKillNode.Type)
 
@@ -472,6 +1143,15 @@ def initMessages():
     MessageGetTasks()
     MessagePeers()
     MessageTasks()
+    MessageGetTaskChanges()
+    MessageTaskChanges()
+    MessageTaskAnnounce()
+    MessageDhtFindNode()
+    MessageDhtFindTask()
+    MessageDhtStoreTask()
+    MessageDhtNodes()
+    MessageLanAnnounce()
+    MessageLanReply()
     MessageTaskToCompute()
     MessageWantToComputeTask()
     MessagePeerStatus()
@@ -482,33 +1162,44 @@ def initMessages():
     MessageReportComputedTask()
     MessageTaskResult()
     MessageGetTaskResult()
+    MessageGetContent()
+    MessageContent()
+    MessageStreamOpen()
+    MessageStreamChunk()
+    MessageStreamAck()
 
 
 if __name__ == "__main__":
 
-    hem = MessageHello( 1, 2 )
+    hem = MessageHello( 1, u"2" )
     pim = MessagePing()
     pom = MessagePong()
-    dcm = MessageDisconnect(3)
+    dcm = MessageDisconnect( u"3" )
+    tam = MessageTasks( [ { "id" : u"1234", "address" : "10.0.0.1", "port" : 40102, "ttl" : 100.0, "clientId" : u"abcd" } ] )
 
     print hem
     print pim
     print pom
     print dcm
 
-    db = DataBuffer()
-    db.appendLenPrefixedString( hem.serialize() )
-    db.appendLenPrefixedString( pim.serialize() )
-    db.appendLenPrefixedString( pom.serialize() )
-    db.appendLenPrefixedString( dcm.serialize() )
+    for msg in [ hem, pim, pom, dcm, tam ]:
+        print "{} pickle: {} bytes, binary: {} bytes".format( msg, len( msg.serialize( CODEC_PICKLE ) ), len( msg.serialize( CODEC_BINARY ) ) )
+
+    for codec in [ CODEC_PICKLE, CODEC_BINARY ]:
+        db = DataBuffer()
+        db.appendLenPrefixedString( hem.serialize( codec ) )
+        db.appendLenPrefixedString( pim.serialize( codec ) )
+        db.appendLenPrefixedString( pom.serialize( codec ) )
+        db.appendLenPrefixedString( dcm.serialize( codec ) )
+        db.appendLenPrefixedString( tam.serialize( codec ) )
 
-    print db.dataSize()
-    streamedData = db.readAll();
-    print len( streamedData )
+        print db.dataSize()
+        streamedData = db.readAll();
+        print len( streamedData )
 
-    db.appendString( streamedData )
+        db.appendString( streamedData )
 
-    messages = Message.deserialize( db )
+        messages = Message.deserialize( db )
 
-    for msg in messages:
-        print msg
+        for msg in messages:
+            print msg, msg.dictRepr()
@@ -1,6 +1,13 @@
 import cPickle
 import zlib
 
+# Compressed frame: COMPRESSED_FRAME_MAGIC | algorithm id | compressed frame
+COMPRESSED_FRAME_MAGIC = '\xc8'
+
+# Algorithms usable for frame compression, in order of preference
+FRAME_COMPRESSION_ALGORITHMS = [ u"zlib" ]
+FRAME_COMPRESSION_IDS = { u"zlib" : 1 }
+
 def save(object, filename, protocol = -1):
     """Save an object to a compressed disk file.
        Works well with huge objects.
@@ -25,6 +32,33 @@ def compress( data ):
 def decompress( data ):
     return zlib.decompress( data )
 
+def compressFrame( data, algorithm, level = 6 ):
+    """Returns compressed frame or None if compression does not pay off"""
+    assert algorithm in FRAME_COMPRESSION_IDS
+
+    compressed = zlib.compress( data, level )
+
+    if len( compressed ) + 2 >= len( data ):
+        return None
+
+    return "".join( [ COMPRESSED_FRAME_MAGIC, chr( FRAME_COMPRESSION_IDS[ algorithm ] ), compressed ] )
+
+def isCompressedFrame( data ):
+    return len( data ) > 1 and data[ 0 ] == COMPRESSED_FRAME_MAGIC
+
+def decompressFrame( data, maxSize ):
+    """Decompresses frame (str or memoryview), refuses to produce more than maxSize bytes"""
+    if ord( data[ 1 ] ) != FRAME_COMPRESSION_IDS[ u"zlib" ]:
+        raise ValueError( "Unknown frame compression algorithm {}".format( ord( data[ 1 ] ) ) )
+
+    d = zlib.decompressobj()
+    ret = d.decompress( data[ 2: ].tobytes() if isinstance( data, memoryview ) else data[ 2: ], maxSize )
+
+    if d.unconsumed_tail:
+        raise ValueError( "Decompressed frame exceeds {} bytes".format( maxSize ) )
+
+    return ret
+
 if __name__ == "__main__":
     def main():
         c = compress( "12334231234434123452341234" )
@@ -0,0 +1,334 @@
+import struct
+import cPickle as pickle
+
+# Binary frames start with this byte. Pickled frames start with '(' (protocol 0)
+# or '\x80' (protocol 2) so both encodings can be told apart on the receiving side
+BINARY_MAGIC = '\xc7'
+
+WIRE_VARINT     = 0
+WIRE_FIXED64    = 1
+WIRE_BYTES      = 2
+
+_double = struct.Struct( "<d" )
+
+MAX_VARINT_SIZE = 10
+
+class CodecError( Exception ):
+    pass
+
+############################
+def toBytes( data ):
+    if isinstance( data, str ):
+        return data
+    return data.tobytes()
+
+############################
+def encodeVarint( out, num ):
+    if num < 0:
+        raise ValueError( "Negative value {} cannot be encoded as varint".format( num ) )
+    if num >> 64:
+        raise ValueError( "Value {} does not fit 64 bits".format( num ) )
+
+    while num > 0x7f:
+        out.append( chr( ( num & 0x7f ) | 0x80 ) )
+        num >>= 7
+    out.append( chr( num ) )
+
+############################
+def decodeVarint( data, pos ):
+    result = 0
+    shift = 0
+
+    # 64 bit value takes at most 10 bytes, crafted frame must not build huge longs
+    for i in range( MAX_VARINT_SIZE ):
+        b = ord( data[ pos ] )
+        pos += 1
+        result |= ( b & 0x7f ) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+    raise CodecError( "Varint longer than {} bytes".format( MAX_VARINT_SIZE ) )
+
+############################
+def encodeLenPrefixed( out, data ):
+    encodeVarint( out, len( data ) )
+    out.append( data )
+
+############################
+def decodeLenPrefixed( data, pos ):
+    size, pos = decodeVarint( data, pos )
+    end = pos + size
+    if end > len( data ):
+        raise CodecError( "Truncated field" )
+    return data[ pos:end ], end
+
+##############################
+##############################
+class UIntType:
+    wireType = WIRE_VARINT
+
+    def encode( self, out, value ):
+        if not isinstance( value, ( int, long ) ):
+            raise TypeError( "Expected integer, got {}".format( type( value ) ) )
+        encodeVarint( out, value )
+
+    def decode( self, data, pos ):
+        return decodeVarint( data, pos )
+
+class SIntType:
+    wireType = WIRE_VARINT
+
+    def encode( self, out, value ):
+        if not isinstance( value, ( int, long ) ):
+            raise TypeError( "Expected integer, got {}".format( type( value ) ) )
+        encodeVarint( out, ( value << 1 ) if value >= 0 else ( ( -value << 1 ) - 1 ) )
+
+    def decode( self, data, pos ):
+        num, pos = decodeVarint( data, pos )
+        return ( num >> 1 ) if not num & 1 else -( ( num + 1 ) >> 1 ), pos
+
+class BoolType:
+    wireType = WIRE_VARINT
+
+    def encode( self, out, value ):
+        out.append( '\x01' if value else '\x00' )
+
+    def decode( self, data, pos ):
+        num, pos = decodeVarint( data, pos )
+        return bool( num ), pos
+
+class FloatType:
+    wireType = WIRE_FIXED64
+
+    def encode( self, out, value ):
+        if not isinstance( value, ( int, long, float ) ):
+            raise TypeError( "Expected number, got {}".format( type( value ) ) )
+        out.append( _double.pack( value ) )
+
+    def decode( self, data, pos ):
+        ( value, ) = _double.unpack_from( data, pos )
+        return value, pos + 8
+
+class BytesType:
+    wireType = WIRE_BYTES
+
+    def encode( self, out, value ):
+        if not isinstance( value, str ):
+            raise TypeError( "Expected str, got {}".format( type( value ) ) )
+        encodeLenPrefixed( out, value )
+
+    def decode( self, data, pos ):
+        value, pos = decodeLenPrefixed( data, pos )
+        return self.decodeBody( value ), pos
+
+    def decodeBody( self, body ):
+        return toBytes( body )
+
+class TextType:
+    wireType = WIRE_BYTES
+
+    def encode( self, out, value ):
+        if isinstance( value, unicode ):
+            value = value.encode( "utf-8" )
+        elif isinstance( value, str ):
+            value.decode( "utf-8" ) # raises UnicodeDecodeError (a ValueError) for binary data
+        else:
+            raise TypeError( "Expected text, got {}".format( type( value ) ) )
+        encodeLenPrefixed( out, value )
+
+    def decode( self, data, pos ):
+        value, pos = decodeLenPrefixed( data, pos )
+        return toBytes( value ).decode( "utf-8" ), pos
+
+class ObjectType:
+    """
+    Arbitrary python object - pickled, so use it only for values without a fixed structure
+    """
+    wireType = WIRE_BYTES
+
+    def encode( self, out, value ):
+        encodeLenPrefixed( out, pickle.dumps( value, pickle.HIGHEST_PROTOCOL ) )
+
+    def decode( self, data, pos ):
+        value, pos = decodeLenPrefixed( data, pos )
+        return self.decodeBody( value ), pos
+
+    def decodeBody( self, body ):
+        return pickle.loads( toBytes( body ) )
+
+class LazyValue:
+    """
+    Encoded field body kept as a view of the received frame until it is needed
+    """
+    __slots__ = [ "fieldType", "body" ]
+
+    def __init__( self, fieldType, body ):
+        self.fieldType  = fieldType
+        self.body       = body
+
+    def get( self ):
+        return self.fieldType.decodeBody( self.body )
+
+class LazyType:
+    """
+    Wraps BYTES or OBJECT field so that decoding returns LazyValue instead of
+    the value itself
+    """
+    wireType = WIRE_BYTES
+
+    def __init__( self, fieldType ):
+        assert fieldType.wireType == WIRE_BYTES
+        self.fieldType = fieldType
+
+    def encode( self, out, value ):
+        self.fieldType.encode( out, value )
+
+    def decode( self, data, pos ):
+        body, pos = decodeLenPrefixed( data, pos )
+        return LazyValue( self.fieldType, body ), pos
+
+class ListType:
+    wireType = WIRE_BYTES
+
+    def __init__( self, itemType ):
+        self.itemType = itemType
+
+    def encode( self, out, value ):
+        if not isinstance( value, ( list, tuple ) ):
+            raise TypeError( "Expected list, got {}".format( type( value ) ) )
+        items = []
+        for v in value:
+            self.itemType.encode( items, v )
+        encodeLenPrefixed( out, "".join( items ) )
+
+    def decode( self, data, pos ):
+        body, pos = decodeLenPrefixed( data, pos )
+        ret = []
+        itemPos = 0
+        while itemPos < len( body ):
+            v, itemPos = self.itemType.decode( body, itemPos )
+            ret.append( v )
+        return ret, pos
+
+class RecordType:
+    """
+    Dictionary with a fixed set of keys described by schema - a sequence
+    of ( fieldId, key, fieldType ) tuples. Each present field is written as
+    varint key ( fieldId << 2 | wireType ) followed by the value, None values
+    are skipped. Unknown field ids are skipped on decoding.
+    """
+    wireType = WIRE_BYTES
+
+    def __init__( self, schema ):
+        self.schema = tuple( schema )
+        self.fields = {}
+
+        for fieldId, key, fieldType in self.schema:
+            assert fieldId > 0 and fieldId not in self.fields
+            self.fields[ fieldId ] = ( key, fieldType )
+
+    def encodeFields( self, out, value ):
+        for fieldId, key, fieldType in self.schema:
+            v = value[ key ]
+            if v is not None:
+                encodeVarint( out, ( fieldId << 2 ) | fieldType.wireType )
+                fieldType.encode( out, v )
+
+    def decodeFields( self, data, pos, end ):
+        ret = dict.fromkeys( [ key for _, key, _ in self.schema ] )
+
+        while pos < end:
+            tag, pos = decodeVarint( data, pos )
+            fieldId = tag >> 2
+
+            if fieldId in self.fields:
+                key, fieldType = self.fields[ fieldId ]
+                ret[ key ], pos = fieldType.decode( data, pos )
+            else:
+                pos = skipField( data, pos, tag & 3 )
+
+        if pos != end:
+            raise CodecError( "Truncated record" )
+
+        return ret
+
+    def encode( self, out, value ):
+        if not isinstance( value, dict ):
+            raise TypeError( "Expected dict, got {}".format( type( value ) ) )
+        fields = []
+        self.encodeFields( fields, value )
+        encodeLenPrefixed( out, "".join( fields ) )
+
+    def decode( self, data, pos ):
+        size, pos = decodeVarint( data, pos )
+        return self.decodeFields( data, pos, pos + size ), pos + size
+
+############################
+def skipField( data, pos, wireType ):
+    if wireType == WIRE_VARINT:
+        _, pos = decodeVarint( data, pos )
+        return pos
+    elif wireType == WIRE_FIXED64:
+        return pos + 8
+    elif wireType == WIRE_BYTES:
+        _, pos = decodeLenPrefixed( data, pos )
+        return pos
+
+    raise CodecError( "Unknown wire type {}".format( wireType ) )
+
+UINT    = UIntType()
+SINT    = SIntType()
+BOOL    = BoolType()
+FLOAT   = FloatType()
+BYTES   = BytesType()
+TEXT    = TextType()
+OBJECT  = ObjectType()
+
+##############################
+##############################
+class MessageCodec:
+    """
+    Encoder/decoder for one message type generated from its schema.
+    Frame layout: BINARY_MAGIC | varint message type | record fields
+    """
+
+    def __init__( self, msgType, schema ):
+        self.msgType = msgType
+        self.record = RecordType( schema )
+
+        header = [ BINARY_MAGIC ]
+        encodeVarint( header, msgType )
+        self.header = "".join( header )
+
+    def encode( self, dictRepr ):
+        out = [ self.header ]
+        if self.record.schema:
+            self.record.encodeFields( out, dictRepr )
+        return "".join( out )
+
+    def decode( self, data, pos ):
+        return self.record.decodeFields( data, pos, len( data ) )
+
+############################
+def isBinaryFrame( data ):
+    return len( data ) > 0 and data[ 0 ] == BINARY_MAGIC
+
+############################
+def peekMessageType( data ):
+    """Returns ( msgType, offset of first field ) of binary frame"""
+    return decodeVarint( data, 1 )
+
+if __name__ == "__main__":
+
+    schema = [ ( 1, "id", TEXT ), ( 2, "port", UINT ), ( 3, "ttl", FLOAT ), ( 4, "data", OBJECT ), ( 5, "peers", ListType( RecordType( [ ( 1, "address", TEXT ), ( 2, "port", UINT ) ] ) ) ) ]
+    codec = MessageCodec( 7, schema )
+
+    val = { "id" : u"some id", "port" : 40102, "ttl" : 12.5, "data" : { "x" : [ 1, 2 ] }, "peers" : [ { "address" : "10.0.0.1", "port" : 1 }, { "address" : "10.0.0.2", "port" : None } ] }
+    data = codec.encode( val )
+
+    print "Encoded {} bytes, pickle takes {} bytes".format( len( data ), len( pickle.dumps( val ) ) )
+
+    msgType, pos = peekMessageType( memoryview( data ) )
+    print msgType
+    print codec.decode( memoryview( data ), pos )
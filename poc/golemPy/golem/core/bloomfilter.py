@@ -0,0 +1,71 @@
+import hashlib
+import math
+import struct
+
+class BloomFilter:
+    """
+    Compact set digest. Membership test may give false positives with rate
+    close to the one the filter was sized for, but never false negatives.
+    Positions of bits depend on seed, so filters sent with different seeds
+    give different false positives.
+    """
+
+    ############################
+    def __init__( self, numBits, numHashes, seed = 0, bits = None ):
+        self.numBits    = max( 8, numBits )
+        self.numHashes  = max( 1, numHashes )
+        self.seed       = seed
+        self.bits       = bytearray( bits ) if bits is not None else bytearray( ( self.numBits + 7 ) // 8 )
+
+        self.numBits    = len( self.bits ) * 8
+
+    ############################
+    @classmethod
+    def forCapacity( cls, capacity, errorRate = 0.01, seed = 0 ):
+        capacity = max( 1, capacity )
+        numBits = int( math.ceil( -capacity * math.log( errorRate ) / ( math.log( 2 ) ** 2 ) ) )
+        numHashes = int( round( float( numBits ) / capacity * math.log( 2 ) ) )
+        return cls( numBits, numHashes, seed )
+
+    ############################
+    @classmethod
+    def fromBytes( cls, data, numHashes, seed ):
+        return cls( len( data ) * 8, numHashes, seed, data )
+
+    ############################
+    def add( self, key ):
+        for pos in self.__positions( key ):
+            self.bits[ pos >> 3 ] |= 1 << ( pos & 7 )
+
+    ############################
+    def __contains__( self, key ):
+        for pos in self.__positions( key ):
+            if not self.bits[ pos >> 3 ] & ( 1 << ( pos & 7 ) ):
+                return False
+        return True
+
+    ############################
+    def toBytes( self ):
+        return str( self.bits )
+
+    ############################
+    def __positions( self, key ):
+        # double hashing - numHashes positions from two halves of one digest
+        if isinstance( key, unicode ):
+            key = key.encode( "utf-8" )
+
+        h1, h2 = struct.unpack( "!QQ", hashlib.md5( struct.pack( "!L", self.seed ) + key ).digest() )
+        return [ ( h1 + i * h2 ) % self.numBits for i in range( self.numHashes ) ]
+
+if __name__ == "__main__":
+
+    bf = BloomFilter.forCapacity( 1000, 0.01, 7 )
+
+    for i in range( 1000 ):
+        bf.add( "task{}".format( i ) )
+
+    falsePositives = len( [ i for i in range( 1000, 11000 ) if "task{}".format( i ) in bf ] )
+    copy = BloomFilter.fromBytes( bf.toBytes(), bf.numHashes, bf.seed )
+
+    print "{} bytes, {} hashes, false positive rate {}".format( len( bf.toBytes() ), bf.numHashes, falsePositives / 10000.0 )
+    print all( "task{}".format( i ) in copy for i in range( 1000 ) )
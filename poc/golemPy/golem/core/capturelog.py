@@ -0,0 +1,175 @@
+import os
+import struct
+import time
+
+RECORD_OPEN     = 0     # payload "kind address port"
+RECORD_IN       = 1     # payload is received frame without length prefix
+RECORD_OUT      = 2     # payload is sent frame without length prefix
+RECORD_CLOSE    = 3
+RECORD_CONTINUE = 4     # open record of live session repeated at the beginning of rotated file
+
+CAPTURE_MAGIC   = "GCAP\x01"
+RECORD_HEADER   = struct.Struct( "!BdII" )  # type, timestamp, session id, payload size
+
+class CaptureLog:
+    """
+    Appends timestamped frames of many sessions to a binary file. When the
+    file grows over maxFileSize it is renamed to fileName.1 ( older ones to
+    .2, .3 ... ) and at most maxFiles files are kept, so capture never takes
+    more than about maxFileSize * maxFiles bytes. Live sessions are repeated
+    at the beginning of every file, so each file can be read alone.
+    """
+
+    ############################
+    def __init__( self, fileName, maxFileSize = 64 * 1024 * 1024, maxFiles = 4 ):
+        self.fileName       = fileName
+        self.maxFileSize    = maxFileSize
+        self.maxFiles       = max( 1, maxFiles )
+        self.sessions       = {}    # id -> open record payload of live session
+        self.nextId         = 1
+        self.file           = None
+        self.size           = 0
+
+        # every run starts with a new file
+        if os.path.exists( self.fileName ):
+            self.__rotate()
+        else:
+            self.__open()
+
+    ############################
+    def sessionOpened( self, kind, address, port ):
+        sessionId = self.nextId
+        self.nextId += 1
+
+        self.sessions[ sessionId ] = "{} {} {}".format( kind, address, port )
+        self.__write( RECORD_OPEN, sessionId, self.sessions[ sessionId ] )
+
+        return sessionId
+
+    ############################
+    def frame( self, sessionId, incoming, data ):
+        if isinstance( data, memoryview ):
+            data = data.tobytes()
+
+        self.__write( RECORD_IN if incoming else RECORD_OUT, sessionId, data )
+
+    ############################
+    def sessionClosed( self, sessionId ):
+        if self.sessions.pop( sessionId, None ) is not None:
+            self.__write( RECORD_CLOSE, sessionId, "" )
+
+    ############################
+    def flush( self ):
+        if self.file:
+            self.file.flush()
+
+    ############################
+    def close( self ):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    ############################
+    def __write( self, recordType, sessionId, payload ):
+        if not self.file:
+            return
+
+        if self.size + RECORD_HEADER.size + len( payload ) > self.maxFileSize and self.size > len( CAPTURE_MAGIC ):
+            self.__rotate()
+
+        self.file.write( RECORD_HEADER.pack( recordType, time.time(), sessionId, len( payload ) ) )
+        self.file.write( payload )
+        self.size += RECORD_HEADER.size + len( payload )
+
+    ############################
+    def __rotate( self ):
+        self.close()
+
+        for i in range( self.maxFiles - 1, 0, -1 ):
+            src = self.fileName if i == 1 else "{}.{}".format( self.fileName, i - 1 )
+            if os.path.exists( src ):
+                os.rename( src, "{}.{}".format( self.fileName, i ) )
+
+        if os.path.exists( self.fileName ):
+            os.remove( self.fileName )  # only when maxFiles is 1
+
+        self.__open()
+
+        for sessionId, payload in sorted( self.sessions.items() ):
+            self.__write( RECORD_CONTINUE, sessionId, payload )
+
+    ############################
+    def __open( self ):
+        self.file = open( self.fileName, "wb" )
+        self.file.write( CAPTURE_MAGIC )
+        self.size = len( CAPTURE_MAGIC )
+
+############################
+def captureFiles( fileName ):
+    """Files of capture from the oldest to the newest one"""
+    files = []
+    i = 1
+    while os.path.exists( "{}.{}".format( fileName, i ) ):
+        files.insert( 0, "{}.{}".format( fileName, i ) )
+        i += 1
+
+    if os.path.exists( fileName ):
+        files.append( fileName )
+
+    return files
+
+############################
+def readCapture( fileName ):
+    """
+    Yields ( type, timestamp, session id, payload ) records of capture from
+    the oldest file. Sessions opened by a new run are reported as
+    RECORD_OPEN, continuation of a session from previous file is skipped.
+    Truncated record at the end of file ( node crashed ) ends that file.
+    """
+    live = set()
+
+    for name in captureFiles( fileName ):
+        with open( name, "rb" ) as f:
+            if f.read( len( CAPTURE_MAGIC ) ) != CAPTURE_MAGIC:
+                print "{} is not a capture file".format( name )
+                continue
+
+            while True:
+                header = f.read( RECORD_HEADER.size )
+                if len( header ) < RECORD_HEADER.size:
+                    break
+
+                recordType, timestamp, sessionId, size = RECORD_HEADER.unpack( header )
+                payload = f.read( size )
+                if len( payload ) < size:
+                    break
+
+                if recordType == RECORD_CONTINUE:
+                    if sessionId in live:
+                        continue
+                    recordType = RECORD_OPEN
+
+                if recordType == RECORD_OPEN:
+                    live.add( sessionId )
+                elif recordType == RECORD_CLOSE:
+                    live.discard( sessionId )
+
+                yield recordType, timestamp, sessionId, payload
+
+if __name__ == "__main__":
+    import tempfile
+    import shutil
+
+    d = tempfile.mkdtemp()
+    log = CaptureLog( os.path.join( d, "capture" ), 4096, 3 )
+
+    s = log.sessionOpened( "p2p", "127.0.0.1", 40102 )
+    for i in range( 100 ):
+        log.frame( s, i % 2 == 0, "frame {}".format( i ) * 20 )
+    log.sessionClosed( s )
+    log.close()
+
+    records = list( readCapture( os.path.join( d, "capture" ) ) )
+    print "{} files, {} records kept, first kept frame: {}".format( len( captureFiles( os.path.join( d, "capture" ) ) ), len( records ), records[ 1 ][ 3 ][ :8 ] )
+
+    shutil.rmtree( d )
@@ -0,0 +1,90 @@
+from collections import OrderedDict
+import cPickle as pickle
+
+from simplehash import SimpleHash
+
+class ContentCache:
+    """
+    Bounded, content addressed store of immutable blobs. Entries are keyed
+    by hex sha1 of their data and the least recently used ones are evicted
+    once the total size exceeds maxBytes.
+    """
+
+    ############################
+    def __init__( self, maxBytes ):
+        self.maxBytes   = maxBytes
+        self.curBytes   = 0
+        self.entries    = OrderedDict()
+
+    ############################
+    def put( self, data ):
+        h = SimpleHash.hash_hex( data )
+        self.__store( h, data )
+        return h
+
+    ############################
+    def putWithHash( self, h, data ):
+        """Stores data received from other node, returns False if it does not match its hash"""
+        if SimpleHash.hash_hex( data ) != h:
+            return False
+
+        self.__store( h, data )
+        return True
+
+    ############################
+    def get( self, h ):
+        data = self.entries.pop( h, None )
+
+        if data is not None:
+            self.entries[ h ] = data # mark as recently used
+
+        return data
+
+    ############################
+    def has( self, h ):
+        return h in self.entries
+
+    ############################
+    def missing( self, hashes ):
+        return [ h for h in hashes if h not in self.entries ]
+
+    ############################
+    def size( self ):
+        return self.curBytes
+
+    ############################
+    def __store( self, h, data ):
+        if h in self.entries:
+            self.get( h )
+            return
+
+        if len( data ) > self.maxBytes:
+            return
+
+        self.entries[ h ] = data
+        self.curBytes += len( data )
+
+        while self.curBytes > self.maxBytes:
+            _, evicted = self.entries.popitem( last = False )
+            self.curBytes -= len( evicted )
+
+############################
+def packContent( value ):
+    return pickle.dumps( value, pickle.HIGHEST_PROTOCOL )
+
+############################
+def unpackContent( data ):
+    return pickle.loads( data )
+
+if __name__ == "__main__":
+
+    cc = ContentCache( 30 )
+
+    h1 = cc.put( "a" * 10 )
+    h2 = cc.put( "b" * 10 )
+    cc.get( h1 )
+    h3 = cc.put( "c" * 15 )
+
+    print "Size {} has h1: {} has h2: {} has h3: {}".format( cc.size(), cc.has( h1 ), cc.has( h2 ), cc.has( h3 ) )
+    print cc.missing( [ h1, h2, h3 ] ) == [ h2 ]
+    print cc.putWithHash( h2, "not b" )
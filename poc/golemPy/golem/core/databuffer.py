@@ -2,47 +2,70 @@ import struct
 
 class DataBuffer:
 
+    # Consumed bytes are dropped from the front of the buffer only when at
+    # least that many of them have accumulated and they make up at least half
+    # of the buffer, so the total compaction cost stays linear
+    COMPACT_THRESHOLD = 64 * 1024
+
     def __init__( self ):
-        self.bufferedData = ""
+        self.bufferedData = bytearray()
+        self.readPos = 0
    
     def appendUInt( self, num ):
         assert num >= 0
         strNumRep = struct.pack( "!L", num )
-        self.bufferedData = "".join( [ self.bufferedData, strNumRep ] )
+        self.appendString( strNumRep )
 
     def appendString( self, data ):
-        self.bufferedData = "".join( [ self.bufferedData, data ] )
+        try:
+            self.bufferedData.extend( data )
+        except BufferError:
+            # some views handed out by readView are still alive - leave the old buffer to them
+            self.__reallocate()
+            self.bufferedData.extend( data )
 
     def dataSize( self ):
-        return len( self.bufferedData )
+        return len( self.bufferedData ) - self.readPos
 
     def peekUInt( self ):
-        assert len( self.bufferedData ) >= 4
+        assert self.dataSize() >= 4
 
-        (retVal,) = struct.unpack( "!L", self.bufferedData[0:4] )
+        (retVal,) = struct.unpack_from( "!L", self.bufferedData, self.readPos )
         return retVal
 
     def readUInt( self ):
         val = self.peekUInt()
-        self.bufferedData = self.bufferedData[4:]
+        self.__consume( 4 )
 
         return val
 
-    def peekString( self, numChars ):
-        assert numChars <= len( self.bufferedData )
+    def peekView( self, numChars ):
+        assert numChars <= self.dataSize()
 
-        retStr = self.bufferedData[:numChars]
-        return retStr
+        return memoryview( self.bufferedData )[ self.readPos : self.readPos + numChars ]
+
+    def readView( self, numChars ):
+        """
+        Returns zero-copy view of next numChars bytes. The view stays valid
+        after further appends and reads.
+        """
+        val = self.peekView( numChars )
+        self.__consume( numChars )
+
+        return val
+
+    def peekString( self, numChars ):
+        return self.peekView( numChars ).tobytes()
 
     def readString( self, numChars ):
         val = self.peekString( numChars )
-        self.bufferedData = self.bufferedData[numChars:]
+        self.__consume( numChars )
 
         return val
         
     def readAll( self ):
-        retData = self.bufferedData
-        self.bufferedData = ""
+        retData = self.peekString( self.dataSize() )
+        self.__consume( self.dataSize() )
 
         return retData
 
@@ -55,10 +78,45 @@ class DataBuffer:
 
         return retStr
 
+    def readLenPrefixedView( self ):
+        retView = None
+
+        if self.dataSize() > 4 and self.dataSize() >= ( self.peekUInt() + 4 ):
+            numChars = self.readUInt()
+            retView = self.readView( numChars )
+
+        return retView
+
     def appendLenPrefixedString( self, data ):
         self.appendUInt( len( data ) )
         self.appendString( data )
 
+    def __consume( self, numChars ):
+        self.readPos += numChars
+
+        if self.readPos == len( self.bufferedData ):
+            self.__reset()
+        elif self.readPos >= self.COMPACT_THRESHOLD and 2 * self.readPos >= len( self.bufferedData ):
+            self.__compact()
+
+    def __reset( self ):
+        try:
+            del self.bufferedData[:]
+        except BufferError:
+            self.bufferedData = bytearray()
+        self.readPos = 0
+
+    def __compact( self ):
+        try:
+            del self.bufferedData[ :self.readPos ]
+            self.readPos = 0
+        except BufferError:
+            self.__reallocate()
+
+    def __reallocate( self ):
+        self.bufferedData = bytearray( memoryview( self.bufferedData )[ self.readPos: ] )
+        self.readPos = 0
+
 if __name__ == "__main__":
 
     db = DataBuffer()
@@ -0,0 +1,59 @@
+import heapq
+
+class DeadlineQueue:
+    """
+    Keys with absolute deadlines in a min-heap. Moving a deadline pushes new
+    heap entry and leaves the old one to be skipped when popped, so update
+    costs O(log n) and popping expired keys costs O(expired log n).
+    """
+
+    ############################
+    def __init__( self ):
+        self.deadlines  = {}    # key -> deadline
+        self.heap       = []    # ( deadline, key ), stale if not matching self.deadlines
+
+    ############################
+    def set( self, key, deadline ):
+        self.deadlines[ key ] = deadline
+        heapq.heappush( self.heap, ( deadline, key ) )
+
+        # stale entries are dropped when heap is mostly garbage
+        if len( self.heap ) > 2 * len( self.deadlines ) + 64:
+            self.heap = [ ( d, k ) for k, d in self.deadlines.iteritems() ]
+            heapq.heapify( self.heap )
+
+    ############################
+    def remove( self, key ):
+        self.deadlines.pop( key, None )
+
+    ############################
+    def get( self, key ):
+        return self.deadlines.get( key )
+
+    ############################
+    def popExpired( self, now ):
+        """Removes and returns keys with deadline not later than now"""
+        expired = []
+
+        while self.heap and self.heap[ 0 ][ 0 ] <= now:
+            deadline, key = heapq.heappop( self.heap )
+            if self.deadlines.get( key ) == deadline:
+                del self.deadlines[ key ]
+                expired.append( key )
+
+        return expired
+
+    ############################
+    def nextDeadline( self ):
+        while self.heap and self.deadlines.get( self.heap[ 0 ][ 1 ] ) != self.heap[ 0 ][ 0 ]:
+            heapq.heappop( self.heap )
+
+        return self.heap[ 0 ][ 0 ] if self.heap else None
+
+    ############################
+    def __len__( self ):
+        return len( self.deadlines )
+
+    ############################
+    def __contains__( self, key ):
+        return key in self.deadlines
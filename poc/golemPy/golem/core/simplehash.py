@@ -38,6 +38,19 @@ class SimpleHash:
 
             return cls.base64_encode( sha.digest() )
 
+    @classmethod
+    def hash_file_hex( cls, filename, block_size = 2 ** 20 ):
+        with open( filename, "rb" ) as f:
+            sha = hashlib.sha1()
+
+            while True:
+                data = f.read( block_size )
+                if not data:
+                    break
+                sha.update( data )
+
+            return sha.hexdigest()
+
 if __name__ == "__main__":
     val = "Exceptional string"
 
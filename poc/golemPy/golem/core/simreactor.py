@@ -0,0 +1,560 @@
+import heapq
+import math
+import random
+import threading
+import time
+import traceback
+
+from twisted.internet.address import IPv4Address
+from twisted.internet.error import AlreadyCalled, AlreadyCancelled, CannotListenError, ConnectionRefusedError, ConnectionDone, ConnectionLost, TimeoutError, UserError
+from twisted.python.failure import Failure
+
+# time.time of the real clock, install replaces time.time with virtual one
+realTime = time.time
+
+class Link:
+    """
+    Parameters of one direction of simulated connection between two hosts.
+    Bandwidth is in bytes per second, zero means unlimited. Loss is the
+    probability of losing one packet ( below 1.0 ), lost packets are
+    delivered after retransmission timeout which also holds back data sent
+    after them.
+    """
+
+    ############################
+    def __init__( self, latency = 0.05, bandwidth = 0, loss = 0.0 ):
+        self.latency    = latency
+        self.bandwidth  = bandwidth
+        self.loss       = loss
+
+class SimDelayedCall:
+
+    ############################
+    def __init__( self, reactor, when, host, fn, args, kw ):
+        self.reactor    = reactor
+        self.time       = when
+        self.host       = host  # simulated host the call runs as
+        self.fn         = fn
+        self.args       = args
+        self.kw         = kw
+        self.seq        = None
+        self.cancelled  = False
+        self.called     = False
+
+    ############################
+    def getTime( self ):
+        return self.time
+
+    ############################
+    def cancel( self ):
+        self.__checkActive()
+        self.cancelled = True
+
+    ############################
+    def reset( self, secondsLater ):
+        self.__checkActive()
+        self.time = self.reactor.seconds() + secondsLater
+        self.reactor._push( self )
+
+    ############################
+    def delay( self, secondsLater ):
+        self.__checkActive()
+        self.time += secondsLater
+        self.reactor._push( self )
+
+    ############################
+    def active( self ):
+        return not ( self.cancelled or self.called )
+
+    ############################
+    def __checkActive( self ):
+        if self.cancelled:
+            raise AlreadyCancelled()
+        if self.called:
+            raise AlreadyCalled()
+
+class SimPort:
+
+    ############################
+    def __init__( self, reactor, host, port, factory ):
+        self.reactor    = reactor
+        self.host       = host
+        self.port       = port
+        self.factory    = factory
+
+    ############################
+    def getHost( self ):
+        return IPv4Address( "TCP", self.host, self.port )
+
+    ############################
+    def stopListening( self ):
+        if self.reactor.listeners.get( ( self.host, self.port ) ) is self:
+            del self.reactor.listeners[ ( self.host, self.port ) ]
+            self.factory.doStop()
+
+class SimConnector:
+
+    ############################
+    def __init__( self, reactor, factory, host, port ):
+        self.reactor    = reactor
+        self.factory    = factory
+        self.host       = host
+        self.port       = port
+        self.call       = None  # pending connection attempt
+        self.transport  = None
+
+    ############################
+    def getDestination( self ):
+        return IPv4Address( "TCP", self.host, self.port )
+
+    ############################
+    def stopConnecting( self ):
+        if self.call and self.call.active():
+            self.call.cancel()
+            self.factory.clientConnectionFailed( self, Failure( UserError() ) )
+            self.factory.doStop()
+
+    ############################
+    def disconnect( self ):
+        if self.transport:
+            self.transport.loseConnection()
+        else:
+            self.stopConnecting()
+
+class SimTransport:
+    """
+    One end of simulated TCP connection. Written data reaches the other end
+    in order after the link delays, producer is paused while more than
+    HighWater bytes wait for the link as with real socket buffer.
+    """
+
+    HighWater = 64 * 1024
+
+    ############################
+    def __init__( self, reactor, host, port, peerHost, peerPort ):
+        self.reactor        = reactor
+        self.host           = host
+        self.port           = port
+        self.peerHost       = peerHost
+        self.peerPort       = peerPort
+        self.peer           = None  # transport of the other end
+        self.protocol       = None
+        self.connected      = True
+        self.disconnecting  = False
+        self.producer       = None
+        self.streaming      = False
+        self.producerPaused = False
+        self.unsent         = 0     # bytes written but not yet put on the link
+        self.lastSent       = 0.0   # when the last written byte leaves
+        self.lastArrival    = 0.0   # when the last written byte reaches the peer
+
+    ############################
+    def write( self, data ):
+        if self.connected and not self.disconnecting and data:
+            self.reactor._send( self, data )
+
+    ############################
+    def writeSequence( self, seq ):
+        self.write( "".join( seq ) )
+
+    ############################
+    def loseConnection( self ):
+        if self.connected and not self.disconnecting:
+            self.disconnecting = True
+            self.reactor._close( self )
+
+    ############################
+    def abortConnection( self ):
+        self.reactor._abort( self )
+
+    ############################
+    def getPeer( self ):
+        return IPv4Address( "TCP", self.peerHost, self.peerPort )
+
+    ############################
+    def getHost( self ):
+        return IPv4Address( "TCP", self.host, self.port )
+
+    ############################
+    def registerProducer( self, producer, streaming ):
+        self.producer = producer
+        self.streaming = streaming
+
+    ############################
+    def unregisterProducer( self ):
+        self.producer = None
+
+    ############################
+    def setTcpNoDelay( self, enabled ):
+        pass
+
+class SimReactor:
+    """
+    Reactor of discrete event simulation. Time is virtual and jumps to the
+    next scheduled call, so idle periods cost nothing. TCP connections of
+    many simulated hosts go through Links with latency, bandwidth and loss
+    instead of sockets. Code runs as some host - calls and data delivered
+    to a host run as that host and connections or listening ports opened
+    from them belong to it. Calls of removed hosts are dropped.
+    """
+
+    ConnectTimeout  = 30.0
+    MinRto          = 0.2   # retransmission timeout of lost data is max( MinRto, 3 * latency )
+    SynRto          = 1.0   # retransmission timeout of lost connection request
+    MaxRto          = 60.0
+    EphemeralPort   = 50000
+    Mss             = 1460
+
+    ############################
+    def __init__( self, defaultLink = None, seed = None ):
+        self.now            = realTime()
+        self.heap           = []    # ( time, seq, call ), stale if seq does not match call.seq
+        self.seq            = 0
+        self.running        = False
+        self.currentHost    = None
+        self.reactorThread  = None
+        self.threadCalls    = []
+        self.threadLock     = threading.Lock()
+
+        self.defaultLink    = defaultLink or Link()
+        self.links          = {}    # ( src, dst ) -> Link
+        self.linkBusy       = {}    # ( src, dst ) -> time when link is free to send
+        self.random         = random.Random( seed )
+
+        self.hosts          = set()
+        self.listeners      = {}    # ( host, port ) -> SimPort
+        self.transports     = {}    # host -> set of open SimTransports
+        self.nextPort       = {}    # host -> next ephemeral port
+
+    ############################
+    def install( self ):
+        """Makes this the twisted reactor and replaces time.time with virtual clock, call before anything imports the reactor"""
+        from twisted.internet.main import installReactor
+        installReactor( self )
+        time.time = self.seconds
+
+    ############################
+    def seconds( self ):
+        return self.now
+
+    ############################
+    def callLater( self, delay, fn, *args, **kw ):
+        return self.__schedule( self.now + max( 0.0, delay ), self.currentHost, fn, *args, **kw )
+
+    ############################
+    def callFromThread( self, fn, *args, **kw ):
+        # calls from reactor thread keep running as the current host
+        host = self.currentHost if threading.current_thread() is self.reactorThread else None
+        with self.threadLock:
+            self.threadCalls.append( ( host, fn, args, kw ) )
+
+    ############################
+    def getDelayedCalls( self ):
+        return [ c for t, s, c in self.heap if c.seq == s and c.active() ]
+
+    ############################
+    def runAs( self, host, fn, *args, **kw ):
+        prev = self.currentHost
+        self.currentHost = host
+        try:
+            return fn( *args, **kw )
+        finally:
+            self.currentHost = prev
+
+    ############################
+    def setLink( self, src, dst, link, symmetric = True ):
+        self.links[ ( src, dst ) ] = link
+        if symmetric:
+            self.links[ ( dst, src ) ] = link
+
+    ############################
+    def getLink( self, src, dst ):
+        return self.links.get( ( src, dst ), self.defaultLink )
+
+    ############################
+    def addHost( self, host ):
+        self.hosts.add( host )
+
+    ############################
+    def removeHost( self, host ):
+        """Simulates crash of the host, its connections are reset and its pending calls dropped"""
+        self.hosts.discard( host )
+
+        for key, port in self.listeners.items():
+            if key[ 0 ] == host:
+                port.stopListening()
+
+        for t in list( self.transports.get( host, [] ) ):
+            self._abort( t )
+
+    ############################
+    def listenTCP( self, port, factory, backlog = 50, interface = "" ):
+        host = interface if interface not in ( "", "0.0.0.0" ) else self.currentHost
+        if host is None or host not in self.hosts:
+            raise CannotListenError( interface, port, "no simulated host" )
+        if ( host, port ) in self.listeners:
+            raise CannotListenError( interface, port, "address already in use" )
+
+        p = SimPort( self, host, port, factory )
+        self.listeners[ ( host, port ) ] = p
+        factory.doStart()
+        return p
+
+    ############################
+    def connectTCP( self, host, port, factory, timeout = 30, bindAddress = None ):
+        src = self.currentHost
+        connector = SimConnector( self, factory, host, port )
+        factory.doStart()
+        factory.startedConnecting( connector )
+
+        link = self.getLink( src, host )
+        back = self.getLink( host, src )
+        synDelay = link.latency + self.__lossDelay( link, 1, self.SynRto )
+
+        if host not in self.hosts:
+            connector.call = self.callLater( timeout or self.ConnectTimeout, self.__connectFailed, connector, TimeoutError() )
+        elif ( host, port ) not in self.listeners:
+            connector.call = self.callLater( synDelay + back.latency, self.__connectFailed, connector, ConnectionRefusedError() )
+        else:
+            connector.call = self.callLater( synDelay + back.latency, self.__accept, connector, src )
+
+        return connector
+
+    ############################
+    def stop( self ):
+        self.running = False
+
+    ############################
+    def run( self ):
+        self.runUntil( None )
+
+    ############################
+    def runUntil( self, until ):
+        """Runs calls due before until ( or all of them ), then virtual time is until"""
+        self.running = True
+        self.reactorThread = threading.current_thread()
+
+        while self.running:
+            self.__runThreadCalls()
+
+            call = self.__nextCall()
+            if call is None or ( until is not None and call.time > until ):
+                break
+
+            heapq.heappop( self.heap )
+            self.now = max( self.now, call.time )
+            call.called = True
+
+            if call.host is not None and call.host not in self.hosts:
+                continue
+
+            self.__run( call.host, call.fn, call.args, call.kw )
+
+        if until is not None and self.running:
+            self.now = max( self.now, until )
+
+        self.running = False
+
+    ############################
+    def nextCallTime( self ):
+        call = self.__nextCall()
+        return call.time if call else None
+
+    ############################
+    def _push( self, call ):
+        self.seq += 1
+        call.seq = self.seq
+        heapq.heappush( self.heap, ( call.time, call.seq, call ) )
+
+    ############################
+    def _send( self, t, data ):
+        size = len( data )
+        link = self.getLink( t.host, t.peerHost )
+        key = ( t.host, t.peerHost )
+
+        start = max( self.now, self.linkBusy.get( key, 0.0 ) )
+        sent = start + ( size / float( link.bandwidth ) if link.bandwidth > 0 else 0.0 )
+        self.linkBusy[ key ] = sent
+
+        packets = int( math.ceil( size / float( self.Mss ) ) )
+        arrival = max( sent + link.latency + self.__lossDelay( link, packets, max( self.MinRto, 3 * link.latency ) ), t.lastArrival )
+        t.lastSent = sent
+        t.lastArrival = arrival
+
+        t.unsent += size
+        if t.unsent > t.HighWater and t.producer and not t.producerPaused:
+            t.producerPaused = True
+            t.producer.pauseProducing()
+
+        self.__schedule( sent, t.host, self.__sent, t, size )
+        self.__schedule( arrival, t.peerHost, self.__deliver, t.peer, data )
+
+    ############################
+    def _close( self, t ):
+        # FIN follows the data written before
+        self.__schedule( max( self.now, t.lastSent ), t.host, self.__lost, t, ConnectionDone() )
+        fin = max( t.lastArrival, self.now + self.getLink( t.host, t.peerHost ).latency )
+        self.__schedule( fin, t.peerHost, self.__lost, t.peer, ConnectionDone() )
+
+    ############################
+    def _abort( self, t ):
+        if t.connected:
+            self.__schedule( self.now + self.getLink( t.host, t.peerHost ).latency, t.peerHost, self.__lost, t.peer, ConnectionLost() )
+            self.__run( t.host, self.__lost, ( t, ConnectionLost() ), {} )
+
+    ############################
+    def __schedule( self, when, host, fn, *args, **kw ):
+        call = SimDelayedCall( self, when, host, fn, args, kw )
+        self._push( call )
+        return call
+
+    ############################
+    def __nextCall( self ):
+        while self.heap:
+            when, seq, call = self.heap[ 0 ]
+            if call.seq == seq and call.active():
+                return call
+            heapq.heappop( self.heap )
+
+        return None
+
+    ############################
+    def __runThreadCalls( self ):
+        if not self.threadCalls:
+            return
+
+        with self.threadLock:
+            calls = self.threadCalls
+            self.threadCalls = []
+
+        for host, fn, args, kw in calls:
+            self.__run( host, fn, args, kw )
+
+    ############################
+    def __run( self, host, fn, args, kw ):
+        prev = self.currentHost
+        self.currentHost = host
+        try:
+            fn( *args, **kw )
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self.currentHost = prev
+
+    ############################
+    def __lossDelay( self, link, packets, rto ):
+        if link.loss <= 0.0:
+            return 0.0
+
+        # lost packets are found by skipping geometrically distributed runs of delivered ones
+        delay = 0.0
+        i = self.__delivered( link.loss )
+        while i < packets:
+            r = rto
+            delay += r
+            while self.random.random() < link.loss:
+                r = min( self.MaxRto, 2 * r )
+                delay += r
+
+            i += 1 + self.__delivered( link.loss )
+
+        return delay
+
+    ############################
+    def __delivered( self, loss ):
+        return int( math.log( 1.0 - self.random.random() ) / math.log( 1.0 - loss ) )
+
+    ############################
+    def __ephemeralPort( self, host ):
+        port = self.nextPort.get( host, self.EphemeralPort )
+        self.nextPort[ host ] = port + 1
+        return port
+
+    ############################
+    def __connectFailed( self, connector, reason ):
+        connector.factory.clientConnectionFailed( connector, Failure( reason ) )
+        connector.factory.doStop()
+
+    ############################
+    def __accept( self, connector, src ):
+        dst = connector.host
+        listener = self.listeners.get( ( dst, connector.port ) )
+        if listener is None or dst not in self.hosts:
+            self.__connectFailed( connector, ConnectionRefusedError() )
+            return
+
+        srcPort = self.__ephemeralPort( src )
+        server = SimTransport( self, dst, connector.port, src, srcPort )
+        client = SimTransport( self, src, srcPort, dst, connector.port )
+        server.peer = client
+        client.peer = server
+
+        server.protocol = self.runAs( dst, listener.factory.buildProtocol, server.getPeer() )
+        client.protocol = connector.factory.buildProtocol( client.getPeer() )
+        connector.transport = client
+
+        if server.protocol is None or client.protocol is None:
+            # the side without protocol resets the connection
+            server.connected = client.connected = False
+            if client.protocol is None:
+                self.__connectFailed( connector, ConnectionRefusedError() )
+            return
+
+        self.transports.setdefault( dst, set() ).add( server )
+        self.transports.setdefault( src, set() ).add( client )
+
+        self.__run( dst, server.protocol.makeConnection, ( server, ), {} )
+        client.protocol.makeConnection( client )
+
+    ############################
+    def __sent( self, t, size ):
+        t.unsent -= size
+        if t.producerPaused and t.unsent <= t.HighWater / 2:
+            t.producerPaused = False
+            if t.producer and t.connected:
+                t.producer.resumeProducing()
+
+    ############################
+    def __deliver( self, t, data ):
+        if t.connected:
+            t.protocol.dataReceived( data )
+
+    ############################
+    def __lost( self, t, reason ):
+        if not t.connected:
+            return
+
+        t.connected = False
+        self.transports.get( t.host, set() ).discard( t )
+        t.protocol.connectionLost( Failure( reason ) )
+
+if __name__ == "__main__":
+
+    from twisted.internet.protocol import Protocol, Factory, ClientFactory
+
+    reactor = SimReactor( Link( latency = 0.05, bandwidth = 1024 * 1024, loss = 0.01 ), seed = 1 )
+    reactor.addHost( "10.0.0.1" )
+    reactor.addHost( "10.0.0.2" )
+    start = reactor.seconds()
+
+    class Echo( Protocol ):
+        def dataReceived( self, data ):
+            self.transport.write( data )
+
+    class Sender( Protocol ):
+        def connectionMade( self ):
+            print "connected after {:.3f}s".format( reactor.seconds() - start )
+            self.received = 0
+            self.transport.write( "x" * 4 * 1024 * 1024 )
+        def dataReceived( self, data ):
+            self.received += len( data )
+            if self.received == 4 * 1024 * 1024:
+                print "4 MB echoed after {:.3f}s of virtual time".format( reactor.seconds() - start )
+                self.transport.loseConnection()
+
+    reactor.runAs( "10.0.0.1", reactor.listenTCP, 40102, Factory.forProtocol( Echo ) )
+    reactor.runAs( "10.0.0.2", reactor.connectTCP, "10.0.0.1", 40102, ClientFactory.forProtocol( Sender ) )
+
+    t = realTime()
+    reactor.run()
+    print "simulation took {:.3f}s".format( realTime() - t )
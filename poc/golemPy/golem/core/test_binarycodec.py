@@ -0,0 +1,121 @@
+import sys
+import os
+testDir = os.path.dirname( os.path.abspath( __file__ ) )
+sys.path.append( testDir )
+
+import unittest
+import cPickle as pickle
+
+from binarycodec import MessageCodec, ListType, RecordType, LazyType, LazyValue, CodecError, encodeVarint, decodeVarint, isBinaryFrame, peekMessageType, MAX_VARINT_SIZE
+from binarycodec import UINT, SINT, BOOL, FLOAT, BYTES, TEXT, OBJECT
+
+class VarintTest( unittest.TestCase ):
+
+    ############################
+    def testRoundTrip( self ):
+        for num in [ 0, 1, 127, 128, 300, 2 ** 32, 2 ** 64 - 1 ]:
+            out = []
+            encodeVarint( out, num )
+            data = "".join( out )
+            self.assertEqual( decodeVarint( data, 0 ), ( num, len( data ) ) )
+
+    ############################
+    def testOutOfRange( self ):
+        self.assertRaises( ValueError, encodeVarint, [], -1 )
+        self.assertRaises( ValueError, encodeVarint, [], 2 ** 64 )
+
+    ############################
+    def testTooLong( self ):
+        self.assertRaises( CodecError, decodeVarint, "\xff" * ( MAX_VARINT_SIZE + 1 ) + "\x01", 0 )
+
+    ############################
+    def testTruncated( self ):
+        self.assertRaises( IndexError, decodeVarint, "\xff\xff", 0 )
+
+class MessageCodecTest( unittest.TestCase ):
+
+    Schema = (  ( 1, "id",      TEXT ),
+                ( 2, "port",    UINT ),
+                ( 3, "offset",  SINT ),
+                ( 4, "ok",      BOOL ),
+                ( 5, "ttl",     FLOAT ),
+                ( 6, "data",    BYTES ),
+                ( 7, "extra",   OBJECT ),
+                ( 8, "peers",   ListType( RecordType( [ ( 1, "address", TEXT ), ( 2, "port", UINT ) ] ) ) ) )
+
+    ############################
+    def value( self ):
+        return {    "id"        : u"za\u017c\u00f3\u0142\u0107",
+                    "port"      : 40102,
+                    "offset"    : -12,
+                    "ok"        : True,
+                    "ttl"       : 12.5,
+                    "data"      : "\x00\xff",
+                    "extra"     : { "x" : [ 1, 2 ] },
+                    "peers"     : [ { "address" : u"10.0.0.1", "port" : 1 }, { "address" : u"10.0.0.2", "port" : None } ] }
+
+    ############################
+    def testRoundTrip( self ):
+        codec = MessageCodec( 7, self.Schema )
+        data = codec.encode( self.value() )
+
+        self.assertTrue( isBinaryFrame( data ) )
+        self.assertFalse( isBinaryFrame( pickle.dumps( self.value(), 0 ) ) )
+        self.assertFalse( isBinaryFrame( pickle.dumps( self.value(), 2 ) ) )
+
+        msgType, pos = peekMessageType( data )
+        self.assertEqual( msgType, 7 )
+        self.assertEqual( codec.decode( data, pos ), self.value() )
+
+    ############################
+    def testNoneIsSkipped( self ):
+        codec = MessageCodec( 7, self.Schema )
+        value = dict.fromkeys( self.value().keys() )
+        value[ "port" ] = 1
+
+        data = codec.encode( value )
+        self.assertEqual( codec.decode( data, peekMessageType( data )[ 1 ] ), value )
+
+    ############################
+    def testUnknownFieldsAreSkipped( self ):
+        newer = MessageCodec( 7, self.Schema + ( ( 9, "added", TEXT ), ( 10, "count", UINT ), ( 11, "rate", FLOAT ) ) )
+        older = MessageCodec( 7, self.Schema )
+
+        value = self.value()
+        value.update( { "added" : u"new", "count" : 3, "rate" : 0.5 } )
+        data = newer.encode( value )
+
+        self.assertEqual( older.decode( data, peekMessageType( data )[ 1 ] ), self.value() )
+
+    ############################
+    def testTruncatedFrame( self ):
+        codec = MessageCodec( 7, self.Schema )
+        data = codec.encode( self.value() )
+
+        for end in [ len( data ) - 1, len( data ) - 5 ]:
+            self.assertRaises( ( CodecError, IndexError, ValueError ), codec.decode, data[ :end ], 2 )
+
+    ############################
+    def testSchemaMismatch( self ):
+        codec = MessageCodec( 7, self.Schema )
+
+        for key, bad in [ ( "port", -1 ), ( "port", u"x" ), ( "peers", "not a list" ) ]:
+            value = self.value()
+            value[ key ] = bad
+            self.assertRaises( ( TypeError, ValueError ), codec.encode, value )
+
+        value = self.value()
+        del value[ "ttl" ]
+        self.assertRaises( KeyError, codec.encode, value )
+
+    ############################
+    def testLazyField( self ):
+        codec = MessageCodec( 3, [ ( 1, "result", LazyType( OBJECT ) ) ] )
+        data = codec.encode( { "result" : [ 1, u"two" ] } )
+
+        value = codec.decode( data, peekMessageType( data )[ 1 ] )[ "result" ]
+        self.assertTrue( isinstance( value, LazyValue ) )
+        self.assertEqual( value.get(), [ 1, u"two" ] )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import sys
+import os
+testDir = os.path.dirname( os.path.abspath( __file__ ) )
+sys.path.append( testDir )
+
+import unittest
+
+from databuffer import DataBuffer
+
+class DataBufferTest( unittest.TestCase ):
+
+    ############################
+    def testLenPrefixed( self ):
+        db = DataBuffer()
+        db.appendLenPrefixedString( "first" )
+        db.appendLenPrefixedString( "" )
+        db.appendString( "\x00\x00\x00\x05par" )
+
+        self.assertEqual( db.readLenPrefixedString(), "first" )
+        self.assertEqual( db.readLenPrefixedString(), "" )
+        self.assertEqual( db.readLenPrefixedString(), None )
+
+        db.appendString( "ts" )
+        self.assertEqual( db.readLenPrefixedView().tobytes(), "parts" )
+        self.assertEqual( db.dataSize(), 0 )
+
+    ############################
+    def testCompaction( self ):
+        db = DataBuffer()
+        db.COMPACT_THRESHOLD = 64
+
+        read = 0
+        for i in range( 1000 ):
+            db.appendLenPrefixedString( "frame{:04}".format( i ) )
+            if i % 3 == 2:
+                for j in range( 2 ):
+                    self.assertEqual( db.readLenPrefixedString(), "frame{:04}".format( read ) )
+                    read += 1
+
+                # consumed bytes are dropped once they reach threshold and half of the buffer
+                self.assertTrue( db.readPos < db.COMPACT_THRESHOLD or db.readPos < db.dataSize() )
+
+        while db.dataSize():
+            self.assertEqual( db.readLenPrefixedString(), "frame{:04}".format( read ) )
+            read += 1
+
+        self.assertEqual( read, 1000 )
+        self.assertEqual( db.readPos, 0 )
+
+    ############################
+    def testViewsSurviveCompaction( self ):
+        db = DataBuffer()
+        db.COMPACT_THRESHOLD = 64
+
+        views = []
+        for i in range( 200 ):
+            db.appendLenPrefixedString( "frame{:04}".format( i ) * 3 )
+            views.append( db.readLenPrefixedView() )
+
+            # exported views keep bytearray from being resized, so it is replaced
+            db.appendLenPrefixedString( "x" * 50 )
+            self.assertEqual( db.readLenPrefixedString(), "x" * 50 )
+
+        for i, v in enumerate( views ):
+            self.assertEqual( v.tobytes(), "frame{:04}".format( i ) * 3 )
+
+        del views[ : ]
+        db.appendLenPrefixedString( "last" )
+        self.assertEqual( db.readLenPrefixedString(), "last" )
+
+    ############################
+    def testViewSurvivesPartialFrame( self ):
+        db = DataBuffer()
+        db.COMPACT_THRESHOLD = 8
+
+        db.appendLenPrefixedString( "a" * 16 )
+        db.appendString( "\x00\x00\x00\x04ab" )
+        view = db.readLenPrefixedView()
+
+        db.appendString( "cd" )
+        self.assertEqual( db.readLenPrefixedString(), "abcd" )
+        self.assertEqual( view.tobytes(), "a" * 16 )
+
+if __name__ == "__main__":
+    unittest.main()
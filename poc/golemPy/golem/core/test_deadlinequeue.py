@@ -0,0 +1,72 @@
+import sys
+import os
+testDir = os.path.dirname( os.path.abspath( __file__ ) )
+sys.path.append( testDir )
+
+import unittest
+import random
+
+from deadlinequeue import DeadlineQueue
+
+class DeadlineQueueTest( unittest.TestCase ):
+
+    ############################
+    def testOrder( self ):
+        q = DeadlineQueue()
+        for key, deadline in [ ( "c", 3.0 ), ( "a", 1.0 ), ( "b", 2.0 ), ( "d", 4.0 ) ]:
+            q.set( key, deadline )
+
+        self.assertEqual( q.nextDeadline(), 1.0 )
+        self.assertEqual( q.popExpired( 0.5 ), [] )
+        self.assertEqual( q.popExpired( 2.0 ), [ "a", "b" ] )
+        self.assertEqual( q.nextDeadline(), 3.0 )
+        self.assertEqual( len( q ), 2 )
+        self.assertFalse( "a" in q )
+
+    ############################
+    def testMovedDeadline( self ):
+        q = DeadlineQueue()
+        q.set( "a", 1.0 )
+        q.set( "b", 2.0 )
+        q.set( "a", 5.0 )
+
+        self.assertEqual( q.popExpired( 3.0 ), [ "b" ] )
+        self.assertEqual( q.nextDeadline(), 5.0 )
+        self.assertEqual( q.get( "a" ), 5.0 )
+
+        q.set( "a", 0.5 )
+        self.assertEqual( q.nextDeadline(), 0.5 )
+        self.assertEqual( q.popExpired( 10.0 ), [ "a" ] )
+        self.assertEqual( q.nextDeadline(), None )
+
+    ############################
+    def testRemove( self ):
+        q = DeadlineQueue()
+        q.set( "a", 1.0 )
+        q.set( "b", 2.0 )
+        q.remove( "a" )
+        q.remove( "missing" )
+
+        self.assertEqual( q.nextDeadline(), 2.0 )
+        self.assertEqual( q.popExpired( 3.0 ), [ "b" ] )
+        self.assertEqual( len( q ), 0 )
+
+    ############################
+    def testStaleEntriesAreDropped( self ):
+        rnd = random.Random( 1 )
+        q = DeadlineQueue()
+        deadlines = {}
+
+        for i in range( 5000 ):
+            key = rnd.randrange( 50 )
+            deadlines[ key ] = rnd.uniform( 0.0, 100.0 )
+            q.set( key, deadlines[ key ] )
+
+        self.assertTrue( len( q.heap ) <= 2 * len( q ) + 65 )
+
+        expired = q.popExpired( 50.0 )
+        self.assertEqual( sorted( expired ), sorted( k for k, d in deadlines.items() if d <= 50.0 ) )
+        self.assertEqual( expired, sorted( expired, key = deadlines.get ) )
+
+if __name__ == "__main__":
+    unittest.main()
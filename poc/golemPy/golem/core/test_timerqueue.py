@@ -0,0 +1,126 @@
+import sys
+import os
+testDir = os.path.dirname( os.path.abspath( __file__ ) )
+sys.path.append( testDir )
+
+import unittest
+
+from twisted.internet.task import Clock
+
+import timerqueue
+from timerqueue import TimerQueue
+
+class ClockTime:
+    """time module replacement reading the test clock"""
+
+    ############################
+    def __init__( self, clock ):
+        self.clock = clock
+
+    ############################
+    def time( self ):
+        return self.clock.seconds()
+
+class TimerQueueTest( unittest.TestCase ):
+
+    ############################
+    def setUp( self ):
+        self.clock = Clock()
+        self.saved = ( timerqueue.reactor, timerqueue.time )
+        timerqueue.reactor = self.clock
+        timerqueue.time = ClockTime( self.clock )
+
+        self.queue = TimerQueue()
+        self.calls = []
+
+    ############################
+    def tearDown( self ):
+        timerqueue.reactor, timerqueue.time = self.saved
+
+    ############################
+    def record( self, name, delay = None ):
+        def fn():
+            self.calls.append( ( name, self.clock.seconds() ) )
+            return delay
+        return fn
+
+    ############################
+    def testOneDelayedCall( self ):
+        for i in range( 10 ):
+            self.queue.callEvery( 1.0 + i, self.record( i ) )
+
+        self.assertEqual( len( self.clock.getDelayedCalls() ), 1 )
+
+    ############################
+    def testOrder( self ):
+        self.queue.callEvery( 3.0, self.record( "slow" ), jitter = 0.0 )
+        self.queue.callEvery( 1.0, self.record( "fast" ), jitter = 0.0 )
+
+        for i in range( 100 ):
+            self.clock.advance( 0.1 )
+
+        times = [ t for name, t in self.calls ]
+        self.assertEqual( times, sorted( times ) )
+
+        fast = [ t for name, t in self.calls if name == "fast" ]
+        slow = [ t for name, t in self.calls if name == "slow" ]
+        self.assertTrue( 9 <= len( fast ) <= 10 )
+        self.assertTrue( 3 <= len( slow ) <= 4 )
+        for a, b in zip( fast, fast[ 1: ] ):
+            self.assertAlmostEqual( b - a, 1.0, delta = 0.11 )
+
+    ############################
+    def testReturnedDelay( self ):
+        self.queue.callEvery( 10.0, self.record( "t", 0.5 ) )
+        self.clock.advance( 10.0 )
+        self.assertEqual( len( self.calls ), 1 )
+
+        self.clock.advance( 0.5 )
+        self.assertEqual( len( self.calls ), 2 )
+        self.assertAlmostEqual( self.calls[ 1 ][ 1 ] - self.calls[ 0 ][ 1 ], 0.5 )
+
+    ############################
+    def testWake( self ):
+        timer = self.queue.callEvery( 100.0, self.record( "t" ) )
+        self.clock.advance( 0.0 )
+        calls = len( self.calls )
+
+        timer.wake( 1.0 )
+        self.clock.advance( 1.0 )
+        self.assertEqual( len( self.calls ), calls + 1 )
+
+        # waking cannot postpone a timer which is due sooner
+        timer.wake( 500.0 )
+        self.clock.advance( 110.0 )
+        self.assertEqual( len( self.calls ), calls + 2 )
+
+    ############################
+    def testCancel( self ):
+        timer = self.queue.callEvery( 1.0, self.record( "t" ) )
+        self.queue.callEvery( 1.0, self.record( "other" ) )
+        timer.cancel()
+        timer.wake()
+
+        self.clock.advance( 5.0 )
+        self.assertFalse( [ c for c in self.calls if c[ 0 ] == "t" ] )
+
+        self.queue.cancelAll()
+        calls = len( self.calls )
+        self.clock.advance( 5.0 )
+        self.assertEqual( len( self.calls ), calls )
+        self.assertEqual( self.clock.getDelayedCalls(), [] )
+
+    ############################
+    def testFailingTimerKeepsRunning( self ):
+        def fail():
+            self.calls.append( ( "fail", self.clock.seconds() ) )
+            raise RuntimeError( "timer failure" )
+
+        self.queue.callEvery( 1.0, fail, jitter = 0.0 )
+        for i in range( 50 ):
+            self.clock.advance( 0.1 )
+
+        self.assertTrue( len( self.calls ) >= 4 )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import heapq
+import random
+import time
+import traceback
+
+from twisted.internet import reactor
+
+class Timer:
+
+    ############################
+    def __init__( self, queue, fn, interval, jitter ):
+        self.queue      = queue
+        self.fn         = fn
+        self.interval   = interval
+        self.jitter     = jitter
+        self.when       = None
+        self.cancelled  = False
+
+    ############################
+    def wake( self, delay = 0.0 ):
+        """Runs the timer delay seconds from now unless it is due sooner, call from reactor thread only"""
+        self.queue.schedule( self, delay )
+
+    ############################
+    def cancel( self ):
+        self.cancelled = True
+        self.when = None
+
+class TimerQueue:
+    """
+    Heap of timers sharing one reactor delayed call armed for the earliest
+    of them, so idle node wakes up only when some timer is due. Periodic
+    timers start at random offset and every period is extended by random
+    jitter, which keeps nodes started together from polling in lockstep.
+    """
+
+    ############################
+    def __init__( self ):
+        self.heap           = []    # ( when, seq, timer ), entries not matching timer.when are stale
+        self.seq            = 0
+        self.timers         = []
+        self.delayedCall    = None
+        self.armedAt        = None
+
+    ############################
+    def callEvery( self, interval, fn, jitter = 0.1 ):
+        """
+        Runs fn about every interval seconds. If fn returns a number it is
+        used as delay of the next run instead.
+        """
+        timer = Timer( self, fn, interval, jitter )
+        self.timers.append( timer )
+        self.schedule( timer, random.uniform( 0.0, interval ) )
+        return timer
+
+    ############################
+    def schedule( self, timer, delay ):
+        when = time.time() + max( 0.0, delay )
+
+        if timer.cancelled or ( timer.when is not None and timer.when <= when ):
+            return
+
+        timer.when = when
+        self.seq += 1
+        heapq.heappush( self.heap, ( when, self.seq, timer ) )
+        self.__arm()
+
+    ############################
+    def cancelAll( self ):
+        for t in self.timers:
+            t.cancel()
+
+        self.timers = []
+        self.heap   = []
+        self.__arm()
+
+    ############################
+    def __fire( self ):
+        self.delayedCall = None
+        now = time.time()
+
+        # timers rescheduled by their runs are due after now, they wait for next call
+        due = []
+        while self.heap and self.heap[ 0 ][ 0 ] <= now:
+            when, seq, timer = heapq.heappop( self.heap )
+            if timer.when == when:
+                timer.when = None
+                due.append( timer )
+
+        for timer in due:
+            if timer.cancelled:
+                continue
+
+            delay = None
+            try:
+                delay = timer.fn()
+            except Exception:
+                traceback.print_exc()
+
+            if timer.cancelled:
+                continue
+
+            if not isinstance( delay, ( int, long, float ) ):
+                delay = timer.interval * ( 1.0 + random.uniform( 0.0, timer.jitter ) )
+
+            self.schedule( timer, delay )
+
+        self.__arm()
+
+    ############################
+    def __arm( self ):
+        while self.heap and self.heap[ 0 ][ 2 ].when != self.heap[ 0 ][ 0 ]:
+            heapq.heappop( self.heap )
+
+        if not self.heap:
+            if self.delayedCall:
+                self.delayedCall.cancel()
+                self.delayedCall = None
+            return
+
+        delay = max( 0.0, self.heap[ 0 ][ 0 ] - time.time() )
+
+        if self.delayedCall is None:
+            self.delayedCall = reactor.callLater( delay, self.__fire )
+        elif self.armedAt != self.heap[ 0 ][ 0 ]:
+            self.delayedCall.reset( delay )
+
+        self.armedAt = self.heap[ 0 ][ 0 ]
@@ -0,0 +1,73 @@
+import math
+import time
+
+class TokenBucket:
+    """
+    Limits traffic to rate bytes per second with bursts up to burst bytes,
+    zero rate means no limit. Tokens may go below zero, so one large frame
+    is not held back forever - it delays data sent after it instead. Rate
+    of consumed bytes is measured also when there is no limit.
+    """
+
+    RateTau = 2.0   # time constant of measured rate in seconds
+
+    ############################
+    def __init__( self, rate = 0, burst = None ):
+        self.rate       = rate
+        self.burst      = burst if burst is not None else rate
+        self.tokens     = self.burst
+        self.lastRefill = time.time()
+
+        self.measured   = 0.0   # exponentially decayed byte count
+        self.lastUsage  = self.lastRefill
+
+    ############################
+    def delay( self ):
+        """Seconds to wait before more data may be sent"""
+        if self.rate <= 0:
+            return 0.0
+
+        self.__refill()
+
+        if self.tokens >= 0:
+            return 0.0
+
+        return -self.tokens / float( self.rate )
+
+    ############################
+    def consume( self, size ):
+        self.__refill()
+        self.tokens -= size
+
+        self.measured = self.__decayed() + size
+        self.lastUsage = time.time()
+
+    ############################
+    def currentRate( self ):
+        """Bytes per second sent recently"""
+        return self.__decayed() / self.RateTau
+
+    ############################
+    def __refill( self ):
+        now = time.time()
+        self.tokens = min( self.burst, self.tokens + ( now - self.lastRefill ) * self.rate )
+        self.lastRefill = now
+
+    ############################
+    def __decayed( self ):
+        return self.measured * math.exp( -( time.time() - self.lastUsage ) / self.RateTau )
+
+if __name__ == "__main__":
+
+    bucket = TokenBucket( 1024 * 1024 )
+    start = time.time()
+    sent = 0
+
+    while time.time() - start < 3.0:
+        wait = bucket.delay()
+        if wait > 0.0:
+            time.sleep( wait )
+        bucket.consume( 64 * 1024 )
+        sent += 64 * 1024
+
+    print "sent {:.0f} KB/s, measured {:.0f} KB/s".format( sent / ( time.time() - start ) / 1024.0, bucket.currentRate() / 1024.0 )
@@ -65,7 +65,7 @@ class LocalTaskStateSnapshot:
 #FIXME: also add a boolean flag indicating whether there is any active local/rempote task being calculated
 class NodeStateSnapshot:
 
-    def __init__( self, running = True, uid = 0, peersNum = 0, tasksNum = 0, endpointAddr = "", endpointPort = "", lastNetowrkMessages = [], lastTaskMessages = [], tcss = {}, ltss = {} ):
+    def __init__( self, running = True, uid = 0, peersNum = 0, tasksNum = 0, endpointAddr = "", endpointPort = "", lastNetowrkMessages = [], lastTaskMessages = [], tcss = {}, ltss = {}, networkStats = {}, taskStats = {}, peersRtt = {}, ownersRtt = {}, bandwidth = {} ):
         self.uid                    = uid
         self.timestamp              = QtCore.QTime.currentTime()
         self.endpointAddr           = endpointAddr
@@ -77,6 +77,11 @@ class NodeStateSnapshot:
         self.taskChunkState         = tcss
         self.localTaskState         = ltss
         self.running                = running
+        self.networkStats           = networkStats
+        self.taskStats              = taskStats
+        self.peersRtt               = peersRtt
+        self.ownersRtt              = ownersRtt
+        self.bandwidth              = bandwidth
 
     def isRunning( self ):
         return self.running
@@ -111,6 +116,25 @@ class NodeStateSnapshot:
     def getLocalTaskStateSnapshot( self ):
         return self.localTaskState
 
+    # { ( direction, message name ) : counters } - see ProtocolStats.toDict
+    def getNetworkProtocolStats( self ):
+        return self.networkStats
+
+    def getTaskProtocolStats( self ):
+        return self.taskStats
+
+    # { peer id : { "srtt", "rttvar", "samples" } } - see RttEstimator.toDict
+    def getPeersRtt( self ):
+        return self.peersRtt
+
+    # { "address:port" of task owner : { "srtt", "rttvar", "samples" } }
+    def getTaskOwnersRtt( self ):
+        return self.ownersRtt
+
+    # bulk upload rates - see TaskServer.getBandwidthStats
+    def getBandwidthStats( self ):
+        return self.bandwidth
+
     def __str__( self ):
         return "Nothing here"
         #ret = str( self.getUID() )+ " ----- \n" + "peers count: " + str( self.getPeersNum() ) + "\n" + "tasks count: " + str( self.getTasksNum() ) + "\n"
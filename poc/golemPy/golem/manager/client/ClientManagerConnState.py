@@ -15,26 +15,17 @@ class ClientManagerConnState( ConnectionState ):
 
     ############################
     def connectionMade( self ):
-        self.opened = True
+        ConnectionState.connectionMade( self )
 
     ############################
-    def dataReceived(self, data):
-        assert self.opened
-
-        self.db.appendString(data)
-        mess = Message.deserialize( self.db )
-        if mess is None:
-            print "Deserialization message failed"
-            self.clientManagerSession.interpret( None )
-
+    def _interpret( self, msg ):
         if self.clientManagerSession:
-            for m in mess:
-                self.clientManagerSession.interpret(m)
+            self.clientManagerSession.interpret( msg )
         else:
             print "manager session for connection is None"
             assert False
 
     ############################
     def connectionLost(self, reason):
-        self.opened = False
+        ConnectionState.connectionLost( self, reason )
         self.clientManagerSession.dropped()
@@ -24,6 +24,9 @@ class ClientManagerSession:
 
         assert self.client
 
+        if msg is None:
+            return
+
         type = msg.getType()
 
         if type == MessageNewTask.Type:
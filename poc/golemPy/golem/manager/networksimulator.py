@@ -1,59 +1,184 @@
+import sys
+sys.path.append( '../' )
+sys.path.append( '../../' )
+sys.path.append( '../core' )
+sys.path.append( '../network' )
+sys.path.append( '../task' )
+sys.path.append( '../task/resource' )
+sys.path.append( '../vm' )
+
 from threading import Thread, Lock
+from functools import partial
+import cPickle as pickle
+import subprocess
 import time
 import random
+import os
 
-from PyQt4 import QtCore
-
-from NodeStateSnapshot import NodeStateSnapshot, LocalTaskStateSnapshot, TaskChunkStateSnapshot
+from NodeStateSnapshot import NodeStateSnapshot
+from ClientConfigDescriptor import ClientConfigDescriptor
+from TaskBase import Task, TaskHeader
+from TaskComputer import TaskThread
+from ProtocolStats import DIRECTION_OUT
+from simreactor import SimReactor, Link, realTime
 
 
 GLOBAL_SHUTDOWN = [ False ]
 
-class NodeSimulator(QtCore.QThread):
-
-    #updateRequest = QtCore.pyqtSignal()
-
-    ########################
-    def __init__(self, simulator, id, uid, numLocalTasks, numRemoteTasks, localTaskDuration, remoteTaskDuration, innerUpdateDelay ):
-        super(NodeSimulator, self).__init__()
-            
-        self.simulator = simulator
-        self.id = id
-        self.uid = uid
-        self.numLocalTasks = numLocalTasks
-        self.numRemoteTasks = numRemoteTasks
-        self.localTaskDuration = localTaskDuration
-        self.remoteTaskDuration = remoteTaskDuration
-        self.startTime = time.time()
-        self.innerUpdateDelay = innerUpdateDelay
-        
-        self.locProgress = 0.0
-        self.remProgress = 0.0
-
-        self.forcedQuit = False
-
-        self.localAddr = "127.0.0.1"
-        self.localPort = int( random.random() * 60000.0 + 1024.0 )
-        self.peersNum = 0
-        self.tasksNum = 0
-        self.running = True
-        
-        self.addedTasks = []
+class SimTask( Task ):
+    """
+    Synthetic task of numSubTasks subtasks without resources. Subtask is
+    not computed - it takes work / performance seconds of virtual time on
+    the computing node and its result is resultSize bytes.
+    """
+
+    #######################
+    def __init__( self, header, numSubTasks, work, resultSize, simulation, descr = "" ):
+        Task.__init__( self, header, "" )
+        self.numSubTasks    = numSubTasks
+        self.work           = work
+        self.resultSize     = resultSize
+        self.simulation     = simulation
+        self.descr          = descr or "{} subtasks of {} work".format( numSubTasks, work )
+        self.given          = 0
+        self.finished       = 0
+
+    #######################
+    def initialize( self ):
+        pass
+
+    #######################
+    def queryExtraData( self, perfIndex ):
+        subTaskId = u"{}-{}".format( self.header.taskId, self.given )
+        self.given += 1
+        self.simulation.subTaskAssigned( self.header.taskId, subTaskId )
+        return { "work" : self.work, "resultSize" : self.resultSize }, subTaskId, self.header.taskOwnerAddress, self.header.taskOwnerPort
+
+    #######################
+    def shortExtraDataRepr( self, perfIndex ):
+        return self.descr
+
+    #######################
+    def needsComputation( self ):
+        return self.given < self.numSubTasks
+
+    #######################
+    def computationStarted( self, extraData ):
+        pass
+
+    #######################
+    def computationFinished( self, subTaskId, taskResult, env = None ):
+        self.finished += 1
+        self.simulation.subTaskFinished( self.header.taskId, subTaskId )
+
+    #######################
+    def getTotalTasks( self ):
+        return self.numSubTasks
+
+    #######################
+    def getTotalChunks( self ):
+        return self.numSubTasks
+
+    #######################
+    def getActiveTasks( self ):
+        return self.given - self.finished
+
+    #######################
+    def getActiveChunks( self ):
+        return self.given - self.finished
+
+    #######################
+    def getChunksLeft( self ):
+        return self.numSubTasks - self.finished
+
+    #######################
+    def getProgress( self ):
+        return self.finished / float( self.numSubTasks )
+
+    #######################
+    def acceptResultsDelay( self ):
+        return 0.0
+
+    #######################
+    def prepareResourceDelta( self, subTaskId, resourceHeader ):
+        return None
+
+class SimTaskThread( TaskThread ):
+    """Computation of SimTask subtask, finishes after its work in virtual time without running any thread"""
+
+    ######################
+    def __init__( self, node, taskComputer, subTaskId, srcCode, extraData, shortDescr, resPath, tmpPath ):
+        super( SimTaskThread, self ).__init__( taskComputer, subTaskId, srcCode, extraData, shortDescr, resPath, tmpPath )
+        self.node       = node
+        self.duration   = extraData.get( "work", 0.0 ) / max( 1.0, taskComputer.estimatedPerformance )
+        self.startTime  = None
+
+    ######################
+    def start( self ):
+        from twisted.internet import reactor
+        self.startTime = reactor.seconds()
+        reactor.callLater( self.duration, self.run )
+
+    ######################
+    def getProgress( self ):
+        from twisted.internet import reactor
+        if not self.startTime or self.duration <= 0.0:
+            return 0.0
+
+        return min( 1.0, ( reactor.seconds() - self.startTime ) / self.duration )
+
+    ######################
+    def run( self ):
+        self.result = "r" * self.extraData.get( "resultSize", 0 )
+        self.node.subTasksComputed += 1
+        self.taskComputer.taskComputed( self )
+        self.done = True
 
-        for i in range( numLocalTasks ):
-            self.addedTasks.append( "Uninteresting taks desc {}".format( i ) )
+class SimulatedNode:
+    """
+    Real P2PService and TaskServer of one simulated host, run from timer
+    queue as in Client. Only computation of subtasks is simulated.
+    """
+
+    MinTimerInterval    = 0.1
 
     ########################
-    def terminate( self ):
-        self.forcedQuit = True
+    def __init__( self, simulation, id, host, configDesc ):
+        self.simulation         = simulation
+        self.id                 = id
+        self.uid                = configDesc.clientUid
+        self.host               = host
+        self.configDesc         = configDesc
+        self.p2pservice         = None
+        self.taskServer         = None
+        self.timers             = None
+        self.running            = False
+        self.subTasksComputed   = 0
 
     ########################
-    def enqueueTask( self, w, h, numSamplesPerPixel, fileName ):
-        self.numLocalTasks += 1
-        self.totalDuration += self.localTaskDuration
-        extraData = "w: {}, h: {}, spp: {}, file: {}".format( w, h, numSamplesPerPixel, fileName )
+    def start( self ):
+        from P2PService import P2PService
+        from TaskServer import TaskServer
+        from timerqueue import TimerQueue
+
+        self.p2pservice = P2PService( self.host, self.configDesc )
+        self.taskServer = TaskServer( self.host, self.configDesc )
+        self.p2pservice.setTaskServer( self.taskServer )
+        self.taskServer.taskComputer.taskThreadType = partial( SimTaskThread, self )
+
+        self.timers = TimerQueue()
+        self.p2pservice.registerTimers( self.timers )
+        self.taskServer.registerTimers( self.timers )
 
-        self.addedTasks.append( extraData )
+        if self.configDesc.sendPings:
+            self.timers.callEvery( max( self.MinTimerInterval, self.configDesc.pingsInterval ), self.__pingPeers )
+
+        self.running = True
+
+    ########################
+    def stop( self ):
+        self.running = False
+        self.timers.cancelAll()
 
     ########################
     def getId( self ):
@@ -64,119 +189,230 @@ class NodeSimulator(QtCore.QThread):
         return self.uid
 
     ########################
-    def getStateSnapshot( self ):
-        addPeers = 1 if random.random() >= 0.45 else -1
-
-        self.peersNum += addPeers
+    def knowsTask( self, taskId ):
+        return taskId in self.taskServer.taskHeaders or taskId in self.taskServer.taskManager.tasks
 
-        if self.peersNum < 0:
-            self.peersNum = 0
-        if self.peersNum > 10:
-            self.peersNum = 10
-
-        addTasks = 1 if random.random() >= 0.5 else -1
+    ########################
+    def getStateSnapshot( self ):
+        if not self.running:
+            return NodeStateSnapshot( False, self.uid )
+
+        return NodeStateSnapshot(   True
+                                ,   self.uid
+                                ,   len( self.p2pservice.peers )
+                                ,   len( self.taskServer.taskHeaders )
+                                ,   self.host
+                                ,   self.p2pservice.p2pServer.curPort
+                                ,   self.p2pservice.getLastMessages()
+                                ,   self.taskServer.getLastMessages()
+                                ,   self.taskServer.taskComputer.getProgresses()
+                                ,   self.taskServer.taskManager.getProgresses()
+                                ,   self.p2pservice.getProtocolStats()
+                                ,   self.taskServer.getProtocolStats()
+                                ,   self.p2pservice.getPeersRtt()
+                                ,   self.taskServer.getOwnersRtt()
+                                ,   self.taskServer.getBandwidthStats() )
 
-        self.tasksNum += addTasks
+    ########################
+    def __pingPeers( self ):
+        self.p2pservice.pingPeers( self.configDesc.pingsInterval )
+
+class NetworkSimulation:
+    """
+    Discrete event simulation of nodes running the real network and task
+    scheduling code on SimReactor - virtual clock and simulated links
+    instead of sockets. Every node is a separate host listening on the same
+    ports, the first one is the seed of all others. Creating the simulation
+    installs SimReactor, so it must happen before anything imports twisted
+    reactor and it can be done once per process.
+    """
+
+    P2PPort             = 40102
+    SampleInterval      = 1.0   # virtual seconds between header propagation samples
+    CoverageLevels      = [ 0.5, 0.9, 1.0 ]
 
-        if self.tasksNum < 0:
-            self.tasksNum = 0
-        if self.tasksNum > 200:
-            self.tasksNum = 200
+    ########################
+    def __init__( self, link = None, seed = None, optNumPeers = 4, useDht = 0, taskRequestInterval = 1.0, performance = 1000.0, pingsInterval = 5.0 ):
+        self.reactor                = SimReactor( link, seed )
+        self.reactor.install()
 
-        curTime = time.time()
+        if seed is not None:
+            random.seed( seed )
 
-        ctl = self.remoteTaskDuration - ( curTime - self.remTaskStartTime )
-        ctl = max( 0.0, ctl )
-        tcss = TaskChunkStateSnapshot( '0xbaadf00d', 1600.0, ctl, self.remProgress, "chunk data: {}".format( self.remTask ) )
+        self.optNumPeers            = optNumPeers
+        self.useDht                 = useDht
+        self.taskRequestInterval    = taskRequestInterval
+        self.performance            = performance
+        self.pingsInterval          = pingsInterval
 
-        allChunks = 1000 * 1000
+        self.nodes                  = []
+        self.startTime              = self.reactor.seconds()
 
-        totalTasks = int( 1000.0 * self.locProgress )
-        totalChunks = 1000 * totalTasks
-        
-        activeRandom = random.random()
-        activeTasks = int( activeRandom * totalTasks )
-        activeChunks = int( activeRandom * totalChunks )
+        self.tasks                  = {}    # taskId -> [ SimTask, owner node, added time ]
+        self.coverage               = {}    # taskId -> { coverage level : virtual seconds after task was added }
+        self.assigned               = {}    # subTaskId -> assignment time
+        self.latencies              = []
+        self.finished               = []    # times of finished subtasks
 
-        descr = "nothing here"
-        lcT = self.locTask
+        self.reactor.callLater( self.SampleInterval, self.__sample )
 
-        if lcT < len( self.addedTasks ):
-            descr = self.addedTasks[ lcT ]
+    ########################
+    def addNode( self ):
+        id = len( self.nodes )
+        host = "10.{}.{}.{}".format( ( id + 1 ) >> 16 & 255, ( id + 1 ) >> 8 & 255, ( id + 1 ) & 255 )
+        node = SimulatedNode( self, id, host, self.__config( id ) )
 
-        ltss = LocalTaskStateSnapshot( '0xcdcdcdcd', totalTasks, totalChunks, activeTasks, activeChunks, allChunks - totalChunks, self.locProgress, descr ) 
+        self.reactor.addHost( host )
+        self.reactor.runAs( host, node.start )
+        self.nodes.append( node )
 
-        return NodeStateSnapshot( self.running, self.uid, self.peersNum, self.tasksNum, self.localAddr, self.localPort, ['test message {}'.format( random.randint(0,200) )], ['test message {}'.format( random.randint(10, 70) )], { '0' : tcss }, { '0xcdcdcd' : ltss } )
+        return node
 
     ########################
-    def run( self ):
-
-        startTime = time.time()
-        self.locTasksDuration = self.numLocalTasks * self.localTaskDuration
-        self.remTasksDuration = self.numRemoteTasks * self.remoteTaskDuration
-
-        self.totalDuration = max( self.locTasksDuration, self.remTasksDuration )
+    def removeNode( self, node ):
+        if node.running:
+            node.stop()
+            self.reactor.removeHost( node.host )
 
-        self.locTask = 0
-        self.locTaskStartTime = startTime
-        self.remTask = 0
-        self.remTaskStartTime = startTime
+    ########################
+    def getNode( self, uid ):
+        for node in self.nodes:
+            if node.getUid() == uid:
+                return node
 
-        print "Starting node '{}' local tasks: {} remote tasks: {}".format( self.uid, self.numLocalTasks, self.numRemoteTasks )
-        print "->local task dura: {} secs, remote task dura: {} secs".format( self.localTaskDuration, self.remoteTaskDuration )
+        return None
 
-        while( time.time() - startTime < self.totalDuration ):
-                
-            if GLOBAL_SHUTDOWN[ 0 ]:
-                print "{}: Global shutdown triggered - bailing out".format( self.uid )
-                break
+    ########################
+    def addTask( self, node, numSubTasks, work, resultSize = 1024, ttl = 3600.0, descr = "" ):
+        if not node.running:
+            return None
 
-            if self.forcedQuit:
-                print "{}: Forced quit triggered - bailing out".format( self.uid )
-                break
+        taskId = u"simtask{:05d}".format( len( self.tasks ) )
+        task = SimTask( TaskHeader( node.uid, taskId, u"", 0, ttl ), numSubTasks, work, resultSize, self, descr )
 
-            time.sleep( self.innerUpdateDelay )
+        self.tasks[ taskId ] = [ task, node, self.reactor.seconds() ]
+        self.coverage[ taskId ] = {}
+        self.reactor.runAs( node.host, node.taskServer.taskManager.addNewTask, task )
 
-            curTime = time.time()
+        return task
 
-            if self.locTask < self.numLocalTasks:
-                dt = curTime - self.locTaskStartTime
+    ########################
+    def runFor( self, duration ):
+        self.reactor.runUntil( self.reactor.seconds() + duration )
 
-                if dt <= self.localTaskDuration:
-                    self.locProgress = dt / self.localTaskDuration
-                else:
-                    self.locTaskStartTime = curTime
-                    self.locTask += 1
-                    self.locProgress = 0.0
+    ########################
+    def runUntil( self, until ):
+        self.reactor.runUntil( until )
 
-            if self.remTask < self.numRemoteTasks:
-                dt = curTime - self.remTaskStartTime
+    ########################
+    def elapsed( self ):
+        return self.reactor.seconds() - self.startTime
 
-                if dt <= self.remoteTaskDuration:
-                    self.remProgress = dt / self.remoteTaskDuration
-                else:
-                    self.remTaskStartTime = curTime
-                    self.remTask += 1
-                    self.remProgress = 0.0
+    ########################
+    def subTaskAssigned( self, taskId, subTaskId ):
+        self.assigned[ subTaskId ] = self.reactor.seconds()
 
-            self.simulator.updateRequested( self.id )
-            #self.updateRequest.emit()
-            #self.emit(QtCore.SIGNAL("Activated()"),self.dupa, QtCore.Qt.QueuedConnection)
-            #print "\r                                                                      ",
-            #print "\r{:3} : {}   {:3} : {}".format( locTask, self.locProgress, remTask, self.remProgress ),
+    ########################
+    def subTaskFinished( self, taskId, subTaskId ):
+        now = self.reactor.seconds()
+        if subTaskId in self.assigned:
+            self.latencies.append( now - self.assigned.pop( subTaskId ) )
+        self.finished.append( now )
 
-        print "Finished node '{}'".format( self.uid )
-        
-        if self.running:
-            self.running = False
-            self.simulator.updateRequested( self.id )
+    ########################
+    def report( self ):
+        running = [ n for n in self.nodes if n.running ]
+        peers = sorted( len( n.p2pservice.peers ) for n in running )
+        workers = sorted( n.subTasksComputed for n in self.nodes if n.subTasksComputed > 0 )
+
+        p2pBytes = 0
+        taskBytes = 0
+        for n in running:
+            p2pBytes += sum( s[ "bytes" ] for ( direction, name ), s in n.p2pservice.getProtocolStats().items() if direction == DIRECTION_OUT )
+            taskBytes += sum( s[ "bytes" ] for ( direction, name ), s in n.taskServer.getProtocolStats().items() if direction == DIRECTION_OUT )
+
+        headers = {}
+        for level in self.CoverageLevels:
+            times = [ c[ level ] for c in self.coverage.values() if level in c ]
+            headers[ "{:.0f}%".format( 100 * level ) ] = { "tasks" : len( times ), "seconds" : percentiles( times ) }
+
+        return {    "virtualSeconds"        : self.elapsed(),
+                    "nodes"                 : len( running ),
+                    "peers"                 : {     "mean"      : sum( peers ) / float( len( peers ) ) if peers else 0.0,
+                                                    "min"       : peers[ 0 ] if peers else 0,
+                                                    "max"       : peers[ -1 ] if peers else 0,
+                                                    "isolated"  : peers.count( 0 ) },
+                    "headerCoverage"        : headers,
+                    "subtasksAssigned"      : sum( t[ 0 ].given for t in self.tasks.values() ),
+                    "subtasksDone"          : len( self.finished ),
+                    "subtasksPerSecond"     : len( self.finished ) / self.elapsed() if self.elapsed() > 0.0 else 0.0,
+                    "resultLatency"         : percentiles( self.latencies ),
+                    "workers"               : len( workers ),
+                    "busiestWorkerShare"    : workers[ -1 ] / float( sum( workers ) ) if workers else 0.0,
+                    "bytesSent"             : { "p2p" : p2pBytes, "task" : taskBytes } }
 
-class LocalNetworkSimulator(Thread):
+    ########################
+    def __config( self, id ):
+        cfg = ClientConfigDescriptor()
+        cfg.clientUid               = u"sim{:05d}".format( id )
+        cfg.startPort               = self.P2PPort
+        cfg.endPort                 = self.P2PPort + 2
+        cfg.optNumPeers             = self.optNumPeers
+        cfg.sendPings               = 1
+        cfg.pingsInterval           = self.pingsInterval
+        cfg.taskRequestInterval     = self.taskRequestInterval
+        cfg.estimatedPerformance    = self.performance * random.uniform( 0.5, 1.5 )
+        cfg.maxResultsSendignDelay  = 10.0
+        cfg.useDht                  = self.useDht
+
+        if id > 0:
+            cfg.seedHost            = self.nodes[ 0 ].host
+            cfg.seedHostPort        = self.P2PPort
+
+        return cfg
 
     ########################
-    def __init__(self, manager, numNodes, maxLocalTasks, maxRemoteTasks, maxLocalTaskDuration, maxRemoteTaskDuration, maxInnerUpdateDelay, nodeSpawnDelay ):
-        super(LocalNetworkSimulator, self).__init__()
+    def __sample( self ):
+        now = self.reactor.seconds()
+        running = [ n for n in self.nodes if n.running ]
+
+        for taskId, coverage in self.coverage.items():
+            if len( coverage ) == len( self.CoverageLevels ) or not running:
+                continue
+
+            known = len( [ n for n in running if n.knowsTask( taskId ) ] ) / float( len( running ) )
+            for level in self.CoverageLevels:
+                if level not in coverage and known >= level:
+                    coverage[ level ] = now - self.tasks[ taskId ][ 2 ]
+
+        self.reactor.callLater( self.SampleInterval, self.__sample )
+
+############################
+def percentiles( samples ):
+    if not samples:
+        return None
+
+    s = sorted( samples )
+    return {    "p50"   : s[ len( s ) / 2 ],
+                "p95"   : s[ min( len( s ) - 1, int( len( s ) * 0.95 ) ) ],
+                "max"   : s[ -1 ] }
+
+class RealTimeSimulation:
+    """
+    Runs NetworkSimulation for nodes manager, virtual time follows real one
+    multiplied by speed. Nodes join at randomized nodeSpawnDelay intervals
+    and every node submits up to maxLocalTasks tasks, one every
+    maxLocalTaskDuration seconds. Task has up to maxRemoteTasks subtasks and
+    a subtask takes up to maxRemoteTaskDuration seconds on a node of average
+    performance. Snapshots of all nodes are sent to manager every
+    maxInnerUpdateDelay seconds. Simulation installs its reactor and clock
+    in the process, so it runs in child process of LocalNetworkSimulator.
+    """
+
+    Performance = 1000.0
 
+    ########################
+    def __init__(self, manager, numNodes, maxLocalTasks, maxRemoteTasks, maxLocalTaskDuration, maxRemoteTaskDuration, maxInnerUpdateDelay, nodeSpawnDelay, speed = 1.0, link = None ):
         self.manager = manager
         self.numNodes = numNodes
         self.maxLocTasks = maxLocalTasks
@@ -185,45 +421,27 @@ class LocalNetworkSimulator(Thread):
         self.maxRemTaskDura = maxRemoteTaskDuration
         self.maxInnerUpdateDelay = maxInnerUpdateDelay
         self.nodeSpawnDelay = nodeSpawnDelay
-        self.curNode = 0
-        self.lock = Lock()
+        self.speed = speed
 
-        self.nodes = []
+        self.simulation = NetworkSimulation( link, performance = self.Performance )
+        self.reactor = self.simulation.reactor
 
     ########################
     def terminateAllNodes( self ):
-        with self.lock:
-            for node in self.nodes:
-                node.terminate()
+        self.reactor.callFromThread( self.__terminateAllNodes )
 
     ########################
     def terminateNode( self, uid ):
-        with self.lock:
-            for i, node in enumerate( self.nodes ):
-                if node.getUid() == uid:
-                    node.terminate()
-                    #self.nodes.pop( i )
-                    break
+        self.reactor.callFromThread( self.__terminateNode, uid )
 
     ########################
     def enqueueNodeTask( self, uid, w, h, numSamplesPerPixel, fileName ):
-        with self.lock:
-            for node in self.nodes:
-                if node.getUid() == uid:
-                    node.enqueueTask( w, h, numSamplesPerPixel, fileName )
+        descr = "w: {}, h: {}, spp: {}, file: {}".format( w, h, numSamplesPerPixel, fileName )
+        self.reactor.callFromThread( self.__enqueueNodeTask, uid, descr )
 
     ########################
     def addNewNode( self ):
-        with self.lock:
-            node = self.createNewNode( self.curNode )
-            self.nodes.append( node )
-            node.start()
-            self.curNode += 1
-            #node.updateRequest.connect( self.updateRequested )
-
-    ########################
-    def updateRequested( self, id ):
-        self.manager.appendStateUpdate( self.nodes[ id ].getStateSnapshot() )
+        self.reactor.callFromThread( self.__addNewNode )
 
     ########################
     def getRandomizedUp( self, value, scl = 1.4 ):
@@ -234,36 +452,251 @@ class LocalNetworkSimulator(Thread):
         return ( 1.0 - random.random() * scl ) * value
 
     ########################
-    def createNewNode( self, id ):
-        uid = "gen - uid - {}".format( id )
+    def run( self ):
+        print "Starting network simulator for {} nodes".format( self.numNodes )
+
+        self.reactor.callLater( 0.0, self.__spawnNode )
+        self.reactor.callLater( self.maxInnerUpdateDelay, self.__sendSnapshots )
+
+        realStart = realTime()
+        virtualStart = self.reactor.seconds()
+
+        while not GLOBAL_SHUTDOWN[ 0 ]:
+            self.simulation.runUntil( virtualStart + ( realTime() - realStart ) * self.speed )
+            time.sleep( 0.05 )
+
+        self.__terminateAllNodes()
+
+        print "Simulation finished after {:.1f} virtual seconds".format( self.simulation.elapsed() )
+
+    ########################
+    def __spawnNode( self ):
+        if GLOBAL_SHUTDOWN[ 0 ] or len( self.simulation.nodes ) >= self.numNodes:
+            return
+
+        self.__addNewNode()
+        self.reactor.callLater( self.getRandomizedUp( self.nodeSpawnDelay ), self.__spawnNode )
+
+    ########################
+    def __addNewNode( self ):
+        node = self.simulation.addNode()
         numLocTasks = int( self.getRandomizedDown( self.maxLocTasks ) )
-        numRemTasks = int( self.getRandomizedDown( self.maxRemTasks ) )
-        locTaskDura = self.getRandomizedDown( self.maxLocTaskDura )
-        remTaskDura = self.getRandomizedDown( self.maxRemTaskDura )
-        updateDelay = self.getRandomizedDown( self.maxInnerUpdateDelay )
 
-        return NodeSimulator( self, id, uid, numLocTasks, numRemTasks, locTaskDura, remTaskDura, updateDelay )
+        for i in range( numLocTasks ):
+            self.reactor.callLater( ( i + 1 ) * self.getRandomizedDown( self.maxLocTaskDura ), self.__addTask, node, "" )
+
+        self.manager.appendStateUpdate( node.getStateSnapshot() )
+
+    ########################
+    def __addTask( self, node, descr ):
+        numSubTasks = max( 1, int( self.getRandomizedDown( self.maxRemTasks ) ) )
+        work = self.getRandomizedDown( self.maxRemTaskDura ) * self.Performance
+        self.simulation.addTask( node, numSubTasks, work, descr = descr )
+
+    ########################
+    def __enqueueNodeTask( self, uid, descr ):
+        node = self.simulation.getNode( uid )
+        if node:
+            self.__addTask( node, descr )
+
+    ########################
+    def __terminateNode( self, uid ):
+        node = self.simulation.getNode( uid )
+        if node and node.running:
+            self.simulation.removeNode( node )
+            self.manager.appendStateUpdate( node.getStateSnapshot() )
+
+    ########################
+    def __terminateAllNodes( self ):
+        for node in self.simulation.nodes:
+            self.__terminateNode( node.getUid() )
+
+    ########################
+    def __sendSnapshots( self ):
+        for node in self.simulation.nodes:
+            if node.running:
+                self.manager.appendStateUpdate( node.getStateSnapshot() )
+
+        self.reactor.callLater( self.maxInnerUpdateDelay, self.__sendSnapshots )
+
+class LocalNetworkSimulator(Thread):
+    """
+    Runs RealTimeSimulation for nodes manager in child process, so reactor
+    and clock of manager are not replaced. Commands are pickled to stdin of
+    the child and snapshots of nodes come back pickled on its stdout. When
+    GLOBAL_SHUTDOWN is set stdin is closed, the child terminates all nodes,
+    sends their last snapshots and exits.
+    """
+
+    Commands = [ "terminateAllNodes", "terminateNode", "enqueueNodeTask", "addNewNode" ]
+
+    ########################
+    def __init__(self, manager, numNodes, maxLocalTasks, maxRemoteTasks, maxLocalTaskDuration, maxRemoteTaskDuration, maxInnerUpdateDelay, nodeSpawnDelay, speed = 1.0, link = None ):
+        super(LocalNetworkSimulator, self).__init__()
+
+        self.manager = manager
+        self.params = ( numNodes, maxLocalTasks, maxRemoteTasks, maxLocalTaskDuration, maxRemoteTaskDuration, maxInnerUpdateDelay, nodeSpawnDelay, speed, link )
+        self.lock = Lock()
+        self.process = None
+
+    ########################
+    def start( self ):
+        script = os.path.splitext( os.path.abspath( __file__ ) )[ 0 ] + ".py"
+        self.process = subprocess.Popen( [ sys.executable, script, "--serve" ], cwd = os.path.dirname( script ), stdin = subprocess.PIPE, stdout = subprocess.PIPE )
+        self.__send( self.params )
+
+        super(LocalNetworkSimulator, self).start()
+
+    ########################
+    def terminateAllNodes( self ):
+        self.__send( ( "terminateAllNodes", () ) )
+
+    ########################
+    def terminateNode( self, uid ):
+        self.__send( ( "terminateNode", ( uid, ) ) )
+
+    ########################
+    def enqueueNodeTask( self, uid, w, h, numSamplesPerPixel, fileName ):
+        self.__send( ( "enqueueNodeTask", ( uid, w, h, numSamplesPerPixel, fileName ) ) )
+
+    ########################
+    def addNewNode( self ):
+        self.__send( ( "addNewNode", () ) )
 
     ########################
     def run( self ):
-        time.sleep( 1 ) #just out of decency
+        reader = Thread( target = self.__readSnapshots )
+        reader.daemon = True
+        reader.start()
 
-        curTime = time.time()
+        while not GLOBAL_SHUTDOWN[ 0 ] and reader.isAlive():
+            time.sleep( 0.05 )
 
-        print "Starting node simulator for {} nodes".format( self.numNodes )
+        with self.lock:
+            self.process.stdin.close()
 
-        while not GLOBAL_SHUTDOWN[ 0 ]:
+        reader.join()
+        self.process.wait()
+
+    ########################
+    def __readSnapshots( self ):
+        try:
+            while True:
+                self.manager.appendStateUpdate( pickle.load( self.process.stdout ) )
+        except EOFError:
+            pass
 
-            if self.curNode < self.numNodes:
-                self.addNewNode()
+    ########################
+    def __send( self, obj ):
+        with self.lock:
+            if not self.process or self.process.stdin.closed:
+                return
 
-            time.sleep( self.getRandomizedUp( self.nodeSpawnDelay ) )
+            try:
+                pickle.dump( obj, self.process.stdin, pickle.HIGHEST_PROTOCOL )
+                self.process.stdin.flush()
+            except IOError as ex:
+                print "Network simulator process failure: {}".format( ex )
 
-        print "Local network simulator finished running."
-        print "Waiting for nodes to finish"
+class SnapshotWriter:
+    """Manager of RealTimeSimulation in child process, pickles snapshots to LocalNetworkSimulator"""
 
-        #10 seconds should be just enough for each node to do its cleanup
-        for node in self.nodes:
-            node.wait()
+    ########################
+    def __init__( self, out ):
+        self.out = out
 
-        print "Simulation finished"
+    ########################
+    def appendStateUpdate( self, snapshot ):
+        pickle.dump( snapshot, self.out, pickle.HIGHEST_PROTOCOL )
+        self.out.flush()
+
+############################
+def serveSimulation( commands, out ):
+    """Child process side of LocalNetworkSimulator, runs until commands are closed"""
+    if sys.platform == "win32":
+        import msvcrt
+        msvcrt.setmode( commands.fileno(), os.O_BINARY )
+        msvcrt.setmode( out.fileno(), os.O_BINARY )
+
+    simulator = RealTimeSimulation( SnapshotWriter( out ), *pickle.load( commands ) )
+
+    def readCommands():
+        try:
+            while True:
+                name, args = pickle.load( commands )
+                if name in LocalNetworkSimulator.Commands:
+                    getattr( simulator, name )( *args )
+        except EOFError:
+            pass
+        finally:
+            GLOBAL_SHUTDOWN[ 0 ] = True
+
+    reader = Thread( target = readCommands )
+    reader.daemon = True
+    reader.start()
+
+    simulator.run()
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import shutil
+    import tempfile
+
+    parser = argparse.ArgumentParser( description = "Simulates network of nodes in virtual time, prints JSON report" )
+    parser.add_argument( "--nodes", type = int, default = 1000 )
+    parser.add_argument( "--spawn-time", type = float, default = 60.0, help = "virtual seconds over which nodes join" )
+    parser.add_argument( "--peers", type = int, default = 4, help = "optimal number of peers of every node" )
+    parser.add_argument( "--dht", type = int, default = 0 )
+    parser.add_argument( "--latency", type = float, default = 0.05, help = "one way latency of links in seconds" )
+    parser.add_argument( "--bandwidth", type = int, default = 0, help = "bytes per second of every link, 0 - unlimited" )
+    parser.add_argument( "--loss", type = float, default = 0.0, help = "packet loss probability of every link" )
+    parser.add_argument( "--tasks", type = int, default = 10, help = "tasks submitted by random nodes after all joined" )
+    parser.add_argument( "--subtasks", type = int, default = 100, help = "subtasks of every task" )
+    parser.add_argument( "--subtask-time", type = float, default = 30.0, help = "seconds of subtask on node of average performance" )
+    parser.add_argument( "--result-size", type = int, default = 64 * 1024 )
+    parser.add_argument( "--request-interval", type = float, default = 1.0, help = "task request interval of every node" )
+    parser.add_argument( "--duration", type = float, default = 600.0, help = "virtual seconds simulated after tasks are submitted" )
+    parser.add_argument( "--seed", type = int, default = None )
+    parser.add_argument( "--verbose", action = "store_true", help = "keep output of nodes on stderr" )
+    parser.add_argument( "--serve", action = "store_true", help = "run simulation of nodes manager controlled over stdin and stdout by LocalNetworkSimulator" )
+    args = parser.parse_args()
+
+    # nodes keep their files relative to working directory, modules are imported from paths relative to this one
+    sys.path = [ os.path.abspath( p ) for p in sys.path ]
+    workDir = tempfile.mkdtemp( prefix = "networksimulator" )
+    os.chdir( workDir )
+
+    stdout = sys.stdout
+    sys.stdout = sys.stderr if args.verbose or args.serve else open( os.devnull, "w" )
+
+    if args.serve:
+        try:
+            serveSimulation( sys.stdin, stdout )
+        finally:
+            os.chdir( "/" )
+            shutil.rmtree( workDir, True )
+        sys.exit( 0 )
+
+    try:
+        realStart = realTime()
+        simulation = NetworkSimulation( Link( args.latency, args.bandwidth, args.loss ), args.seed, args.peers, args.dht, args.request_interval )
+
+        for i in range( args.nodes ):
+            simulation.runUntil( simulation.startTime + args.spawn_time * i / args.nodes )
+            simulation.addNode()
+
+        simulation.runUntil( simulation.startTime + args.spawn_time )
+
+        for i in range( args.tasks ):
+            simulation.addTask( random.choice( simulation.nodes ), args.subtasks, args.subtask_time * simulation.performance, args.result_size )
+
+        simulation.runFor( args.duration )
+
+        report = simulation.report()
+        report[ "realSeconds" ] = realTime() - realStart
+    finally:
+        os.chdir( "/" )
+        shutil.rmtree( workDir, True )
+
+    stdout.write( json.dumps( report, indent = 2, sort_keys = True ) + "\n" )
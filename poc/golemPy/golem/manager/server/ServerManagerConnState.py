@@ -17,29 +17,20 @@ class ServerManagerConnState( ConnectionState ):
 
     ############################
     def connectionMade( self ):
-        self.opened = True
+        ConnectionState.connectionMade( self )
         pp = self.transport.getPeer()
         self.managerSession = ServerManagerSession( self, pp.host, pp.port, self.server )
         self.server.newConnection( self.managerSession )
 
     ############################
-    def dataReceived(self, data):
-        assert self.opened
-
-        self.db.appendString(data)
-        mess = Message.deserialize( self.db )
-        if mess is None:
-            print "Deserialization message failed"
-            self.managerSession.interpret( None )
-
+    def _interpret( self, msg ):
         if self.managerSession:
-            for m in mess:
-                self.managerSession.interpret(m)
+            self.managerSession.interpret( msg )
         else:
             print "manager session for connection is None"
             assert False
 
     ############################
     def connectionLost(self, reason):
-        self.opened = False
+        ConnectionState.connectionLost( self, reason )
         self.managerSession.dropped()
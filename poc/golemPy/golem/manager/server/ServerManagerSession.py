@@ -24,6 +24,9 @@ class ServerManagerSession:
     ##########################
     def interpret( self, msg ):
 
+        if msg is None:
+            return
+
         type = msg.getType()
 
         if type == MessagePeerStatus.Type:
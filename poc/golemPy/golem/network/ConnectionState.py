@@ -1,17 +1,98 @@
 
 import abc
+import struct
+import time
+from collections import deque
 
+from zope.interface import implementer
 from twisted.internet.protocol import Protocol 
-from Message import Message, MessageHello, MessagePing, MessagePong
+from twisted.internet.interfaces import IPushProducer
+from Message import Message, MessageHello, MessagePing, MessagePong, CODEC_PICKLE, CODEC_BINARY
 from databuffer import DataBuffer
+from Compress import compressFrame, isCompressedFrame, decompressFrame, FRAME_COMPRESSION_ALGORITHMS
+from ProtocolStats import DIRECTION_IN, DIRECTION_OUT
 
+@implementer( IPushProducer )
 class ConnectionState(Protocol):
+
+    # Default limits, subclasses and sessions may change them with setFrameLimits
+    MaxFrameSize    = 16 * 1024 * 1024
+    # Bytes that may be buffered on top of one partial frame (a few socket reads)
+    BufferSlack     = 256 * 1024
+    # Size of single transport write when streaming bulk data
+    BulkChunkSize   = 64 * 1024
+    # Larger frames are compressed if the peer supports compression
+    CompressionThreshold = 4 * 1024
+    # Optional protocol features advertised in hello
+    Features        = []
+
     ############################
     def __init__(self ):
         self.peer = None
         self.db = DataBuffer()
         self.opened = False
 
+        # Until peer's hello arrives we only send what every node understands
+        self.codec = CODEC_PICKLE
+        self.compression = None
+        self.peerMaxFrameSize = 0
+        self.peerFeatures = set()
+
+        self.frameSize = None   # size of the frame being received, None until its length prefix arrives
+        self.maxFrameSize = self.MaxFrameSize
+        self.maxBufferedSize = self.MaxFrameSize + 4 + self.BufferSlack
+
+        self.sendQueue = []         # frames waiting for the next flush
+        self.bulkQueue = deque()    # frames of bulk messages, sent after control frames
+        self.bulkStreams = []       # [ stream, onSent ] pairs sent after all queued frames
+        self.bulkLimits = []        # TokenBuckets shared by bulk data, the first one is of this connection
+        self.flushScheduled = False
+        self.shapingCall = None     # delayed flush waiting for bulk tokens
+        self.producerPaused = False
+        self.closeRequested = False
+
+        self.stats = None           # ProtocolStats of the service owning this connection
+        self.capture = None         # CaptureLog of frames, see setCapture
+        self.captureId = None
+
+    ############################
+    def setCodec( self, codec ):
+        self.codec = codec
+
+    ############################
+    def setStats( self, stats ):
+        self.stats = stats
+
+    ############################
+    def setCapture( self, capture, kind ):
+        """Appends frames of this connection to CaptureLog, raw streams are not captured"""
+        pp = self.transport.getPeer()
+        self.capture = capture
+        self.captureId = capture.sessionOpened( kind, pp.host, pp.port )
+
+    ############################
+    def addFeature( self, feature ):
+        """Advertises optional feature enabled by configuration, must be called before hello is sent"""
+        self.Features = self.Features + [ feature ]
+
+    ############################
+    def setFrameLimits( self, maxFrameSize, maxBufferedSize = None ):
+        self.maxFrameSize = maxFrameSize
+
+        if maxBufferedSize is None:
+            maxBufferedSize = maxFrameSize + 4 + self.BufferSlack
+
+        self.maxBufferedSize = maxBufferedSize
+
+    ############################
+    def setBulkLimits( self, buckets ):
+        self.bulkLimits = buckets
+
+    ############################
+    def bulkRate( self ):
+        """Bytes per second of bulk data sent recently over this connection"""
+        return self.bulkLimits[ 0 ].currentRate() if self.bulkLimits else 0.0
+
     ############################
     def sendMessage(self, msg):
         if not self.opened:
@@ -19,37 +100,295 @@ class ConnectionState(Protocol):
             print "sendMessage failed - connection closed."
             return False
 
-        serMsg = msg.serialize()
+        start = time.time()
+
+        if msg.getType() == MessageHello.Type:
+            self.__advertiseCapabilities( msg )
+            serMsg = msg.serialize( CODEC_PICKLE )
+        else:
+            serMsg = msg.serialize( self.codec )
+
+            if self.compression and len( serMsg ) > self.CompressionThreshold:
+                serMsg = compressFrame( serMsg, self.compression ) or serMsg
+
+        if self.peerMaxFrameSize and len( serMsg ) > self.peerMaxFrameSize:
+            print "Message {} of {} bytes exceeds peer frame size limit {}".format( msg, len( serMsg ), self.peerMaxFrameSize )
+            if self.stats:
+                self.stats.error( DIRECTION_OUT, msg.getType() )
+            return False
+
+        if self.stats:
+            self.stats.messageSent( msg.getType(), len( serMsg ) + 4, time.time() - start )
+
+        if self.capture:
+            self.capture.frame( self.captureId, False, serMsg )
+
+        if msg.Bulk:
+            self.bulkQueue.append( ( struct.pack( "!L", len( serMsg ) ), serMsg ) )
+        else:
+            self.sendQueue.append( struct.pack( "!L", len( serMsg ) ) )
+            self.sendQueue.append( serMsg )
 
-        db = DataBuffer()
-        db.appendLenPrefixedString( serMsg )
-        self.transport.getHandle()
-        self.transport.write( db.readAll() )
+        self.__scheduleFlush()
 
         return True
 
     ############################
-    @abc.abstractmethod
+    def sendStream( self, stream, onSent = None ):
+        """
+        Queues raw (not framed) data read from file-like stream. The data is
+        written in BulkChunkSize pieces only while the transport accepts it
+        and bulk limits allow it, messages queued in the meantime are written
+        first. onSent is called after the whole stream has been handed over
+        to the transport.
+        """
+        if not self.opened:
+            print "sendStream failed - connection closed."
+            stream.close()
+            return False
+
+        self.bulkStreams.append( [ stream, onSent ] )
+        self.__scheduleFlush()
+
+        return True
+
+    ############################
+    def sendFile( self, fileName, onSent = None ):
+        return self.sendStream( open( fileName, "rb" ), onSent )
+
+    ############################
+    def flush( self ):
+        """
+        Writes all queued control frames with a single call, then bulk frames
+        and streams until the transport pauses us or bulk limits are reached
+        """
+        self.flushScheduled = False
+
+        if not self.opened:
+            return
+
+        if self.sendQueue:
+            self.transport.writeSequence( self.sendQueue )
+            self.sendQueue = []
+
+        while ( self.bulkQueue or self.bulkStreams ) and not self.producerPaused:
+            wait = max( [ b.delay() for b in self.bulkLimits ] + [ 0.0 ] )
+            if wait > 0.0:
+                self.__scheduleShapedFlush( wait )
+                break
+
+            if self.bulkQueue:
+                frame = self.bulkQueue.popleft()
+                self.transport.writeSequence( frame )
+                self.__bulkSent( len( frame[ 0 ] ) + len( frame[ 1 ] ) )
+                continue
+
+            stream, onSent = self.bulkStreams[ 0 ]
+            data = stream.read( self.BulkChunkSize )
+
+            if data:
+                self.transport.write( data )
+                self.__bulkSent( len( data ) )
+            else:
+                stream.close()
+                self.bulkStreams.pop( 0 )
+                if onSent:
+                    onSent()
+
+        if self.closeRequested and not self.sendQueue and not self.bulkQueue and not self.bulkStreams:
+            self.__loseConnection()
+
+    ############################
+    def pendingBulkStreams( self ):
+        return len( self.bulkStreams )
+
+    ############################
+    def pendingBulkFrames( self ):
+        return len( self.bulkQueue )
+
+    ############################
     def connectionMade(self):
         """Called when new connection is successfully opened"""
-        return
+        self.opened = True
+        self.transport.registerProducer( self, True )
 
     ############################
-    @abc.abstractmethod
     def dataReceived(self, data):
         """Called when additional chunk of data is received from another peer"""
-        return
+        assert self.opened
+
+        self.db.appendString( data )
+
+        if self.db.dataSize() > self.maxBufferedSize:
+            self._protocolError( "{} bytes buffered, limit is {}".format( self.db.dataSize(), self.maxBufferedSize ) )
+            return
+
+        self._parseFrames()
 
     ############################
-    @abc.abstractmethod
     def connectionLost(self, reason):
         """Called when connection is lost (for whatever reason)"""
-        return
+        self.opened = False
+        self.sendQueue = []
+        self.bulkQueue.clear()
+
+        if self.capture:
+            self.capture.sessionClosed( self.captureId )
+            self.capture = None
+
+        if self.shapingCall and self.shapingCall.active():
+            self.shapingCall.cancel()
+
+        for stream, onSent in self.bulkStreams:
+            stream.close()
+        self.bulkStreams = []
 
     ############################
     def close(self):
-        self.transport.loseConnection()
+        """Closes connection after all queued data is written"""
+        if self.opened and ( self.sendQueue or self.bulkQueue or self.bulkStreams ):
+            self.closeRequested = True
+            self.flush()
+        else:
+            self.__loseConnection()
+
+    ############################
+    # IPushProducer - the transport pauses us when its write buffer is full
+    def pauseProducing( self ):
+        self.producerPaused = True
+
+    ############################
+    def resumeProducing( self ):
+        self.producerPaused = False
+        if self.bulkQueue or self.bulkStreams:
+            self.flush()
+
+    ############################
+    def stopProducing( self ):
+        self.producerPaused = True
 
     ############################
     def isOpen(self):
         return self.opened
+
+    ############################
+    def peerSupports( self, feature ):
+        return feature in self.peerFeatures
+
+    ############################
+    def bytesNeeded( self ):
+        """Number of bytes missing to complete the length prefix or the frame being received"""
+        if self.frameSize is None:
+            return max( 4 - self.db.dataSize(), 0 )
+
+        return max( self.frameSize - self.db.dataSize(), 0 )
+
+    ############################
+    @abc.abstractmethod
+    def _interpret( self, msg ):
+        """Called for every received message, msg is None if frame could not be decoded"""
+        return
+
+    ############################
+    def _parseFrames( self ):
+        while self.opened:
+            if self.frameSize is None:
+                if self.db.dataSize() < 4:
+                    return
+
+                self.frameSize = self.db.readUInt()
+
+                if self.frameSize > self.maxFrameSize:
+                    self._protocolError( "Frame of {} bytes exceeds limit of {} bytes".format( self.frameSize, self.maxFrameSize ) )
+                    return
+
+            if self.db.dataSize() < self.frameSize:
+                return
+
+            frame = self.db.readView( self.frameSize )
+            self.frameSize = None
+
+            self._frameReceived( frame )
+
+    ############################
+    def _frameReceived( self, frame ):
+        msg = None
+        frameSize = len( frame ) + 4
+        start = time.time()
+
+        if self.capture:
+            self.capture.frame( self.captureId, True, frame )
+
+        try:
+            if isCompressedFrame( frame ):
+                frame = decompressFrame( frame, self.maxFrameSize )
+
+            msg = Message.deserializeMessage( frame )
+        except Exception as ex:
+            print "Cannot deserialize message len: {} : {}".format( len( frame ), ex )
+
+        decoded = time.time()
+
+        if msg is None:
+            print "Deserialization message failed"
+            if self.stats:
+                self.stats.error( DIRECTION_IN )
+        elif msg.getType() == MessageHello.Type:
+            self.__capabilitiesReceived( msg )
+
+        self._interpret( msg )
+
+        if self.stats and msg is not None:
+            self.stats.messageReceived( msg.getType(), frameSize, decoded - start )
+            self.stats.messageHandled( msg.getType(), time.time() - decoded )
+
+    ############################
+    def _protocolError( self, reason ):
+        print "Protocol error, dropping connection: {}".format( reason )
+        self.opened = False
+        self.__loseConnection()
+
+    ############################
+    def __advertiseCapabilities( self, msg ):
+        msg.codecVersion    = CODEC_BINARY
+        msg.compression     = FRAME_COMPRESSION_ALGORITHMS
+        msg.maxFrameSize    = self.maxFrameSize
+        msg.features        = self.Features
+
+    ############################
+    def __capabilitiesReceived( self, msg ):
+        self.codec = min( msg.codecVersion, CODEC_BINARY )
+
+        self.compression = None
+        for alg in FRAME_COMPRESSION_ALGORITHMS:
+            if alg in msg.compression:
+                self.compression = alg
+                break
+
+        self.peerMaxFrameSize = msg.maxFrameSize
+        self.peerFeatures = set( msg.features )
+
+    ############################
+    def __scheduleFlush( self ):
+        if not self.flushScheduled:
+            from twisted.internet import reactor
+            self.flushScheduled = True
+            reactor.callLater( 0, self.flush )
+
+    ############################
+    def __scheduleShapedFlush( self, delay ):
+        if not self.shapingCall or not self.shapingCall.active():
+            from twisted.internet import reactor
+            self.shapingCall = reactor.callLater( delay, self.flush )
+
+    ############################
+    def __bulkSent( self, size ):
+        for b in self.bulkLimits:
+            b.consume( size )
+
+    ############################
+    def __loseConnection( self ):
+        # a registered producer that is paused would keep the transport from closing
+        if getattr( self.transport, "producer", None ) is not None:
+            self.transport.unregisterProducer()
+        self.transport.loseConnection()
@@ -0,0 +1,35 @@
+from NetConnState import NetConnState
+from Message import MessageDhtNodes
+
+class DhtRpcSession:
+    """
+    Short lived connection to overlay node which is not our peer. It sends
+    one request, passes the answer to dht service and closes.
+    """
+
+    ConnectionStateType = NetConnState
+
+    ##########################
+    def __init__( self, conn ):
+        self.conn       = conn
+        self.dhtService = None
+        self.requestId  = None
+
+    ##########################
+    def request( self, msg ):
+        self.requestId = msg.requestId
+        self.conn.sendMessage( msg )
+
+    ##########################
+    def interpret( self, msg ):
+        # hello and ping of the other side are ignored
+        if msg is not None and msg.getType() == MessageDhtNodes.Type and msg.requestId == self.requestId:
+            self.dhtService.responseReceived( msg )
+            self.requestId = None
+            self.conn.close()
+
+    ##########################
+    def dropped( self ):
+        if self.requestId is not None:
+            self.dhtService.responseMissing( self.requestId )
+            self.requestId = None
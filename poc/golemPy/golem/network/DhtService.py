@@ -0,0 +1,202 @@
+import time
+
+from Message import MessageDhtFindNode, MessageDhtFindTask, MessageDhtStoreTask, MessageDhtNodes
+from Kademlia import RoutingTable, Lookup, Contact, dhtId, dhtIdToText
+from DhtRpcSession import DhtRpcSession
+from network import Network
+
+class DhtService:
+    """
+    Kademlia-like overlay over client uids. Nodes are looked up in O(log N)
+    hops and task headers are stored at nodes closest to task ids. Requests
+    go over peer connection if the node is our peer or over short lived
+    DhtRpcSession connection otherwise.
+    """
+
+    RpcTimeout          = 3.0
+    BootstrapInterval   = 5.0       # refresh while routing table is small
+    RefreshInterval     = 600.0
+    MaxStoredTasks      = 10000
+
+    ############################
+    def __init__( self, p2pService ):
+        self.p2pService     = p2pService
+        self.uid            = p2pService.configDesc.clientUid
+        self.table          = RoutingTable( self.uid )
+        self.pending        = {}    # requestId -> ( deadline, contact, onReply )
+        self.nextRequestId  = 1
+        self.storedTasks    = {}    # taskId -> ( expires, task header dict )
+        self.lastRefresh    = 0.0
+
+    ############################
+    def contactSeen( self, uid, address, port ):
+        self.table.update( Contact( uid, address, port ) )
+
+    ############################
+    def sync( self ):
+        now = time.time()
+
+        for requestId, ( deadline, contact, onReply ) in self.pending.items():
+            if deadline < now:
+                self.responseMissing( requestId )
+
+        for taskId, ( expires, th ) in self.storedTasks.items():
+            if expires < now:
+                del self.storedTasks[ taskId ]
+
+        interval = self.BootstrapInterval if len( self.table ) < RoutingTable.K else self.RefreshInterval
+        if len( self.table ) > 0 and now - self.lastRefresh > interval:
+            self.refresh()
+
+    ############################
+    def refresh( self ):
+        """Looks up own id, which fills buckets near us and lets close nodes know about us"""
+        self.lastRefresh = time.time()
+        self.__lookup( dhtId( self.uid ), lambda l: None )
+
+    ############################
+    def findNode( self, uid, callback ):
+        """Calls callback( contact or None, number of rpcs )"""
+        self.__lookup( dhtId( uid ), lambda l: callback( l.found, l.rpcs ), targetUid = uid )
+
+    ############################
+    def findTask( self, taskId, callback ):
+        """Calls callback( task header dict or None, number of rpcs )"""
+        if taskId in self.storedTasks:
+            callback( self.storedTasks[ taskId ][ 1 ], 0 )
+            return
+
+        self.__lookup( dhtId( taskId ), lambda l: callback( l.taskHeader, l.rpcs ), taskId = taskId )
+
+    ############################
+    def storeTask( self, thDictRepr ):
+        """Stores task header at nodes closest to its id"""
+        self.__storeLocal( thDictRepr )
+
+        def store( lookup ):
+            for c in lookup.closest():
+                self.__rpc( c, MessageDhtStoreTask( 0, self.uid, self.__port(), thDictRepr ), lambda nodes, th: None )
+
+        self.__lookup( dhtId( thDictRepr[ "id" ] ), store )
+
+    ############################
+    def requestReceived( self, msg, address ):
+        """Returns answer to dht request or False if request is malformed"""
+        if not self.__validRequest( msg ):
+            return False
+
+        self.contactSeen( msg.senderId, address, msg.senderPort )
+
+        if msg.getType() == MessageDhtFindNode.Type:
+            return MessageDhtNodes( msg.requestId, self.__closestDicts( long( msg.target, 16 ) ) )
+
+        elif msg.getType() == MessageDhtFindTask.Type:
+            stored = self.storedTasks.get( msg.taskId )
+            return MessageDhtNodes( msg.requestId, self.__closestDicts( dhtId( msg.taskId ) ), stored[ 1 ] if stored else None )
+
+        elif msg.getType() == MessageDhtStoreTask.Type:
+            self.__storeLocal( msg.taskHeader )
+            return MessageDhtNodes( msg.requestId, [] )
+
+        return False
+
+    ############################
+    def responseReceived( self, msg ):
+        entry = self.pending.pop( msg.requestId, None )
+        if entry:
+            deadline, contact, onReply = entry
+            self.table.update( contact )
+            onReply( msg.nodes, msg.taskHeader )
+
+    ############################
+    def responseMissing( self, requestId ):
+        entry = self.pending.pop( requestId, None )
+        if entry:
+            deadline, contact, onReply = entry
+            self.table.remove( contact.uid )
+            onReply( None, None )
+
+    ############################
+    def __validRequest( self, msg ):
+        # requests come also from nodes which are not our peers
+        if not isinstance( msg.requestId, ( int, long ) ) or not self.__validKey( msg.senderId ):
+            return False
+
+        if not isinstance( msg.senderPort, ( int, long ) ) or not 0 < msg.senderPort < 65536:
+            return False
+
+        if msg.getType() == MessageDhtFindNode.Type:
+            if not isinstance( msg.target, basestring ):
+                return False
+            try:
+                return 0 <= long( msg.target, 16 ) < 2 ** 160
+            except ValueError:
+                return False
+
+        elif msg.getType() == MessageDhtFindTask.Type:
+            return self.__validKey( msg.taskId )
+
+        elif msg.getType() == MessageDhtStoreTask.Type:
+            th = msg.taskHeader
+            return isinstance( th, dict ) and self.__validKey( th.get( "id" ) ) and isinstance( th.get( "ttl" ), ( int, long, float ) ) and th[ "ttl" ] >= 0
+
+        return True
+
+    ############################
+    def __validKey( self, key ):
+        if not isinstance( key, basestring ) or not key:
+            return False
+        try:
+            dhtId( key )
+        except UnicodeError:
+            return False
+        return True
+
+    ############################
+    def __lookup( self, targetId, done, targetUid = None, taskId = None ):
+        if taskId is not None:
+            query = lambda c, onReply: self.__rpc( c, MessageDhtFindTask( 0, self.uid, self.__port(), taskId ), onReply )
+        else:
+            query = lambda c, onReply: self.__rpc( c, MessageDhtFindNode( 0, self.uid, self.__port(), dhtIdToText( targetId ) ), onReply )
+
+        lookup = Lookup( self.uid, targetId, query, done, targetUid )
+        lookup.start( self.table.closest( targetId ) )
+
+    ############################
+    def __rpc( self, contact, msg, onReply ):
+        msg.requestId = self.nextRequestId
+        self.nextRequestId += 1
+
+        self.pending[ msg.requestId ] = ( time.time() + self.RpcTimeout, contact, onReply )
+
+        peer = self.p2pService.findPeer( contact.uid )
+        if peer and peer.sendDhtMessage( msg ):
+            return
+
+        Network.connect( contact.address, contact.port, DhtRpcSession, self.__rpcConnected, self.__rpcFailure, msg )
+
+    ############################
+    def __rpcConnected( self, session, msg ):
+        session.dhtService = self
+        session.conn.setStats( self.p2pService.stats )
+        session.request( msg )
+
+    ############################
+    def __rpcFailure( self, msg ):
+        self.responseMissing( msg.requestId )
+
+    ############################
+    def __storeLocal( self, thDictRepr ):
+        if len( self.storedTasks ) >= self.MaxStoredTasks and thDictRepr[ "id" ] not in self.storedTasks:
+            soonest = min( self.storedTasks, key = lambda taskId: self.storedTasks[ taskId ][ 0 ] )
+            del self.storedTasks[ soonest ]
+
+        self.storedTasks[ thDictRepr[ "id" ] ] = ( time.time() + thDictRepr[ "ttl" ], thDictRepr )
+
+    ############################
+    def __closestDicts( self, targetId ):
+        return [ c.toDict() for c in self.table.closest( targetId ) ]
+
+    ############################
+    def __port( self ):
+        return self.p2pService.p2pServer.curPort
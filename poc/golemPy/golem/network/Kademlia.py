@@ -0,0 +1,207 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+ID_BITS = 160
+
+############################
+def dhtId( key ):
+    """160 bit overlay id of client uid or task id"""
+    if not isinstance( key, unicode ):
+        key = unicode( key )
+    return long( hashlib.sha1( key.encode( "utf-8" ) ).hexdigest(), 16 )
+
+############################
+def dhtIdToText( id ):
+    return u"{:040x}".format( id )
+
+class Contact:
+
+    ############################
+    def __init__( self, uid, address, port ):
+        self.uid        = uid
+        self.id         = dhtId( uid )
+        self.address    = address
+        self.port       = port
+        self.lastSeen   = time.time()
+
+    ############################
+    def toDict( self ):
+        return { "id" : self.uid, "address" : self.address, "port" : self.port }
+
+    ############################
+    @classmethod
+    def fromDict( cls, d ):
+        return cls( d[ "id" ], d[ "address" ], d[ "port" ] )
+
+class RoutingTable:
+    """
+    K-buckets of contacts, bucket i keeps contacts whose XOR distance from
+    local id has bit length i + 1. Buckets are kept in least recently seen
+    order. Full bucket accepts new contact only in place of stale one, so
+    long lived nodes stay in the table.
+    """
+
+    K           = 8
+    StaleTime   = 900.0
+
+    ############################
+    def __init__( self, localUid ):
+        self.localId    = dhtId( localUid )
+        self.buckets    = [ OrderedDict() for i in range( ID_BITS ) ]
+
+    ############################
+    def update( self, contact ):
+        if contact.id == self.localId:
+            return
+
+        bucket = self.__bucket( contact.id )
+
+        if contact.uid in bucket:
+            del bucket[ contact.uid ]
+        elif len( bucket ) >= self.K:
+            lruUid = next( iter( bucket ) )
+            if time.time() - bucket[ lruUid ].lastSeen < self.StaleTime:
+                return
+            del bucket[ lruUid ]
+
+        contact.lastSeen = time.time()
+        bucket[ contact.uid ] = contact
+
+    ############################
+    def remove( self, uid ):
+        self.__bucket( dhtId( uid ) ).pop( uid, None )
+
+    ############################
+    def get( self, uid ):
+        return self.__bucket( dhtId( uid ) ).get( uid )
+
+    ############################
+    def closest( self, targetId, count = K ):
+        contacts = [ c for bucket in self.buckets for c in bucket.itervalues() ]
+        contacts.sort( key = lambda c: c.id ^ targetId )
+        return contacts[ :count ]
+
+    ############################
+    def __len__( self ):
+        return sum( len( b ) for b in self.buckets )
+
+    ############################
+    def __bucket( self, id ):
+        return self.buckets[ max( 0, ( id ^ self.localId ).bit_length() - 1 ) ]
+
+class Lookup:
+    """
+    Iterative lookup of contacts closest to targetId. Alpha queries are
+    in flight at once and each reply brings contacts closer to the target.
+    Lookup ends when K closest known contacts were queried, when contact
+    with targetUid is known or when a reply carries task header.
+    """
+
+    Alpha = 3
+
+    ############################
+    def __init__( self, localUid, targetId, query, done, targetUid = None ):
+        self.localUid   = localUid
+        self.targetId   = targetId
+        self.targetUid  = targetUid
+        self.query      = query     # query( contact, onReply ), onReply( nodes, taskHeader ), nodes is None on failure
+        self.done       = done      # done( lookup )
+
+        self.contacts   = {}        # uid -> Contact
+        self.queried    = set()
+        self.inFlight   = 0
+        self.rpcs       = 0
+        self.found      = None      # contact with targetUid
+        self.taskHeader = None
+        self.finished   = False
+
+    ############################
+    def start( self, contacts ):
+        self.__add( contacts )
+        self.__next()
+
+    ############################
+    def closest( self, count = RoutingTable.K ):
+        return sorted( self.contacts.values(), key = lambda c: c.id ^ self.targetId )[ :count ]
+
+    ############################
+    def __add( self, contacts ):
+        for c in contacts:
+            if c.uid != self.localUid and c.uid not in self.contacts:
+                self.contacts[ c.uid ] = c
+
+        if self.targetUid in self.contacts:
+            self.found = self.contacts[ self.targetUid ]
+
+    ############################
+    def __next( self ):
+        if self.finished:
+            return
+
+        if self.found or self.taskHeader:
+            self.__finish()
+            return
+
+        candidates = [ c for c in self.closest() if c.uid not in self.queried ]
+
+        if not candidates and self.inFlight == 0:
+            self.__finish()
+            return
+
+        for c in candidates[ :max( 0, self.Alpha - self.inFlight ) ]:
+            self.queried.add( c.uid )
+            self.inFlight += 1
+            self.rpcs += 1
+            self.query( c, lambda nodes, taskHeader, c = c: self.__replied( c, nodes, taskHeader ) )
+
+    ############################
+    def __replied( self, contact, nodes, taskHeader ):
+        self.inFlight -= 1
+
+        if nodes is None:
+            self.contacts.pop( contact.uid, None )
+        else:
+            self.__add( [ Contact.fromDict( n ) for n in nodes ] )
+            self.taskHeader = self.taskHeader or taskHeader
+
+        self.__next()
+
+    ############################
+    def __finish( self ):
+        self.finished = True
+        self.done( self )
+
+if __name__ == "__main__":
+
+    import random
+
+    # in memory network of 1000 nodes which know few random nodes and join
+    # by looking up their own ids
+    uids = [ u"node{}".format( i ) for i in range( 1000 ) ]
+    tables = dict( ( uid, RoutingTable( uid ) ) for uid in uids )
+
+    def runLookup( src, targetId, targetUid, done ):
+        def query( contact, onReply ):
+            # both sides learn about each other as in real rpc
+            tables[ contact.uid ].update( Contact( src, "127.0.0.1", 0 ) )
+            tables[ src ].update( Contact( contact.uid, "127.0.0.1", 0 ) )
+            onReply( [ c.toDict() for c in tables[ contact.uid ].closest( targetId ) ], None )
+
+        lookup = Lookup( src, targetId, query, done, targetUid )
+        lookup.start( tables[ src ].closest( targetId ) )
+
+    for uid in uids:
+        for other in random.sample( uids, 5 ):
+            tables[ uid ].update( Contact( other, "127.0.0.1", 0 ) )
+
+    for i in range( 2 ): # second round stands for periodic refresh
+        for uid in uids:
+            runLookup( uid, dhtId( uid ), None, lambda l: None )
+
+    rpcs = []
+    for i in range( 100 ):
+        src, dst = random.sample( uids, 2 )
+        runLookup( src, dhtId( dst ), dst, lambda l: rpcs.append( ( l.rpcs, l.found is not None ) ) )
+
+    print "found {} of 100, average rpcs {}".format( sum( f for r, f in rpcs ), sum( r for r, f in rpcs ) / 100.0 )
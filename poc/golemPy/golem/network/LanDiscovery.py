@@ -0,0 +1,190 @@
+import time
+import random
+import socket
+import struct
+from collections import OrderedDict
+
+from twisted.internet.protocol import DatagramProtocol
+from twisted.internet.error import CannotListenError
+
+from Message import Message, MessageLanAnnounce, MessageLanReply, CODEC_BINARY
+from binarycodec import CodecError, isBinaryFrame, peekMessageType
+from tokenbucket import TokenBucket
+
+class LanDiscoveryProtocol( DatagramProtocol ):
+    """Passes datagrams received on one UDP port to LanDiscovery"""
+
+    ############################
+    def __init__( self, discovery ):
+        self.discovery = discovery
+
+    ############################
+    def datagramReceived( self, data, addr ):
+        self.discovery.datagramReceived( data, addr[ 0 ], addr[ 1 ] )
+
+class LanDiscovery:
+    """
+    Finds nodes in local network with UDP multicast. Starting node announces
+    its uid, p2p and task port to the group, nodes which hear it add it as
+    peer candidate and some of them answer straight to the announcing port,
+    so the new node can dial peers before the seed host answers. About
+    ReplyTarget nodes answer one announcement, every node answers one
+    announcer at most once per ReplyInterval and all datagrams of the node
+    are limited by token bucket, so farm started at once does not flood the
+    network.
+    """
+
+    AnnounceDelays      = [ 0.5, 2.0 ]  # announcement is repeated soon, datagrams may be lost
+    AnnounceInterval    = 30.0          # later ones are sent only while node needs peers
+    PortRetryDelay      = 0.05          # announcement waits for p2p port to be opened
+    ReplyTarget         = 8             # expected number of answers to one announcement
+    ReplyInterval       = 10.0
+    ReplyJitter         = 0.02          # answers of many nodes do not arrive at the same time
+    MaxDatagramRate     = 20            # datagrams per second sent by node
+    MaxNodes            = 1024          # remembered local nodes
+    MessageTypes        = { MessageLanAnnounce.Type : MessageLanAnnounce, MessageLanReply.Type : MessageLanReply }
+
+    ############################
+    def __init__( self, p2pService, group, port ):
+        self.p2pService     = p2pService
+        self.uid            = p2pService.configDesc.clientUid
+        self.group          = group
+        self.port           = port
+        self.nodes          = OrderedDict() # uid -> ( address, p2p port, task port, last seen )
+        self.replied        = {}            # uid -> time of the last answer to that node
+        self.bucket         = TokenBucket( self.MaxDatagramRate, self.MaxDatagramRate )
+        self.announcements  = 0
+        self.listener       = None
+        self.sender         = None
+
+        self.__start()
+
+    ############################
+    def announce( self ):
+        """Multicasts announcement if it is needed, returns delay of the next one for timer queue"""
+        if not self.sender:
+            return self.AnnounceInterval
+
+        if self.p2pService.p2pServer.curPort == 0:
+            return self.PortRetryDelay
+
+        if self.announcements == 0 or len( self.p2pService.peers ) < self.p2pService.configDesc.optNumPeers:
+            self.__send( MessageLanAnnounce, ( self.group, self.port ) )
+
+        self.announcements += 1
+
+        if self.announcements <= len( self.AnnounceDelays ):
+            return self.AnnounceDelays[ self.announcements - 1 ]
+
+        return self.AnnounceInterval
+
+    ############################
+    def datagramReceived( self, data, address, port ):
+        # anybody can send datagrams - only lan messages are decoded, fields of other ones may be pickled objects
+        if not isBinaryFrame( data ):
+            return
+
+        try:
+            msgType, pos = peekMessageType( data )
+            if msgType not in self.MessageTypes:
+                return
+
+            msg = self.MessageTypes[ msgType ]( dictRepr = Message.registeredCodecs[ msgType ].decode( data, pos ) )
+        except ( CodecError, IndexError, KeyError, ValueError, struct.error ) as ex:
+            print "Dropping datagram from {}:{}: {}".format( address, port, ex )
+            return
+
+        if not self.__validMessage( msg ) or msg.clientUid == self.uid:
+            return
+
+        self.__nodeSeen( msg.clientUid, address, msg.p2pPort, msg.taskPort )
+
+        if msg.getType() == MessageLanAnnounce.Type:
+            self.__answer( msg.clientUid, address, port )
+
+    ############################
+    def getNodes( self ):
+        return dict( self.nodes )
+
+    ############################
+    def stop( self ):
+        for port in [ self.listener, self.sender ]:
+            if port:
+                port.stopListening()
+
+        self.listener   = None
+        self.sender     = None
+
+    ############################
+    def __start( self ):
+        from twisted.internet import reactor
+
+        try:
+            self.listener = reactor.listenMulticast( self.port, LanDiscoveryProtocol( self ), listenMultiple = True )
+            self.listener.joinGroup( self.group ).addErrback( self.__joinFailure )
+
+            # announcements go from own port, so answers are not shared with other nodes on this host
+            self.sender = reactor.listenMulticast( 0, LanDiscoveryProtocol( self ) )
+            self.sender.setLoopbackMode( 1 )
+        except ( CannotListenError, socket.error ) as ex:
+            print "LAN discovery on {}:{} failure: {}".format( self.group, self.port, ex )
+            self.stop()
+
+    ############################
+    def __joinFailure( self, failure ):
+        print "Joining multicast group {} failure: {}".format( self.group, failure.getErrorMessage() )
+        self.stop()
+
+    ############################
+    def __validMessage( self, msg ):
+        if not isinstance( msg.clientUid, unicode ) or not msg.clientUid:
+            return False
+
+        for port in [ msg.p2pPort, msg.taskPort ]:
+            if not isinstance( port, ( int, long ) ) or not 0 <= port < 65536:
+                return False
+
+        return msg.p2pPort != 0
+
+    ############################
+    def __nodeSeen( self, uid, address, p2pPort, taskPort ):
+        self.nodes.pop( uid, None )
+        self.nodes[ uid ] = ( address, p2pPort, taskPort, time.time() )
+
+        if len( self.nodes ) > self.MaxNodes:
+            self.nodes.popitem( last = False )
+
+        self.p2pService.addPeerCandidate( uid, address, p2pPort )
+
+    ############################
+    def __answer( self, uid, address, port ):
+        from twisted.internet import reactor
+
+        now = time.time()
+        if now - self.replied.get( uid, 0.0 ) < self.ReplyInterval:
+            return
+
+        # every node answers with probability ReplyTarget / number of local nodes it knows
+        if random.random() * len( self.nodes ) > self.ReplyTarget:
+            return
+
+        self.replied[ uid ] = now
+        if len( self.replied ) > self.MaxNodes:
+            for u, t in self.replied.items():
+                if now - t >= self.ReplyInterval:
+                    del self.replied[ u ]
+
+        reactor.callLater( random.uniform( 0.0, self.ReplyJitter ), self.__send, MessageLanReply, ( address, port ) )
+
+    ############################
+    def __send( self, msgType, destination ):
+        if not self.sender or self.bucket.delay() > 0.0:
+            return
+
+        self.bucket.consume( 1 )
+
+        msg = msgType( self.uid, self.p2pService.p2pServer.curPort, self.p2pService.taskServer.curPort if self.p2pService.taskServer else 0 )
+        try:
+            self.sender.write( msg.serialize( CODEC_BINARY ), destination )
+        except socket.error as ex:
+            print "Sending {} to {} failure: {}".format( msg, destination, ex )
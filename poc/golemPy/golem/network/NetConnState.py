@@ -1,8 +1,18 @@
-
 from Message import Message
 from ConnectionState import ConnectionState
 
+# Task headers are synchronized incrementally with MessageGetTaskChanges
+FEATURE_TASK_SYNC = u"taskSync"
+# New tasks are pushed with MessageTaskAnnounce
+FEATURE_TASK_GOSSIP = u"taskGossip"
+# Node takes part in dht overlay ( advertised only if enabled in config )
+FEATURE_DHT = u"dht"
+
 class NetConnState( ConnectionState ):
+
+    MaxFrameSize = 4 * 1024 * 1024
+    Features = [ FEATURE_TASK_SYNC, FEATURE_TASK_GOSSIP ]
+
     ############################
     def __init__( self, server = None ):
         ConnectionState.__init__( self )
@@ -15,7 +25,7 @@ class NetConnState( ConnectionState ):
 
     ############################
     def connectionMade(self):
-        self.opened = True
+        ConnectionState.connectionMade( self )
 
         if self.server:
             from PeerSession import PeerSession
@@ -24,23 +34,14 @@ class NetConnState( ConnectionState ):
             self.server.newConnection( self.peer )
 
     ############################
-    def dataReceived(self, data):
-        assert self.opened
-
-        self.db.appendString(data)
-        mess = Message.deserialize(self.db)
-        if mess is None:
-            print "Deserialization message failed"
-            self.peer.interpret(None)
-
+    def _interpret( self, msg ):
         if self.peer:
-            for m in mess:
-                self.peer.interpret(m)
+            self.peer.interpret( msg )
         else:
             print "Peer for connection is None"
             assert False
 
     ############################
     def connectionLost(self, reason):
-        self.opened = False
+        ConnectionState.connectionLost( self, reason )
         self.peer.dropped()
@@ -2,9 +2,28 @@
 from P2PServer import P2PServer
 from network import Network
 from PeerSession import PeerSession
+from PeerDialer import PeerDialer
+from DhtService import DhtService
+from LanDiscovery import LanDiscovery
+from NetConnState import FEATURE_DHT
+from ProtocolStats import ProtocolStats
 import time
+import random
+from collections import OrderedDict
 
 class P2PService:
+
+    AnnounceHops        = 6     # new task reaches nodes this many hops from its owner
+    AnnouncedCacheSize  = 10000 # ids of announced tasks remembered to drop duplicates
+    MaxPeersExchanged   = 32    # peers sent in one MessagePeers
+    MaxPeersFactor      = 2     # above optNumPeers times this the slowest peers are disconnected
+    MinPeerAge          = 10.0  # younger peers are not disconnected for being slow
+    DialInterval        = 1.0   # dialer is also woken when peers or candidates change
+    GetTasksInterval    = 2.0
+    DhtSyncInterval     = 0.5
+    CachedCandidates    = 64    # best peers of previous run dialed on start
+    PeerCacheInterval   = 60.0  # round trip times of peers are saved this often
+
     ########################
     def __init__( self, hostAddress, configDesc ):
 
@@ -15,33 +34,119 @@ class P2PService:
         self.peers                  = {}
         self.allPeers               = []
         self.clientUid              = self.configDesc.clientUid
-        self.lastPeersRequest       = time.time()
         self.lastGetTasksRequest    = time.time()
-        self.incommingPeers         = {}
-        self.freePeers              = []
+        self.dialer                 = PeerDialer( self.__connect )
         self.taskServer             = None
         self.hostAddress            = hostAddress
 
-        self.lastMessages           = []
+        self.stats                  = ProtocolStats()
+        self.capture                = None
+        self.peerCache              = None
+
+        self.announcedTasks         = OrderedDict()
+
+        self.dht                    = DhtService( self ) if self.configDesc.useDht else None
+        self.lan                    = LanDiscovery( self, self.configDesc.lanDiscoveryGroup, self.configDesc.lanDiscoveryPort ) if self.configDesc.useLanDiscovery else None
+
+        self.dialTimer              = None
 
         if len( self.configDesc.seedHost ) > 0:
-            self.__connect( self.configDesc.seedHost, self.configDesc.seedHostPort )
+            self.dialer.addCandidate( None, self.configDesc.seedHost, self.configDesc.seedHostPort )
 
     #############################
     def setTaskServer( self, taskServer ):
         self.taskServer = taskServer
+        self.taskServer.taskManager.registerListener( self )
+
+    #############################
+    def setCapture( self, capture ):
+        """Frames of peer sessions opened from now on are appended to CaptureLog"""
+        self.capture = capture
+
+    #############################
+    def setPeerCache( self, peerCache ):
+        """Best peers of previous run become dial candidates, changes of peers are saved to PeerCache from now on"""
+        self.peerCache = peerCache
+
+        for e in self.peerCache.best( self.CachedCandidates ):
+            if e.peerId != self.clientUid:
+                self.dialer.addCandidate( e.peerId, e.address, e.port, e.score( time.time() ) )
+
+    #############################
+    def stop( self ):
+        if self.lan:
+            self.lan.stop()
+
+        if self.peerCache:
+            self.__updatePeerCache()
+            self.peerCache.close()
+
+    #############################
+    def taskAdded( self, taskHeader ):
+        """New own task is pushed to peers right away"""
+        self.__markAnnounced( taskHeader.taskId )
+        self.__announceTask( self.taskServer.getTaskHeaderRepr( taskHeader ), self.AnnounceHops, None )
+
+        if self.dht:
+            self.dht.storeTask( self.taskServer.getTaskHeaderRepr( taskHeader ) )
+
+    #############################
+    def taskAnnounced( self, thDictRepr, hops, fromPeer ):
+        """Returns False if announcement is malformed"""
+        if not self.taskServer:
+            return True
+
+        try:
+            taskId = thDictRepr[ "id" ]
+        except ( KeyError, TypeError ):
+            return False
+
+        if not self.__markAnnounced( taskId ):
+            return True # seen already
+
+        if not self.taskServer.addTaskHeader( thDictRepr ):
+            return False
+
+        if hops > 1:
+            self.__announceTask( thDictRepr, hops - 1, fromPeer )
+
+        return True
 
     #############################
     def syncNetwork( self ):
 
         self.__sendMessageGetPeers()
 
+        if self.dht:
+            self.dht.sync()
+
         if self.taskServer:
             self.__sendMessageGetTasks()
 
+    #############################
+    def registerTimers( self, timers ):
+        """Runs network maintenance from timer queue, syncNetwork is not needed then"""
+        self.dialTimer = timers.callEvery( self.DialInterval, self.__sendMessageGetPeers )
+        if self.dialer.hasCandidates( self.__isConnected ):
+            # seed host and cached peers are dialed right away
+            self.dialTimer.wake()
+
+        timers.callEvery( self.GetTasksInterval, self.__sendMessageGetTasks )
+
+        if self.dht:
+            timers.callEvery( self.DhtSyncInterval, self.dht.sync )
+
+        if self.peerCache:
+            timers.callEvery( self.PeerCacheInterval, self.__updatePeerCache )
+
+        if self.lan:
+            # first announcement right away, lan peers are dialed within milliseconds of answers
+            timers.callEvery( LanDiscovery.AnnounceInterval, self.lan.announce ).wake()
+
     #############################
     def newSession( self, session ):
         session.p2pService = self
+        self.__initConnection( session.conn )
         self.allPeers.append( session )
         session.start()
  
@@ -57,6 +162,68 @@ class P2PService:
         else:
             return None
 
+    #############################
+    def addPeer( self, peerId, peerSession ):
+        self.peers[ peerId ] = peerSession
+        # address may have been dialed without knowing its id ( seed host )
+        self.dialer.addCandidate( peerId, peerSession.address, peerSession.port )
+        self.dialer.connected( peerSession.address, peerSession.port )
+
+        if self.peerCache:
+            self.peerCache.connected( peerId, peerSession.address, peerSession.port )
+
+        if self.dht and peerSession.conn.peerSupports( FEATURE_DHT ):
+            self.dht.contactSeen( peerId, peerSession.address, peerSession.port )
+
+    #############################
+    def getPeersRtt( self ):
+        return dict( ( peerId, p.rtt.toDict() ) for peerId, p in self.peers.items() )
+
+    #############################
+    def dhtRequestReceived( self, msg, address ):
+        """Returns answer, False if request is malformed or None if dht is off"""
+        if self.dht:
+            return self.dht.requestReceived( msg, address )
+        return None
+
+    #############################
+    def dhtResponseReceived( self, msg ):
+        if self.dht:
+            self.dht.responseReceived( msg )
+
+    #############################
+    def samplePeers( self, exclude ):
+        """
+        Returns up to MaxPeersExchanged peers infos for peer exchange. Connected
+        peers are sampled with weight of their last activity, the rest is
+        filled with addresses connected recently
+        """
+        now = time.time()
+        weighted = []
+        for p in self.peers.values():
+            if p is not exclude:
+                # weighted sampling without replacement - keys u ^ ( 1 / w )
+                w = 1.0 / ( 1.0 + max( 0.0, now - p.lastMessageTime ) )
+                weighted.append( ( random.random() ** ( 1.0 / w ), p ) )
+
+        weighted.sort( reverse = True )
+
+        ret = [ { "address" : p.address, "port" : p.port, "id" : p.id } for k, p in weighted[ :self.MaxPeersExchanged ] ]
+
+        if len( ret ) < self.MaxPeersExchanged:
+            sent = set( pi[ "id" ] for pi in ret )
+            sent.add( exclude.id )
+            for c in self.dialer.recentlyConnected( self.MaxPeersExchanged - len( ret ), sent ):
+                ret.append( { "address" : c.address, "port" : c.port, "id" : c.peerId } )
+
+        return ret
+
+    #############################
+    def addPeerCandidate( self, peerId, address, port ):
+        if peerId not in self.peers and peerId != self.configDesc.clientUid:
+            self.dialer.addCandidate( peerId, address, port )
+            self.__wakeDialer()
+
     #############################
     def removePeer( self, peerSession ):
 
@@ -66,17 +233,29 @@ class P2PService:
         for p in self.peers.keys():
             if self.peers[ p ] == peerSession:
                 del self.peers[ p ]
+                self.dialer.addCandidate( p, peerSession.address, peerSession.port )
+                if self.peerCache:
+                    self.peerCache.update( p, peerSession.address, peerSession.port, peerSession.rtt.estimate() )
+                if peerSession.disconnectReason == PeerSession.DCRTooManyPeers:
+                    # one side keeps faster peers, do not come back soon
+                    self.dialer.failed( peerSession.address, peerSession.port )
+                else:
+                    # reconnect soon after network blip, port is the listening port from hello
+                    self.dialer.disconnected( peerSession.address, peerSession.port )
+
+        self.__wakeDialer()
     
     #############################
     def setLastMessage( self, type, t, msg, address, port ):
-        if len( self.lastMessages ) >= 5:
-            self.lastMessages = self.lastMessages[ -4: ]
-
-        self.lastMessages.append( [ type, t, address, port, msg ] )
+        self.stats.addLastMessage( type, t, msg, address, port )
 
     #############################
     def getLastMessages( self ):
-        return self.lastMessages
+        return self.stats.getLastMessages()
+
+    #############################
+    def getProtocolStats( self ):
+        return self.stats.toDict()
     
     ############################# 
     def managerSessionDisconnected( self, uid ):
@@ -85,37 +264,108 @@ class P2PService:
     #############################   
     def __connect( self, address, port ):
 
-        Network.connect( address, port, PeerSession, self.__connectionEstablished, self.__connectionFailure )
+        Network.connect( address, port, PeerSession, self.__connectionEstablished, self.__connectionFailure, address, port )
 
     #############################
     def __sendMessageGetPeers( self ):
-        while len( self.peers ) < self.configDesc.optNumPeers:
-            if len( self.freePeers ) == 0:
-                if time.time() - self.lastPeersRequest > 2:
-                    self.lastPeersRequest = time.time()
-                    for p in self.peers.values():
-                        p.sendGetPeers()
-                break
+        self.__dropSlowPeers()
+
+        # sessions waiting for hello will most likely become peers
+        handshaking = len( [ p for p in self.allPeers if p.id not in self.peers ] )
+        needed = self.configDesc.optNumPeers - len( self.peers ) - handshaking
+
+        if needed <= 0:
+            return
+
+        self.dialer.dial( needed, self.__isConnected )
+
+        # called from dial timer ( or syncNetwork ), its interval limits rate of requests
+        if not self.dialer.hasCandidates( self.__isConnected ):
+            for p in self.peers.values():
+                p.sendGetPeers()
+
+    #############################
+    def __wakeDialer( self ):
+        if self.dialTimer:
+            self.dialTimer.wake()
+
+    #############################
+    def __dropSlowPeers( self ):
+        """Keeps peers with lowest round trip time when there are too many of them"""
+        staying = [ p for p in self.peers.values() if p.disconnectReason is None ]
+        excess = len( staying ) - self.configDesc.optNumPeers * self.MaxPeersFactor
+
+        if excess <= 0:
+            return
+
+        now = time.time()
+        measured = [ p for p in staying if p.rtt.samples > 0 and now - p.startTime > self.MinPeerAge ]
+        measured.sort( key = lambda p: p.rtt.srtt, reverse = True )
+
+        for p in measured[ :excess ]:
+            p.disconnect( PeerSession.DCRTooManyPeers )
+
+    #############################
+    def __updatePeerCache( self ):
+        for peerId, p in self.peers.items():
+            self.peerCache.update( peerId, p.address, p.port, p.rtt.estimate() )
+
+        self.peerCache.flush()
+
+    #############################
+    def __isConnected( self, peerId ):
+        return peerId in self.peers
+
+    #############################
+    def __markAnnounced( self, taskId ):
+        """Returns False if task was announced already"""
+        if taskId in self.announcedTasks:
+            return False
+
+        self.announcedTasks[ taskId ] = None
+        if len( self.announcedTasks ) > self.AnnouncedCacheSize:
+            self.announcedTasks.popitem( last = False )
+
+        return True
 
-            x = int( time.time() ) % len( self.freePeers ) # get some random peer from freePeers
-            self.incommingPeers[ self.freePeers[ x ] ][ "conn_trials" ] += 1 # increment connection trials
-            print "Connecting to peer {}".format( self.freePeers[ x ] )
-            self.__connect( self.incommingPeers[ self.freePeers[ x ] ][ "address" ], self.incommingPeers[ self.freePeers[ x ] ][ "port" ] )
-            self.freePeers.remove( self.freePeers[ x ] )
+    #############################
+    def __announceTask( self, thDictRepr, hops, fromPeer ):
+        for p in self.peers.values():
+            if p is not fromPeer:
+                p.sendTaskAnnounce( thDictRepr, hops )
 
     #############################
     def __sendMessageGetTasks( self ):
-        if time.time() - self.lastGetTasksRequest > 2:
+        if self.taskServer and time.time() - self.lastGetTasksRequest > 2:
             self.lastGetTasksRequest = time.time()
             for p in self.peers.values():
                 p.sendGetTasks()
 
     #############################
-    def __connectionEstablished( self, session ):
+    def __connectionEstablished( self, session, address, port ):
+        self.dialer.connected( address, port )
         session.p2pService = self
+        self.__initConnection( session.conn )
         self.allPeers.append( session )
         print "Connection to peer established. {}: {}".format( session.conn.transport.getPeer().host, session.conn.transport.getPeer().port )
 
     #############################
-    def __connectionFailure( self ):
-        print "Connection to peer failure."
+    def __initConnection( self, conn ):
+        conn.setStats( self.stats )
+
+        if self.capture:
+            conn.setCapture( self.capture, "p2p" )
+
+        if self.dht:
+            conn.addFeature( FEATURE_DHT )
+
+        if self.configDesc.p2pMaxFrameSize > 0:
+            conn.setFrameLimits( self.configDesc.p2pMaxFrameSize )
+
+    #############################
+    def __connectionFailure( self, address, port ):
+        print "Connection to peer {}:{} failure.".format( address, port )
+        self.dialer.failed( address, port )
+        if self.peerCache:
+            self.peerCache.failed( address, port )
+        self.__wakeDialer()
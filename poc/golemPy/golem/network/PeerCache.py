@@ -0,0 +1,187 @@
+import os
+import time
+import cPickle as pickle
+
+class CachedPeer:
+
+    ############################
+    def __init__( self, peerId, address, port ):
+        self.peerId     = peerId
+        self.address    = address
+        self.port       = port
+        self.lastSeen   = 0.0
+        self.attempts   = 0
+        self.successes  = 0
+        self.srtt       = 0.0   # zero - not measured
+
+    ############################
+    def successRate( self ):
+        # estimate with one success and one failure added, so a single attempt does not decide
+        return ( self.successes + 1.0 ) / ( self.attempts + 2.0 )
+
+    ############################
+    def score( self, now ):
+        """Higher is better - success rate lowered by age and round trip time"""
+        freshness = 0.5 ** ( max( 0.0, now - self.lastSeen ) / PeerCache.ScoreHalfLife )
+        rtt = self.srtt if self.srtt > 0.0 else PeerCache.RttScale
+        return self.successRate() * freshness * PeerCache.RttScale / ( PeerCache.RttScale + rtt )
+
+    ############################
+    def toTuple( self ):
+        return ( self.peerId, self.address, self.port, self.lastSeen, self.attempts, self.successes, self.srtt )
+
+    ############################
+    @classmethod
+    def fromTuple( cls, t ):
+        e = cls( t[ 0 ], t[ 1 ], t[ 2 ] )
+        e.lastSeen, e.attempts, e.successes, e.srtt = t[ 3: ]
+        return e
+
+class PeerCache:
+    """
+    Peers known from previous runs of node, kept in journal file. Every
+    change of an entry appends its new state, so update costs one short
+    write and when file is loaded the last state of each entry wins. The
+    journal is rewritten with current entries when it grows over
+    CompactFactor times their number, then at most MaxEntries best scored
+    entries are kept.
+    """
+
+    MaxEntries      = 1024
+    CompactFactor   = 4
+    ScoreHalfLife   = 24 * 3600.0   # peer not seen for a day scores half
+    RttScale        = 0.1           # peer with this round trip time scores half
+
+    ############################
+    def __init__( self, fileName ):
+        self.fileName   = fileName
+        self.entries    = {}    # ( address, port ) -> CachedPeer
+        self.records    = 0     # records in journal
+        self.file       = None
+
+        self.__load()
+        self.__compact()
+
+    ############################
+    def best( self, count ):
+        """Up to count entries with the highest score, best first"""
+        now = time.time()
+        ret = sorted( self.entries.values(), key = lambda e: e.score( now ), reverse = True )
+        return ret[ :count ]
+
+    ############################
+    def connected( self, peerId, address, port ):
+        e = self.__get( peerId, address, port )
+        e.attempts  += 1
+        e.successes += 1
+        e.lastSeen  = time.time()
+        self.__append( e )
+
+    ############################
+    def failed( self, address, port ):
+        # only known peers are remembered, failing random addresses would push them out
+        e = self.entries.get( ( address, port ) )
+        if e:
+            e.attempts += 1
+            self.__append( e )
+
+    ############################
+    def update( self, peerId, address, port, srtt ):
+        """Peer is still connected or was just disconnected"""
+        e = self.__get( peerId, address, port )
+        e.lastSeen = time.time()
+        if srtt > 0.0:
+            e.srtt = srtt
+        self.__append( e )
+
+    ############################
+    def flush( self ):
+        if self.file:
+            self.file.flush()
+
+    ############################
+    def close( self ):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    ############################
+    def __get( self, peerId, address, port ):
+        e = self.entries.get( ( address, port ) )
+
+        if e is None:
+            e = self.entries[ ( address, port ) ] = CachedPeer( peerId, address, port )
+        elif peerId:
+            e.peerId = peerId
+
+        return e
+
+    ############################
+    def __append( self, e ):
+        if not self.file:
+            return
+
+        pickle.dump( e.toTuple(), self.file, pickle.HIGHEST_PROTOCOL )
+        self.records += 1
+
+        if self.records > self.CompactFactor * max( len( self.entries ), self.MaxEntries / 16 ):
+            self.__compact()
+
+    ############################
+    def __load( self ):
+        if not os.path.exists( self.fileName ):
+            return
+
+        with open( self.fileName, "rb" ) as f:
+            try:
+                while True:
+                    e = CachedPeer.fromTuple( pickle.load( f ) )
+                    self.entries[ ( e.address, e.port ) ] = e
+            except EOFError:
+                pass
+            except Exception as ex:
+                # node stopped in the middle of write, entries read so far are kept
+                print "Peer cache {} is damaged: {}".format( self.fileName, ex )
+
+    ############################
+    def __compact( self ):
+        self.close()
+
+        if len( self.entries ) > self.MaxEntries:
+            self.entries = dict( ( ( e.address, e.port ), e ) for e in self.best( self.MaxEntries ) )
+
+        tmpName = self.fileName + ".tmp"
+        with open( tmpName, "wb" ) as f:
+            for e in self.entries.values():
+                pickle.dump( e.toTuple(), f, pickle.HIGHEST_PROTOCOL )
+
+        try:
+            os.rename( tmpName, self.fileName )
+        except OSError:
+            # rename does not replace existing file on windows
+            os.remove( self.fileName )
+            os.rename( tmpName, self.fileName )
+
+        self.file       = open( self.fileName, "ab" )
+        self.records    = len( self.entries )
+
+if __name__ == "__main__":
+    import tempfile
+    import shutil
+
+    d = tempfile.mkdtemp()
+    name = os.path.join( d, "peers.dat" )
+
+    pc = PeerCache( name )
+    for i in range( 10 ):
+        pc.connected( "peer{}".format( i ), "10.0.0.{}".format( i ), 40102 )
+        pc.update( "peer{}".format( i ), "10.0.0.{}".format( i ), 40102, 0.01 * ( i + 1 ) )
+    for i in range( 3 ):
+        pc.failed( "10.0.0.0", 40102 )
+    pc.close()
+
+    pc = PeerCache( name )
+    print [ ( e.peerId, e.successes, e.attempts, round( e.score( time.time() ), 3 ) ) for e in pc.best( 4 ) ], pc.records, "records"
+    pc.close()
+
+    shutil.rmtree( d )
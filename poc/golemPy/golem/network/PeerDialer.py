@@ -0,0 +1,146 @@
+import time
+import random
+
+class PeerCandidate:
+
+    ############################
+    def __init__( self, peerId, address, port, score = 0.0 ):
+        self.peerId         = peerId
+        self.address        = address
+        self.port           = port
+        self.score          = score     # peers from cache of previous run are dialed best first
+        self.failures       = 0
+        self.nextTrial      = 0.0
+        self.lastSuccess    = None
+        self.dialing        = False
+        self.added          = time.time()
+
+class PeerDialer:
+    """
+    Keeps addresses of known peers and chooses which of them to dial. At most
+    MaxParallelDials connections are attempted at once, failed addresses are
+    retried after exponential backoff with jitter and addresses which were
+    connected recently are dialed first, then ones with the highest score.
+    At most MaxCandidates addresses are kept, the least promising ones are
+    evicted.
+    """
+
+    MaxCandidates       = 512
+    MaxParallelDials    = 4
+    BaseBackoff         = 1.0
+    MaxBackoff          = 300.0
+    RecentSuccessTime   = 600.0
+
+    ############################
+    def __init__( self, connect ):
+        self.connect        = connect   # connect( address, port ) starts connection attempt
+        self.candidates     = {}        # ( address, port ) -> PeerCandidate
+
+    ############################
+    def addCandidate( self, peerId, address, port, score = 0.0 ):
+        key = ( address, port )
+        c = self.candidates.get( key )
+
+        if c is None:
+            self.candidates[ key ] = PeerCandidate( peerId, address, port, score )
+            if len( self.candidates ) > self.MaxCandidates:
+                self.__evict()
+        else:
+            c.score = max( c.score, score )
+            if peerId:
+                c.peerId = peerId
+
+    ############################
+    def dial( self, needed, isConnected ):
+        """Starts up to needed connection attempts to candidates for which isConnected( peerId ) is False"""
+        now = time.time()
+        slots = min( needed, self.MaxParallelDials ) - self.numDialing()
+
+        if slots <= 0:
+            return 0
+
+        ready = [ c for c in self.candidates.values() if not c.dialing and c.nextTrial <= now and not ( c.peerId and isConnected( c.peerId ) ) ]
+        random.shuffle( ready )
+        ready.sort( key = lambda c: ( not self.__recentlyConnected( c, now ), c.failures, -c.score ) )
+
+        for c in ready[ :slots ]:
+            c.dialing = True
+            print "Connecting to peer {} {}:{}".format( c.peerId, c.address, c.port )
+            self.connect( c.address, c.port )
+
+        return min( slots, len( ready ) )
+
+    ############################
+    def connected( self, address, port ):
+        c = self.candidates.get( ( address, port ) )
+        if c:
+            c.dialing       = False
+            c.failures      = 0
+            c.lastSuccess   = time.time()
+
+    ############################
+    def failed( self, address, port ):
+        c = self.candidates.get( ( address, port ) )
+        if c:
+            c.dialing   = False
+            c.failures  += 1
+            c.nextTrial = time.time() + self.backoff( c.failures )
+
+    ############################
+    def disconnected( self, address, port ):
+        """Established connection was lost, address is dialed again after short delay"""
+        c = self.candidates.get( ( address, port ) )
+        if c:
+            c.nextTrial = time.time() + self.backoff( 0 )
+
+    ############################
+    def backoff( self, failures ):
+        delay = min( self.MaxBackoff, self.BaseBackoff * ( 2 ** failures ) )
+        return random.uniform( delay / 2.0, delay )
+
+    ############################
+    def numDialing( self ):
+        return len( [ c for c in self.candidates.values() if c.dialing ] )
+
+    ############################
+    def hasCandidates( self, isConnected ):
+        """True if there is address which may be dialed now - not connected, not dialed and not waiting for backoff"""
+        now = time.time()
+        for c in self.candidates.values():
+            if not c.dialing and c.nextTrial <= now and not ( c.peerId and isConnected( c.peerId ) ):
+                return True
+        return False
+
+    ############################
+    def recentlyConnected( self, count, exclude ):
+        """Up to count candidates connected recently which are not in exclude set of peer ids"""
+        now = time.time()
+        ret = [ c for c in self.candidates.values() if self.__recentlyConnected( c, now ) and c.peerId and c.peerId not in exclude ]
+        ret.sort( key = lambda c: c.lastSuccess, reverse = True )
+        return ret[ :count ]
+
+    ############################
+    def __evict( self ):
+        # addresses which failed most are evicted first, then the oldest never connected ones
+        now = time.time()
+        worst = min( ( c for c in self.candidates.values() if not c.dialing ), key = lambda c: ( self.__recentlyConnected( c, now ), -c.failures, c.added ) )
+        del self.candidates[ ( worst.address, worst.port ) ]
+
+    ############################
+    def __recentlyConnected( self, c, now ):
+        return c.lastSuccess is not None and now - c.lastSuccess < self.RecentSuccessTime
+
+if __name__ == "__main__":
+
+    def connect( address, port ):
+        print "dial {}:{}".format( address, port )
+
+    pd = PeerDialer( connect )
+
+    for i in range( 10 ):
+        pd.addCandidate( "peer{}".format( i ), "10.0.0.{}".format( i ), 40102 )
+
+    pd.connected( "10.0.0.7", 40102 )
+    print pd.dial( 6, lambda id: id == "peer3" ), "dialing"
+    pd.failed( "10.0.0.7", 40102 )
+    print [ ( c.peerId, c.failures, round( c.nextTrial - time.time(), 2 ) ) for c in pd.candidates.values() if c.failures ]
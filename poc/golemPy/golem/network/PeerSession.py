@@ -1,8 +1,13 @@
 
-from NetConnState import NetConnState
+from NetConnState import NetConnState, FEATURE_TASK_SYNC, FEATURE_TASK_GOSSIP, FEATURE_DHT
 
-from Message import MessageHello, MessagePing, MessagePong, MessageDisconnect, MessageGetPeers, MessagePeers, MessageGetTasks, MessageTasks
+from Message import MessageHello, MessagePing, MessagePong, MessageDisconnect, MessageGetPeers, MessagePeers, MessageGetTasks, MessageTasks, MessageGetTaskChanges, MessageTaskChanges, MessageTaskAnnounce
+from Message import MessageDhtFindNode, MessageDhtFindTask, MessageDhtStoreTask, MessageDhtNodes
+from bloomfilter import BloomFilter
+from ProtocolStats import RttEstimator
+from collections import deque
 import time
+import random
 
 class PeerSessionInterface:
     def __init__(self):
@@ -21,6 +26,14 @@ class PeerSession(PeerSessionInterface):
 
     DCRBadProtocol      = "Bad protocol"
     DCRDuplicatePeers   = "Duplicate peers"
+    DCRTooManyPeers     = "Too many peers"
+
+    MaxPingsInFlight    = 16
+    FullTaskSyncInterval = 300.0    # headers skipped as bloom filter false positives are fetched then
+
+    # filter of known tasks sent by peer is tested with every header ( own filters use 7 hashes )
+    MaxFilterHashes     = 16
+    MaxFilterSize       = 1024 * 1024
 
     ##########################
     def __init__(self, conn ):
@@ -34,10 +47,21 @@ class PeerSession(PeerSessionInterface):
         self.port = pp.port
         self.state = PeerSession.StateInitialize
         self.lastMessageTime = 0.0
+        self.startTime = time.time()
 
         print "CREATING PEER SESSION {} {}".format( self.address, self.port )
 
         self.lastDisconnectTime = None
+        self.disconnectReason   = None
+
+        # pongs come in order of pings, old nodes answer them too
+        self.pingsSent          = deque( maxlen = self.MaxPingsInFlight )
+        self.rtt                = RttEstimator()
+
+        # task headers of peer seen so far
+        self.taskSyncEpoch      = u""
+        self.taskSyncVersion    = 0
+        self.lastFullTaskSync   = 0.0
 
     ##########################
     def __str__(self):
@@ -59,6 +83,14 @@ class PeerSession(PeerSessionInterface):
         if time.time() - self.lastMessageTime > interval:
             self.__sendPing()
 
+    ##########################
+    def disconnect( self, reason ):
+        if reason == PeerSession.DCRTooManyPeers:
+            # let the peer find other nodes before it goes away
+            self.__sendPeers()
+
+        self.__disconnect( reason )
+
     ##########################
     def interpret(self, msg):
         self.lastMessageTime = time.time()
@@ -67,6 +99,7 @@ class PeerSession(PeerSessionInterface):
 
         if msg is None:
             self.__disconnect( PeerSession.DCRBadProtocol )
+            return
 
         self.p2pService.setLastMessage( "<-", time.localtime(), msg, self.address, self.port )
 
@@ -79,9 +112,11 @@ class PeerSession(PeerSessionInterface):
         if type == MessagePing.Type:
             self.__sendPong()
         elif type == MessagePong.Type:
-            pass
+            if self.pingsSent:
+                self.rtt.addSample( time.time() - self.pingsSent.popleft() )
         elif type == MessageDisconnect.Type:
             print "Disconnect reason: {}".format(msg.reason)
+            self.disconnectReason = msg.reason
             print "Closing {} : {}".format( self.address, self.port )
             self.dropped()
 
@@ -98,7 +133,7 @@ class PeerSession(PeerSessionInterface):
 
             if not p:
                 self.__sendHello()
-                self.p2pService.peers[self.id] = self
+                self.p2pService.addPeer( self.id, self )
 
             #print "Add peer to client uid:{} address:{} port:{}".format(self.id, self.address, self.port)
             self.__sendPing()
@@ -107,13 +142,9 @@ class PeerSession(PeerSessionInterface):
             self.__sendPeers()
 
         elif type == MessagePeers.Type:
-            peersInfo = msg.peersArray
-            for pi in peersInfo:
-                if pi[ "id" ] not in self.p2pService.incommingPeers and pi[ "id" ] not in self.p2pService.peers and pi[ "id" ] != self.p2pService.configDesc.clientUid:
-                    print "add peer to incoming {} {} {}".format( pi[ "id" ], pi[ "address" ], pi[ "port" ] )
-                    self.p2pService.incommingPeers[ pi[ "id" ] ] = { "address" : pi[ "address" ], "port" : pi[ "port" ], "conn_trials" : 0 }
-                    self.p2pService.freePeers.append( pi[ "id" ] )
-                    print self.p2pService.incommingPeers
+            # old nodes send all their peers
+            for pi in msg.peersArray[ :self.p2pService.MaxPeersExchanged ]:
+                self.p2pService.addPeerCandidate( pi[ "id" ], pi[ "address" ], pi[ "port" ] )
 
         elif type == MessageGetTasks.Type:
             tasks = self.p2pService.taskServer.getTasksHeaders()
@@ -124,13 +155,81 @@ class PeerSession(PeerSessionInterface):
                 if not self.p2pService.taskServer.addTaskHeader( t ):
                     self.__disconnect( PeerSession.DCRBadProtocol )
 
+        elif type == MessageGetTaskChanges.Type:
+            known = None
+            if msg.knownTasks:
+                if not self.__validFilter( msg ):
+                    self.__disconnect( PeerSession.DCRBadProtocol )
+                    return
+                known = BloomFilter.fromBytes( msg.knownTasks, msg.filterHashes, msg.filterSeed )
+
+            epoch, version, full, tasks, removed = self.p2pService.taskServer.getTaskChanges( msg.epoch, msg.sinceVersion, known )
+            self.__send( MessageTaskChanges( epoch, version, full, tasks, removed ) )
+
+        elif type == MessageTaskChanges.Type:
+            for t in msg.tasksArray:
+                if not self.p2pService.taskServer.addTaskHeader( t ):
+                    self.__disconnect( PeerSession.DCRBadProtocol )
+                    return
+
+            self.p2pService.taskServer.taskHeadersWithdrawn( msg.removed, self.id )
+
+            self.taskSyncEpoch      = msg.epoch
+            self.taskSyncVersion    = msg.version
+
+        elif type == MessageTaskAnnounce.Type:
+            if not self.p2pService.taskAnnounced( msg.taskHeader, msg.hops, self ):
+                self.__disconnect( PeerSession.DCRBadProtocol )
+
+        elif type in ( MessageDhtFindNode.Type, MessageDhtFindTask.Type, MessageDhtStoreTask.Type ):
+            # also sent by nodes which are not our peers over short lived connections
+            reply = self.p2pService.dhtRequestReceived( msg, self.address )
+            if reply is False:
+                self.__disconnect( PeerSession.DCRBadProtocol )
+            elif reply:
+                self.__send( reply )
+
+        elif type == MessageDhtNodes.Type:
+            self.p2pService.dhtResponseReceived( msg )
+
     ##########################
     def sendGetPeers( self ):
         self.__send( MessageGetPeers() )
 
     ##########################
     def sendGetTasks( self ):
-        self.__send( MessageGetTasks() )
+        if not self.conn.peerSupports( FEATURE_TASK_SYNC ):
+            self.__send( MessageGetTasks() )
+        elif not self.taskSyncEpoch:
+            # first sync - peer skips headers we already got from others
+            self.lastFullTaskSync = time.time()
+            known = self.p2pService.taskServer.getKnownTasksFilter( random.getrandbits( 32 ) )
+            self.__send( MessageGetTaskChanges( knownTasks = known.toBytes(), filterHashes = known.numHashes, filterSeed = known.seed ) )
+        elif time.time() - self.lastFullTaskSync > self.FullTaskSyncInterval:
+            # about 1% of headers are skipped by the filter without us having them,
+            # deltas never send them again, so the full list is asked for without filter
+            self.lastFullTaskSync = time.time()
+            self.__send( MessageGetTaskChanges() )
+        else:
+            self.__send( MessageGetTaskChanges( self.taskSyncEpoch, self.taskSyncVersion ) )
+
+    ##########################
+    def sendTaskAnnounce( self, taskHeader, hops ):
+        """Returns False if peer is an old node which does not understand announcements"""
+        if not self.conn.peerSupports( FEATURE_TASK_GOSSIP ):
+            return False
+
+        self.__send( MessageTaskAnnounce( taskHeader, hops ) )
+        return True
+
+    ##########################
+    def sendDhtMessage( self, msg ):
+        """Returns False if peer does not take part in dht"""
+        if not self.conn.peerSupports( FEATURE_DHT ):
+            return False
+
+        self.__send( msg )
+        return True
 
     ##########################
     # PRIVATE SECTION
@@ -138,6 +237,7 @@ class PeerSession(PeerSessionInterface):
     ##########################
     def __disconnect(self, reason):
         print "Disconnecting {} : {} reason: {}".format( self.address, self.port, reason )
+        self.disconnectReason = reason
         if self.conn.isOpen():
             if self.lastDisconnectTime:
                 self.dropped()
@@ -145,12 +245,23 @@ class PeerSession(PeerSessionInterface):
                 self.__sendDisconnect(reason)
                 self.lastDisconnectTime = time.time()
 
+    ##########################
+    def __validFilter( self, msg ):
+        if not isinstance( msg.knownTasks, str ) or len( msg.knownTasks ) > self.MaxFilterSize:
+            return False
+
+        if not isinstance( msg.filterHashes, ( int, long ) ) or not 1 <= msg.filterHashes <= self.MaxFilterHashes:
+            return False
+
+        return isinstance( msg.filterSeed, ( int, long ) ) and 0 <= msg.filterSeed < 2 ** 32
+
     ##########################
     def __sendHello(self):
         self.__send(MessageHello(self.p2pService.p2pServer.curPort, self.p2pService.configDesc.clientUid)) #FIXME: self.p2pService.configDesc.clientUid (naprawde trzeba az tak???)
 
     ##########################
     def __sendPing(self):
+        self.pingsSent.append( time.time() )
         self.__send(MessagePing())
 
     ##########################
@@ -163,10 +274,7 @@ class PeerSession(PeerSessionInterface):
 
     ##########################
     def __sendPeers( self ):
-        peersInfo = []
-        for p in self.p2pService.peers.values():
-            peersInfo.append( { "address" : p.address, "port" : p.port, "id" : p.id } )
-        self.__send( MessagePeers( peersInfo ) )
+        self.__send( MessagePeers( self.p2pService.samplePeers( self ) ) )
 
     ##########################
     def __sendTasks( self, tasks ):
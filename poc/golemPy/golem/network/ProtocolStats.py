@@ -0,0 +1,221 @@
+from collections import deque
+
+from Message import Message
+
+DIRECTION_IN    = "<-"
+DIRECTION_OUT   = "->"
+
+UNKNOWN_MESSAGE_TYPE = -1
+
+class RingBuffer:
+    """
+    Keeps last maxSize items, appending is constant time
+    """
+
+    ############################
+    def __init__( self, maxSize ):
+        self.items = deque( maxlen = maxSize )
+
+    ############################
+    def append( self, item ):
+        self.items.append( item )
+
+    ############################
+    def toList( self ):
+        return list( self.items )
+
+    ############################
+    def __len__( self ):
+        return len( self.items )
+
+class TimeHistogram:
+    """
+    Histogram of durations with power of two buckets: bucket 0 counts durations
+    below 1 us and bucket i durations in [ 2^(i-1), 2^i ) us. The last bucket
+    takes everything longer.
+    """
+
+    NumBuckets = 24 # up to ~4s
+
+    ############################
+    def __init__( self ):
+        self.buckets    = [ 0 ] * self.NumBuckets
+        self.count      = 0
+        self.total      = 0.0
+        self.max        = 0.0
+
+    ############################
+    def record( self, seconds ):
+        us = int( seconds * 1e6 )
+        self.buckets[ min( us.bit_length(), self.NumBuckets - 1 ) ] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max( self.max, seconds )
+
+    ############################
+    def percentile( self, p ):
+        """Upper bound of bucket holding p-th percentile in seconds"""
+        if self.count == 0:
+            return 0.0
+
+        limit = p * self.count
+        seen = 0
+        for i, n in enumerate( self.buckets ):
+            seen += n
+            if seen >= limit:
+                return min( ( 1 << i ) * 1e-6, self.max )
+
+        return self.max
+
+    ############################
+    def toDict( self ):
+        return {    "count"     : self.count,
+                    "total"     : self.total,
+                    "max"       : self.max,
+                    "p50"       : self.percentile( 0.5 ),
+                    "p99"       : self.percentile( 0.99 ),
+                    "buckets"   : list( self.buckets ) }
+
+class RttEstimator:
+    """
+    Smoothed round trip time and its mean deviation, updated as in TCP
+    retransmission timer ( RFC 6298 ).
+    """
+
+    Alpha   = 0.125
+    Beta    = 0.25
+
+    ############################
+    def __init__( self ):
+        self.srtt       = 0.0
+        self.rttvar     = 0.0
+        self.samples    = 0
+
+    ############################
+    def addSample( self, rtt ):
+        if self.samples == 0:
+            self.srtt   = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = ( 1.0 - self.Beta ) * self.rttvar + self.Beta * abs( self.srtt - rtt )
+            self.srtt   = ( 1.0 - self.Alpha ) * self.srtt + self.Alpha * rtt
+
+        self.samples += 1
+
+    ############################
+    def estimate( self, default = 0.0 ):
+        return self.srtt if self.samples > 0 else default
+
+    ############################
+    def toDict( self ):
+        return {    "srtt"      : self.srtt,
+                    "rttvar"    : self.rttvar,
+                    "samples"   : self.samples }
+
+class MessageTypeStats:
+
+    ############################
+    def __init__( self ):
+        self.count      = 0
+        self.bytes      = 0
+        self.errors     = 0
+        self.codecTime  = TimeHistogram()   # encoding of sent, decoding of received messages
+        self.handleTime = TimeHistogram()   # session handler of received messages
+
+    ############################
+    def toDict( self ):
+        return {    "count"         : self.count,
+                    "bytes"         : self.bytes,
+                    "errors"        : self.errors,
+                    "codecTime"     : self.codecTime.toDict(),
+                    "handleTime"    : self.handleTime.toDict() }
+
+class ProtocolStats:
+    """
+    Per message type and direction traffic counters of one service ( p2p or task ).
+    Connections report to it, sessions keep last messages in it.
+    """
+
+    LastMessagesNum = 5
+
+    ############################
+    def __init__( self ):
+        self.stats          = {}
+        self.lastMessages   = RingBuffer( self.LastMessagesNum )
+
+    ############################
+    def messageSent( self, msgType, size, encodeTime ):
+        s = self.__get( DIRECTION_OUT, msgType )
+        s.count += 1
+        s.bytes += size
+        s.codecTime.record( encodeTime )
+
+    ############################
+    def messageReceived( self, msgType, size, decodeTime ):
+        s = self.__get( DIRECTION_IN, msgType )
+        s.count += 1
+        s.bytes += size
+        s.codecTime.record( decodeTime )
+
+    ############################
+    def messageHandled( self, msgType, handleTime ):
+        self.__get( DIRECTION_IN, msgType ).handleTime.record( handleTime )
+
+    ############################
+    def error( self, direction, msgType = UNKNOWN_MESSAGE_TYPE ):
+        self.__get( direction, msgType ).errors += 1
+
+    ############################
+    def addLastMessage( self, direction, t, msg, address, port ):
+        self.lastMessages.append( [ direction, t, address, port, msg ] )
+
+    ############################
+    def getLastMessages( self ):
+        return self.lastMessages.toList()
+
+    ############################
+    def toDict( self ):
+        """Aggregates as plain dictionary { ( direction, message name ) : counters } which can be pickled to node snapshot"""
+        ret = {}
+        for ( direction, msgType ), s in self.stats.items():
+            cls = Message.registeredMessageTypes.get( msgType )
+            ret[ ( direction, cls.__name__ if cls else str( msgType ) ) ] = s.toDict()
+
+        return ret
+
+    ############################
+    def __get( self, direction, msgType ):
+        key = ( direction, msgType )
+        s = self.stats.get( key )
+
+        if s is None:
+            s = self.stats[ key ] = MessageTypeStats()
+
+        return s
+
+if __name__ == "__main__":
+
+    from Message import initMessages
+    initMessages()
+
+    ps = ProtocolStats()
+
+    for i in range( 1000 ):
+        ps.messageSent( 1, 26, 0.000004 )
+        ps.messageReceived( 2, 26, 0.00002 + i * 1e-6 )
+        ps.messageHandled( 2, 0.0001 )
+
+    ps.error( DIRECTION_IN )
+
+    for i in range( 10 ):
+        ps.addLastMessage( DIRECTION_OUT, i, "msg", "127.0.0.1", 40102 )
+
+    rtt = RttEstimator()
+    for sample in [ 0.010, 0.012, 0.011, 0.050, 0.010 ]:
+        rtt.addSample( sample )
+
+    print rtt.toDict()
+
+    print ps.getLastMessages()
+    for key, s in sorted( ps.toDict().items() ):
+        print key, s[ "count" ], s[ "bytes" ], s[ "errors" ], s[ "codecTime" ][ "p50" ], s[ "codecTime" ][ "p99" ], s[ "handleTime" ][ "total" ]
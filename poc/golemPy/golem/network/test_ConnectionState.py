@@ -0,0 +1,134 @@
+import sys
+import os
+testDir = os.path.dirname( os.path.abspath( __file__ ) )
+for d in [ ".", "..", "../core" ]:
+    sys.path.append( os.path.join( testDir, d ) )
+
+import unittest
+import struct
+
+from twisted.internet.address import IPv4Address
+
+from Message import MessageHello, MessagePing, MessageDisconnect, MessageTasks, CODEC_BINARY, initMessages
+from ConnectionState import ConnectionState
+
+class FakeTransport:
+
+    ############################
+    def __init__( self ):
+        self.producer   = None
+        self.lost       = False
+        self.written    = []
+
+    ############################
+    def write( self, data ):
+        self.written.append( data )
+
+    ############################
+    def writeSequence( self, seq ):
+        self.written.extend( seq )
+
+    ############################
+    def loseConnection( self ):
+        self.lost = True
+
+    ############################
+    def getPeer( self ):
+        return IPv4Address( "TCP", "10.0.0.2", 40102 )
+
+    ############################
+    def registerProducer( self, producer, streaming ):
+        self.producer = producer
+
+    ############################
+    def unregisterProducer( self ):
+        self.producer = None
+
+class RecordingConnState( ConnectionState ):
+
+    ############################
+    def __init__( self ):
+        ConnectionState.__init__( self )
+        self.received = []
+
+    ############################
+    def _interpret( self, msg ):
+        self.received.append( msg )
+
+class ConnectionStateTest( unittest.TestCase ):
+
+    ############################
+    def setUp( self ):
+        initMessages()
+        self.conn = RecordingConnState()
+        self.conn.makeConnection( FakeTransport() )
+
+    ############################
+    def frames( self, msgs ):
+        data = []
+        for m in msgs:
+            serMsg = m.serialize( CODEC_BINARY )
+            data.append( struct.pack( "!L", len( serMsg ) ) + serMsg )
+        return "".join( data )
+
+    ############################
+    def testSplitFrames( self ):
+        msgs = [ MessageHello( 40102, u"uid" ), MessagePing(), MessageDisconnect( u"reason" ), MessageTasks( [] ) ]
+        data = self.frames( msgs )
+
+        for i in range( len( data ) ):
+            self.assertTrue( self.conn.bytesNeeded() > 0 )
+            self.conn.dataReceived( data[ i ] )
+
+        self.assertEqual( [ m.getType() for m in self.conn.received ], [ m.getType() for m in msgs ] )
+        self.assertEqual( self.conn.received[ 2 ].reason, u"reason" )
+        self.assertEqual( self.conn.bytesNeeded(), 4 )
+        self.assertFalse( self.conn.transport.lost )
+
+    ############################
+    def testManyFramesInOneRead( self ):
+        data = self.frames( [ MessagePing() ] * 100 ) + self.frames( [ MessageDisconnect( u"last" ) ] )[ :-2 ]
+
+        self.conn.dataReceived( data )
+        self.assertEqual( len( self.conn.received ), 100 )
+        self.assertEqual( self.conn.bytesNeeded(), 2 )
+
+        self.conn.dataReceived( self.frames( [ MessageDisconnect( u"last" ) ] )[ -2: ] )
+        self.assertEqual( self.conn.received[ -1 ].reason, u"last" )
+
+    ############################
+    def testUndecodableFrame( self ):
+        self.conn.dataReceived( struct.pack( "!L", 3 ) + "\xc7\xff\xff" + self.frames( [ MessagePing() ] ) )
+
+        self.assertEqual( self.conn.received[ 0 ], None )
+        self.assertEqual( self.conn.received[ 1 ].getType(), MessagePing.Type )
+
+    ############################
+    def testFrameSizeLimit( self ):
+        self.conn.setFrameLimits( 1024 )
+
+        self.conn.dataReceived( struct.pack( "!L", 1024 ) + "\x00" * 10 )
+        self.assertFalse( self.conn.transport.lost )
+        self.assertEqual( self.conn.bytesNeeded(), 1014 )
+
+        conn = RecordingConnState()
+        conn.makeConnection( FakeTransport() )
+        conn.setFrameLimits( 1024 )
+
+        conn.dataReceived( struct.pack( "!L", 1025 ) )
+        self.assertTrue( conn.transport.lost )
+        self.assertFalse( conn.isOpen() )
+        self.assertEqual( conn.received, [] )
+
+    ############################
+    def testBufferedSizeLimit( self ):
+        self.conn.setFrameLimits( 1024, 2048 )
+
+        self.conn.dataReceived( self.frames( [ MessagePing() ] ) * 10 )
+        self.assertFalse( self.conn.transport.lost )
+
+        self.conn.dataReceived( "\x00" * 2049 )
+        self.assertTrue( self.conn.transport.lost )
+
+if __name__ == "__main__":
+    unittest.main()
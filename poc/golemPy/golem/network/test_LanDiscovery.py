@@ -0,0 +1,101 @@
+import sys
+import os
+testDir = os.path.dirname( os.path.abspath( __file__ ) )
+for d in [ "..", "../..", "../core", "." ]:
+    sys.path.append( os.path.join( testDir, d ) )
+
+import unittest
+
+from Message import Message, MessageLanAnnounce, MessageLanReply, MessageTaskToCompute, CODEC_BINARY, initMessages
+from LanDiscovery import LanDiscovery
+from binarycodec import isBinaryFrame
+
+EXECUTED = []
+
+############################
+def payloadExecuted():
+    EXECUTED.append( True )
+
+class Payload( object ):
+    """Object which runs code of the sender when it is unpickled"""
+
+    ############################
+    def __reduce__( self ):
+        return ( payloadExecuted, () )
+
+class FakeConfig:
+    clientUid       = u"local"
+    optNumPeers     = 2
+
+class FakeP2PService:
+
+    ############################
+    def __init__( self ):
+        self.configDesc = FakeConfig()
+        self.candidates = []
+
+    ############################
+    def addPeerCandidate( self, uid, address, port ):
+        self.candidates.append( ( uid, address, port ) )
+
+class TestLanDiscovery( LanDiscovery ):
+    """Does not open multicast sockets"""
+
+    ############################
+    def _LanDiscovery__start( self ):
+        pass
+
+class LanDiscoveryTest( unittest.TestCase ):
+
+    ############################
+    def setUp( self ):
+        initMessages()
+        del EXECUTED[ : ]
+        self.p2pService = FakeP2PService()
+        self.discovery = TestLanDiscovery( self.p2pService, "239.192.0.1", 40100 )
+
+    ############################
+    def testReplyAddsPeerCandidate( self ):
+        data = MessageLanReply( u"remote", 40102, 40103 ).serialize( CODEC_BINARY )
+        self.discovery.datagramReceived( data, "10.0.0.2", 40100 )
+
+        self.assertEqual( self.p2pService.candidates, [ ( u"remote", "10.0.0.2", 40102 ) ] )
+        self.assertEqual( self.discovery.getNodes()[ u"remote" ][ :3 ], ( "10.0.0.2", 40102, 40103 ) )
+
+    ############################
+    def testOwnAnnouncementIsIgnored( self ):
+        data = MessageLanAnnounce( u"local", 40102, 40103 ).serialize( CODEC_BINARY )
+        self.discovery.datagramReceived( data, "10.0.0.1", 40100 )
+
+        self.assertEqual( self.p2pService.candidates, [] )
+
+    ############################
+    def testObjectFieldOfOtherMessageIsNotUnpickled( self ):
+        msg = MessageTaskToCompute( u"subtask", { "x" : Payload() }, u"descr", "", u"10.0.0.2", 40103, extraDataHashes = {}, requestId = 1 )
+        data = msg.serialize( CODEC_BINARY )
+        self.assertTrue( isBinaryFrame( data ) )
+
+        # sanity check - the generic decoder would run the payload
+        Message.deserializeBinaryMessage( data )
+        self.assertEqual( EXECUTED, [ True ] )
+        del EXECUTED[ : ]
+
+        self.discovery.datagramReceived( data, "10.0.0.2", 40100 )
+
+        self.assertEqual( EXECUTED, [] )
+        self.assertEqual( self.p2pService.candidates, [] )
+
+    ############################
+    def testMalformedDatagramsAreDropped( self ):
+        data = MessageLanReply( u"remote", 40102, 40103 ).serialize( CODEC_BINARY )
+
+        for bad in [ data[ :-1 ], data[ :2 ], data[ 0 ] + "\xff" * 12, "\x80\x02garbage" ]:
+            self.discovery.datagramReceived( bad, "10.0.0.2", 40100 )
+
+        self.discovery.datagramReceived( MessageLanReply( u"remote", 0, 40103 ).serialize( CODEC_BINARY ), "10.0.0.2", 40100 )
+        self.discovery.datagramReceived( MessageLanReply( u"", 40102, 40103 ).serialize( CODEC_BINARY ), "10.0.0.2", 40100 )
+
+        self.assertEqual( self.p2pService.candidates, [] )
+
+if __name__ == "__main__":
+    unittest.main()
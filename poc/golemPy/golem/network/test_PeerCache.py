@@ -0,0 +1,99 @@
+import sys
+import os
+testDir = os.path.dirname( os.path.abspath( __file__ ) )
+sys.path.append( testDir )
+
+import unittest
+import tempfile
+import shutil
+
+from PeerCache import PeerCache
+
+class PeerCacheTest( unittest.TestCase ):
+
+    ############################
+    def setUp( self ):
+        self.dir = tempfile.mkdtemp()
+        self.fileName = os.path.join( self.dir, "peers.dat" )
+
+    ############################
+    def tearDown( self ):
+        shutil.rmtree( self.dir, True )
+
+    ############################
+    def testReload( self ):
+        pc = PeerCache( self.fileName )
+        for i in range( 5 ):
+            pc.connected( "peer{}".format( i ), "10.0.0.{}".format( i ), 40102 )
+        pc.update( "peer1", "10.0.0.1", 40102, 0.05 )
+        pc.failed( "10.0.0.2", 40102 )
+        pc.failed( "10.0.0.9", 40102 )
+        pc.close()
+
+        pc = PeerCache( self.fileName )
+        self.assertEqual( len( pc.entries ), 5 )
+        self.assertEqual( pc.records, 5 )
+
+        e = pc.entries[ ( "10.0.0.2", 40102 ) ]
+        self.assertEqual( ( e.peerId, e.attempts, e.successes ), ( "peer2", 2, 1 ) )
+        self.assertEqual( pc.entries[ ( "10.0.0.1", 40102 ) ].srtt, 0.05 )
+        self.assertEqual( pc.best( 1 )[ 0 ].peerId, "peer1" )
+        pc.close()
+
+    ############################
+    def testJournalCompaction( self ):
+        pc = PeerCache( self.fileName )
+        limit = pc.CompactFactor * pc.MaxEntries / 16
+
+        for i in range( 10 * limit ):
+            pc.update( "peer{}".format( i % 3 ), "10.0.0.{}".format( i % 3 ), 40102, 0.01 )
+            self.assertTrue( pc.records <= limit )
+
+        pc.flush()
+        size = os.path.getsize( self.fileName )
+        pc.close()
+
+        pc = PeerCache( self.fileName )
+        self.assertEqual( len( pc.entries ), 3 )
+        self.assertTrue( os.path.getsize( self.fileName ) < size )
+        pc.close()
+
+    ############################
+    def testCompactionKeepsBestEntries( self ):
+        pc = PeerCache( self.fileName )
+        pc.MaxEntries = 8
+
+        for i in range( 40 ):
+            pc.connected( "peer{}".format( i ), "10.0.{}.1".format( i ), 40102 )
+            if i % 2:
+                for j in range( 3 ):
+                    pc.failed( "10.0.{}.1".format( i ), 40102 )
+
+        pc.close()
+
+        PeerCache.MaxEntries, saved = 8, PeerCache.MaxEntries
+        try:
+            pc = PeerCache( self.fileName )
+        finally:
+            PeerCache.MaxEntries = saved
+
+        self.assertEqual( len( pc.entries ), 8 )
+        self.assertTrue( all( e.attempts == e.successes for e in pc.entries.values() ) )
+        pc.close()
+
+    ############################
+    def testDamagedJournal( self ):
+        pc = PeerCache( self.fileName )
+        pc.connected( "peer0", "10.0.0.0", 40102 )
+        pc.connected( "peer1", "10.0.0.1", 40102 )
+        pc.close()
+
+        with open( self.fileName, "r+b" ) as f:
+            f.truncate( os.path.getsize( self.fileName ) - 3 )
+
+        pc = PeerCache( self.fileName )
+        self.assertEqual( pc.entries.keys(), [ ( "10.0.0.0", 40102 ) ] )
+        pc.close()
+
+if __name__ == "__main__":
+    unittest.main()
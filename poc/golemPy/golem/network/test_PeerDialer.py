@@ -0,0 +1,114 @@
+import sys
+import os
+testDir = os.path.dirname( os.path.abspath( __file__ ) )
+sys.path.append( testDir )
+
+import unittest
+import time
+
+from PeerDialer import PeerDialer
+
+class PeerDialerTest( unittest.TestCase ):
+
+    ############################
+    def setUp( self ):
+        self.dialed = []
+        self.dialer = PeerDialer( lambda address, port: self.dialed.append( ( address, port ) ) )
+
+        for i in range( 10 ):
+            self.dialer.addCandidate( "peer{}".format( i ), "10.0.0.{}".format( i ), 40102 )
+
+    ############################
+    def notConnected( self, peerId ):
+        return False
+
+    ############################
+    def testBackoff( self ):
+        for failures in range( 20 ):
+            delay = min( PeerDialer.MaxBackoff, PeerDialer.BaseBackoff * 2 ** failures )
+            for i in range( 20 ):
+                b = self.dialer.backoff( failures )
+                self.assertTrue( delay / 2.0 <= b <= delay )
+
+    ############################
+    def testFailedAddressWaits( self ):
+        c = self.dialer.candidates[ ( "10.0.0.3", 40102 ) ]
+
+        for failures in range( 1, 6 ):
+            before = time.time()
+            self.dialer.failed( "10.0.0.3", 40102 )
+            self.assertEqual( c.failures, failures )
+            self.assertTrue( c.nextTrial >= before + PeerDialer.BaseBackoff * 2 ** failures / 2.0 )
+
+        self.dialer.dial( 10, self.notConnected )
+        self.assertFalse( ( "10.0.0.3", 40102 ) in self.dialed )
+
+        # backoff has passed
+        c.nextTrial = 0.0
+        c.dialing = False
+        self.dialer.dial( 10, self.notConnected )
+        self.dialer.connected( "10.0.0.3", 40102 )
+        self.assertEqual( c.failures, 0 )
+
+    ############################
+    def testParallelDials( self ):
+        self.assertEqual( self.dialer.dial( 10, self.notConnected ), PeerDialer.MaxParallelDials )
+        self.assertEqual( self.dialer.dial( 10, self.notConnected ), 0 )
+        self.assertEqual( len( self.dialed ), PeerDialer.MaxParallelDials )
+
+        address, port = self.dialed[ 0 ]
+        self.dialer.failed( address, port )
+        self.assertEqual( self.dialer.dial( 10, self.notConnected ), 1 )
+        self.assertFalse( self.dialed[ -1 ] == ( address, port ) )
+
+    ############################
+    def testRecentlyConnectedFirst( self ):
+        self.dialer.connected( "10.0.0.7", 40102 )
+        self.dialer.addCandidate( "peer5", "10.0.0.5", 40102, score = 1.0 )
+
+        self.dialer.dial( 2, self.notConnected )
+        self.assertEqual( self.dialed, [ ( "10.0.0.7", 40102 ), ( "10.0.0.5", 40102 ) ] )
+
+    ############################
+    def testConnectedPeersAreSkipped( self ):
+        self.dialer.dial( 4, lambda peerId: peerId != "peer2" )
+        self.assertEqual( self.dialed, [ ( "10.0.0.2", 40102 ) ] )
+
+    ############################
+    def testAllCandidatesInBackoff( self ):
+        self.assertTrue( self.dialer.hasCandidates( self.notConnected ) )
+
+        for c in self.dialer.candidates.values():
+            self.dialer.failed( c.address, c.port )
+
+        # dead addresses waiting for retry do not stop asking peers for new ones
+        self.assertFalse( self.dialer.hasCandidates( self.notConnected ) )
+        self.assertEqual( self.dialer.dial( 10, self.notConnected ), 0 )
+
+        self.dialer.candidates[ ( "10.0.0.6", 40102 ) ].nextTrial = 0.0
+        self.assertTrue( self.dialer.hasCandidates( self.notConnected ) )
+
+    ############################
+    def testEviction( self ):
+        self.dialer.failed( "10.0.0.4", 40102 )
+        self.dialer.connected( "10.0.0.5", 40102 )
+        for c in self.dialer.candidates.values():
+            c.added -= 100.0
+
+        self.dialer.addCandidate( None, "10.1.0.0", 40102 )
+        self.assertEqual( len( self.dialer.candidates ), 11 )
+
+        for i in range( 1, PeerDialer.MaxCandidates ):
+            self.dialer.addCandidate( None, "10.1.{}.{}".format( i / 256, i % 256 ), 40102 )
+            if i == PeerDialer.MaxCandidates - 10:
+                # the failed address goes first
+                self.assertFalse( ( "10.0.0.4", 40102 ) in self.dialer.candidates )
+                self.assertTrue( ( "10.0.0.0", 40102 ) in self.dialer.candidates )
+
+        # then the oldest ones, recently connected are kept
+        self.assertEqual( len( self.dialer.candidates ), PeerDialer.MaxCandidates )
+        self.assertFalse( ( "10.0.0.0", 40102 ) in self.dialer.candidates )
+        self.assertTrue( ( "10.0.0.5", 40102 ) in self.dialer.candidates )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+import sys
+import os
+testDir = os.path.dirname( os.path.abspath( __file__ ) )
+for d in [ ".", "..", "../core" ]:
+    sys.path.append( os.path.join( testDir, d ) )
+
+import unittest
+
+from twisted.internet.address import IPv4Address
+
+from Message import MessageGetTaskChanges, MessageTaskChanges, MessageDisconnect, initMessages
+from bloomfilter import BloomFilter
+from PeerSession import PeerSession
+
+class FakeTransport:
+
+    ############################
+    def getPeer( self ):
+        return IPv4Address( "TCP", "10.0.0.2", 40102 )
+
+class FakeConn:
+
+    ############################
+    def __init__( self ):
+        self.transport  = FakeTransport()
+        self.sent       = []
+
+    ############################
+    def sendMessage( self, msg ):
+        self.sent.append( msg )
+        return True
+
+    ############################
+    def isOpen( self ):
+        return True
+
+class FakeTaskServer:
+
+    ############################
+    def __init__( self ):
+        self.known = []
+
+    ############################
+    def getTaskChanges( self, epoch, sinceVersion, known ):
+        self.known.append( known )
+        return u"epoch", 1, True, [], []
+
+class FakeP2PService:
+
+    ############################
+    def __init__( self ):
+        self.taskServer = FakeTaskServer()
+
+    ############################
+    def setLastMessage( self, direction, time, msg, address, port ):
+        pass
+
+class PeerSessionTaskSyncTest( unittest.TestCase ):
+
+    ############################
+    def setUp( self ):
+        initMessages()
+        self.newSession()
+
+    ############################
+    def newSession( self ):
+        self.session = PeerSession( FakeConn() )
+        self.session.p2pService = FakeP2PService()
+
+    ############################
+    def sentTypes( self ):
+        return [ m.getType() for m in self.session.conn.sent ]
+
+    ############################
+    def testValidFilter( self ):
+        known = BloomFilter.forCapacity( 100, seed = 7 )
+        known.add( u"task" )
+        self.session.interpret( MessageGetTaskChanges( knownTasks = known.toBytes(), filterHashes = known.numHashes, filterSeed = known.seed ) )
+
+        self.assertEqual( self.sentTypes(), [ MessageTaskChanges.Type ] )
+        self.assertTrue( u"task" in self.session.p2pService.taskServer.known[ 0 ] )
+
+    ############################
+    def testNoFilter( self ):
+        self.session.interpret( MessageGetTaskChanges() )
+
+        self.assertEqual( self.sentTypes(), [ MessageTaskChanges.Type ] )
+        self.assertEqual( self.session.p2pService.taskServer.known, [ None ] )
+
+    ############################
+    def testOversizedFilter( self ):
+        for knownTasks, filterHashes, filterSeed in [ ( "\xff" * 16, 10 ** 6, 0 ),
+                                                      ( "\xff" * 16, 0, 0 ),
+                                                      ( "\xff" * 16, 7, -1 ),
+                                                      ( "\xff" * 16, 7, 2 ** 32 ),
+                                                      ( "\xff" * ( PeerSession.MaxFilterSize + 1 ), 7, 0 ),
+                                                      ( [ 1, 2 ], 7, 0 ) ]:
+            self.newSession()
+            self.session.interpret( MessageGetTaskChanges( knownTasks = knownTasks, filterHashes = filterHashes, filterSeed = filterSeed ) )
+
+            self.assertEqual( self.sentTypes(), [ MessageDisconnect.Type ] )
+            self.assertEqual( self.session.conn.sent[ 0 ].reason, PeerSession.DCRBadProtocol )
+            self.assertEqual( self.session.p2pService.taskServer.known, [] )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+import os
+import re
+import cPickle as pickle
+
+from Message import MessageStreamOpen, MessageStreamChunk, MessageStreamAck
+from simplehash import SimpleHash
+
+STREAM_KIND_RESULT      = u"result"
+STREAM_KIND_RESOURCE    = u"resource"
+
+SHA1_HEX = re.compile( r"^[0-9a-f]{40}$" )
+
+############################
+def spoolObject( obj, fileName ):
+    """Pickles obj to file, returns ( size, hex sha1 ) of the spooled data"""
+    with open( fileName, "wb" ) as fh:
+        pickle.dump( obj, fh, pickle.HIGHEST_PROTOCOL )
+
+    return os.path.getsize( fileName ), SimpleHash.hash_file_hex( fileName )
+
+############################
+def loadSpooledObject( fileName ):
+    with open( fileName, "rb" ) as fh:
+        return pickle.load( fh )
+
+class StreamSender:
+    """
+    Sends file as sequence of MessageStreamChunk. Sending starts from the offset
+    given by the first ack of receiver and at most Window bytes are sent ahead
+    of the last acknowledged offset.
+    """
+
+    ChunkSize   = 64 * 1024
+    Window      = 8 * ChunkSize
+
+    ############################
+    def __init__( self, conn, streamId, kind, fileName, size, hash ):
+        self.conn       = conn
+        self.streamId   = streamId
+        self.kind       = kind
+        self.fileName   = fileName
+        self.size       = size
+        self.hash       = hash
+        self.fh         = None
+        self.sentPos    = 0
+        self.ackedPos   = -1
+
+    ############################
+    def open( self ):
+        if self.size > 0:
+            self.fh = open( self.fileName, "rb" )
+        self.conn.sendMessage( MessageStreamOpen( self.streamId, self.kind, self.size, self.hash ) )
+
+    ############################
+    def acked( self, offset ):
+        """Returns True once receiver has the whole stream"""
+        if offset > self.size:
+            raise ValueError( "Stream {} acknowledged offset {} beyond its size {}".format( self.streamId, offset, self.size ) )
+
+        self.ackedPos = max( self.ackedPos, offset )
+        self.sentPos = max( self.sentPos, self.ackedPos )
+
+        if self.finished():
+            self.close()
+            return True
+
+        while self.sentPos < self.size and self.sentPos - self.ackedPos < self.Window:
+            self.fh.seek( self.sentPos )
+            data = self.fh.read( min( self.ChunkSize, self.size - self.sentPos ) )
+            if not data:
+                raise IOError( "Spool file {} is shorter than expected".format( self.fileName ) )
+
+            self.conn.sendMessage( MessageStreamChunk( self.streamId, self.sentPos, data ) )
+            self.sentPos += len( data )
+
+        return False
+
+    ############################
+    def finished( self ):
+        return self.ackedPos == self.size
+
+    ############################
+    def close( self ):
+        if self.fh:
+            self.fh.close()
+            self.fh = None
+
+class StreamReceiver:
+    """
+    Writes chunks of stream directly to file. Data of interrupted transfer is
+    kept in the .part file so the next transfer of the same content resumes
+    from its size.
+    """
+
+    ############################
+    def __init__( self, streamId, fileName, size, hash ):
+        """Raises ValueError if size or hash sent by peer is malformed and IOError if part file cannot be opened"""
+        # hash is a part of file name
+        if not isinstance( hash, basestring ) or not SHA1_HEX.match( hash ):
+            raise ValueError( "Malformed stream hash {!r}".format( hash ) )
+        if not isinstance( size, ( int, long ) ) or size < 0:
+            raise ValueError( "Malformed stream size {!r}".format( size ) )
+
+        self.streamId   = streamId
+        self.fileName   = fileName
+        self.partName   = "{}.{}.part".format( fileName, hash )
+        self.size       = size
+        self.hash       = hash
+
+        if os.path.exists( self.partName ) and os.path.getsize( self.partName ) <= size:
+            self.fh = open( self.partName, "ab" )
+        else:
+            self.fh = open( self.partName, "wb" )
+
+        self.offset = self.fh.tell()
+
+    ############################
+    def ack( self ):
+        return MessageStreamAck( self.streamId, self.offset )
+
+    ############################
+    def chunkReceived( self, offset, data ):
+        """Returns False if data does not continue the stream"""
+        if offset != self.offset or offset + len( data ) > self.size:
+            return False
+
+        self.fh.write( data )
+        self.offset += len( data )
+
+        if self.complete():
+            self.fh.close()
+
+        return True
+
+    ############################
+    def complete( self ):
+        return self.offset == self.size
+
+    ############################
+    def finish( self ):
+        """Verifies received data and moves it to target file, returns False if hash does not match"""
+        self.close()
+
+        if SimpleHash.hash_file_hex( self.partName ) != self.hash:
+            os.remove( self.partName )
+            return False
+
+        if os.path.exists( self.fileName ):
+            os.remove( self.fileName )
+        os.rename( self.partName, self.fileName )
+
+        return True
+
+    ############################
+    def close( self ):
+        if not self.fh.closed:
+            self.fh.close()
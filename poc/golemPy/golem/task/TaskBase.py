@@ -8,10 +8,14 @@ class TaskHeader:
         self.taskId = taskId
         self.taskOwnerAddress = taskOwnerAddress
         self.taskOwnerPort = taskOwnerPort
-        self.lastChecking = time.time()
         self.ttl = ttl
+        self.expires = time.time() + ttl
         self.clientId = clientId
 
+    #######################
+    def remainingTtl( self ):
+        return max( 0.0, self.expires - time.time() )
+
 class TaskBuilder:
     #######################
     def __init__( self ):
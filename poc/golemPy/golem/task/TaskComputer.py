@@ -11,9 +11,12 @@ from vm import PythonVM
 from NodeStateSnapshot import TaskChunkStateSnapshot
 from ResourcesManager import ResourcesManager
 from Environment import TaskComputerEnvironment
+from contentcache import ContentCache, unpackContent
 
 class TaskComputer:
 
+    ContentCacheSize = 64 * 1024 * 1024
+
     ######################
     def __init__( self, clientUid, taskServer, estimatedPerformance, taskRequestFrequency ):
         self.clientUid              = clientUid
@@ -24,6 +27,7 @@ class TaskComputer:
         self.lock                   = Lock()
         self.lastTaskRequest        = time.time()
         self.taskRequestFrequency   = taskRequestFrequency
+        self.requestTimer           = None  # woken when computer may request the next task
 
         self.env                    = TaskComputerEnvironment( "ComputerRes", self.clientUid )
 
@@ -35,6 +39,10 @@ class TaskComputer:
         self.curExtraData           = None
         self.curShortDescr          = None
 
+        self.contentCache           = ContentCache( self.ContentCacheSize )
+
+        self.taskThreadType         = PyTaskThread  # network simulator computes in virtual time instead
+
     ######################
     def taskGiven( self, subTaskId, srcCode, extraData, shortDescr, returnAddress, returnPort ):
         if subTaskId not in self.assignedSubTasks:
@@ -45,11 +53,38 @@ class TaskComputer:
         else:
             return False
 
+    ######################
+    def resolveContent( self, srcCode, srcCodeHash, extraData, extraDataHashes, received = {} ):
+        """Replaces content references with cached values, returns ( srcCode, extraData ) or None if some content is missing"""
+        contents = {}
+
+        for h in ( [ srcCodeHash ] if srcCodeHash else [] ) + extraDataHashes.values():
+            data = received.get( h ) or self.contentCache.get( h )
+            if data is None:
+                return None
+            contents[ h ] = unpackContent( data )
+
+        if srcCodeHash:
+            srcCode = contents[ srcCodeHash ]
+
+        if extraDataHashes:
+            extraData = dict( extraData )
+            for key, h in extraDataHashes.items():
+                extraData[ key ] = contents[ h ]
+
+        return srcCode, extraData
+
+    ######################
+    def setRequestTimer( self, timer ):
+        """Timer of timer queue running run, it is woken by events which allow the next task request"""
+        self.requestTimer = timer
+
     ######################
     def resourceGiven( self, subTaskId ):
         if subTaskId in self.assignedSubTasks:
             self.__computeTask( subTaskId, self.assignedSubTasks[ subTaskId ].srcCode, self.assignedSubTasks[ subTaskId ].extraData, self.assignedSubTasks[ subTaskId ].shortDescr )
             self.waitingForTask = None
+            self.__wakeRequests()
             return True
         else:
             return False
@@ -58,12 +93,14 @@ class TaskComputer:
     def taskRequestRejected( self, taskId, reason ):
         self.waitingForTask = None
         print "Task {} request rejected: {}".format( taskId, reason )
+        self.__wakeRequests()
 
     ######################
     def resourceRequestRejected( self, subTaskId, reason ):
         self.waitingForTask = None
         print "Task {} resource request rejected: {}".format( subTaskId, reason )
         del self.assignedSubTasks[ subTaskId ]
+        self.__wakeRequests()
 
     ######################
     def taskComputed( self, taskThread ):
@@ -78,13 +115,28 @@ class TaskComputer:
                     self.taskServer.sendResults( subTaskId, taskThread.result, self.assignedSubTasks[ subTaskId ].ownerAddress, self.assignedSubTasks[ subTaskId ].ownerPort )
                     del self.assignedSubTasks[ subTaskId ]
 
+        if self.requestTimer:
+            # computations finish in their own threads
+            from twisted.internet import reactor
+            reactor.callFromThread( self.requestTimer.wake )
+
     ######################
     def run( self ):
-        if not self.waitingForTask:
-            if time.time() - self.lastTaskRequest > self.taskRequestFrequency:
-                if len( self.currentComputations ) == 0:
-                    self.lastTaskRequest = time.time()
-                    self.__requestTask()
+        """
+        Requests task if computer is idle. Returns time left until the next
+        request is allowed, so the timer queue runs it again just then. Busy
+        computer keeps the timer interval, events ending the work wake it sooner.
+        """
+        if self.waitingForTask or self.currentComputations:
+            return None
+
+        wait = self.lastTaskRequest + self.taskRequestFrequency - time.time()
+        if wait > 0.0:
+            return wait
+
+        self.lastTaskRequest = time.time()
+        self.__requestTask()
+        return None
 
     ######################
     def getProgresses( self ):
@@ -95,6 +147,11 @@ class TaskComputer:
 
         return ret
 
+    ######################
+    def __wakeRequests( self ):
+        if self.requestTimer:
+            self.requestTimer.wake()
+
     ######################
     def __requestTask( self ):
         self.waitingForTask = self.taskServer.requestTask( self.estimatedPerformance )
@@ -106,7 +163,7 @@ class TaskComputer:
     ######################
     def __computeTask( self, subTaskId, srcCode, extraData, shortDescr ):
         self.env.clearTemporary( subTaskId )
-        tt = PyTaskThread( self, subTaskId, srcCode, extraData, shortDescr, self.resourceManager.getResourceDir( subTaskId ), self.resourceManager.getTemporaryDir( subTaskId ) ) 
+        tt = self.taskThreadType( self, subTaskId, srcCode, extraData, shortDescr, self.resourceManager.getResourceDir( subTaskId ), self.resourceManager.getTemporaryDir( subTaskId ) ) 
         self.currentComputations.append( tt )
         tt.start()
 
@@ -2,7 +2,18 @@
 from Message import Message
 from ConnectionState import ConnectionState
 
+# Peer keeps content cache, so source code and large extraData may be sent as hashes
+FEATURE_CONTENT_CACHE = u"contentCache"
+# Task results are sent as chunked stream which can be resumed
+FEATURE_RESULT_STREAM = u"resultStream"
+# Connection is kept open and shared by many requests, resources are sent as streams
+FEATURE_CHANNELS = u"channels"
+
 class TaskConnState( ConnectionState ):
+
+    MaxFrameSize = 256 * 1024 * 1024
+    Features = [ FEATURE_CONTENT_CACHE, FEATURE_RESULT_STREAM, FEATURE_CHANNELS ]
+
     ##########################
     def __init__( self, server = None):
         ConnectionState.__init__( self )
@@ -16,7 +27,7 @@ class TaskConnState( ConnectionState ):
 
     ############################
     def connectionMade(self):
-        self.opened = True
+        ConnectionState.connectionMade( self )
 
         if self.server:
             from TaskSession import TaskSession
@@ -32,23 +43,12 @@ class TaskConnState( ConnectionState ):
             self.fileDataReceived( data )
             return
 
-        self.db.appendString(data)
-
-        mess = None
-
-        try:
-            mess = Message.deserialize(self.db)
-        except:
-            print "Cannot deserialize message len: {} : {}".format( len(data), data )
-
-        if mess is None:
-            print "Deserialization message failed"
-            self.taskSession.interpret(None)
-            return
+        ConnectionState.dataReceived( self, data )
 
+    ############################
+    def _interpret( self, msg ):
         if self.taskSession:
-            for m in mess:
-                self.taskSession.interpret(m)
+            self.taskSession.interpret( msg )
         else:
             print "Task session for connection is None"
             assert False
@@ -61,7 +61,7 @@ class TaskConnState( ConnectionState ):
 
     ############################
     def connectionLost(self, reason):
-        self.opened = False
+        ConnectionState.connectionLost( self, reason )
 
         if self.taskSession:
             self.taskSession.dropped()
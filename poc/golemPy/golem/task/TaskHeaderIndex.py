@@ -0,0 +1,89 @@
+import uuid
+
+class TaskHeaderIndex:
+    """
+    Task headers advertised by this node. Every addition and removal gets
+    next version number, so peers may ask only for changes since the
+    version they have seen. Removals are remembered as tombstones, peer
+    asking for version older than the oldest forgotten tombstone gets the
+    full list. Epoch changes with every restart of the node.
+    """
+
+    MaxTombstones = 1000
+
+    ############################
+    def __init__( self ):
+        self.epoch          = uuid.uuid4().hex
+        self.version        = 0
+        self.headers        = {}    # taskId -> ( version, header )
+        self.tombstones     = {}    # taskId -> version
+        self.forgotten      = 0     # highest version of forgotten tombstone
+
+    ############################
+    def add( self, header ):
+        if header.taskId in self.headers:
+            return False
+
+        self.version += 1
+        self.headers[ header.taskId ] = ( self.version, header )
+        self.tombstones.pop( header.taskId, None )
+        return True
+
+    ############################
+    def remove( self, taskId ):
+        if taskId not in self.headers:
+            return False
+
+        del self.headers[ taskId ]
+        self.version += 1
+        self.tombstones[ taskId ] = self.version
+
+        if len( self.tombstones ) > self.MaxTombstones:
+            oldest = min( self.tombstones, key = self.tombstones.get )
+            self.forgotten = self.tombstones.pop( oldest )
+
+        return True
+
+    ############################
+    def __contains__( self, taskId ):
+        return taskId in self.headers
+
+    ############################
+    def changesSince( self, epoch, version, known = None ):
+        """
+        Returns ( full, headers, removed ): headers added after version which are
+        not in known filter and ids of removed ones. If peer's version cannot be
+        continued full is True and all headers are returned
+        """
+        full = epoch != self.epoch or version > self.version or version < self.forgotten
+
+        if not full and version == self.version:
+            return False, [], [] # peer is up to date - the common case
+        elif full:
+            headers = [ h for v, h in self.headers.itervalues() ]
+            removed = []
+        else:
+            headers = [ h for v, h in self.headers.itervalues() if v > version ]
+            removed = [ taskId for taskId, v in self.tombstones.iteritems() if v > version ]
+
+        if known is not None:
+            headers = [ h for h in headers if h.taskId not in known ]
+
+        return full, headers, removed
+
+if __name__ == "__main__":
+
+    from TaskBase import TaskHeader
+
+    idx = TaskHeaderIndex()
+    for i in range( 5 ):
+        idx.add( TaskHeader( "node", "task{}".format( i ), "127.0.0.1", 40102, 600.0 ) )
+
+    v = idx.version
+    idx.remove( "task1" )
+    idx.add( TaskHeader( "node", "task9", "127.0.0.1", 40102, 600.0 ) )
+
+    full, headers, removed = idx.changesSince( idx.epoch, v )
+    print full, [ h.taskId for h in headers ], removed
+    print idx.changesSince( idx.epoch, idx.version )
+    print idx.changesSince( "old epoch", idx.version )[ 0 ]
@@ -1,16 +1,25 @@
 
 import random
 import time
+import os
 
 from TaskBase import Task
 from NodeStateSnapshot import LocalTaskStateSnapshot
 from Environment import TaskManagerEnvironment
+from contentcache import ContentCache, packContent
+from StreamTransfer import loadSpooledObject
+from deadlinequeue import DeadlineQueue
 
 class TaskManager:
+
+    ContentStoreSize    = 256 * 1024 * 1024
+    ContentRefMinSize   = 1024 # smaller extraData values are always sent inline
+
     #######################
     def __init__( self, clientUid, listenAddress = "", listenPort = 0 ):
         self.clientUid      = clientUid
         self.tasks          = {}
+        self.deadlines      = DeadlineQueue()
         self.tasksComputed  = []
         self.listenAddress  = listenAddress
         self.listenPort     = listenPort
@@ -19,6 +28,11 @@ class TaskManager:
 
         self.subTask2TaskMapping = {}
 
+        self.contentStore   = ContentCache( self.ContentStoreSize )
+        self.srcCodeHashes  = {}
+
+        self.listeners      = []
+
     #######################
     def addNewTask( self, task):
         assert task.header.taskId not in self.tasks
@@ -27,10 +41,21 @@ class TaskManager:
         task.header.taskOwnerPort = self.listenPort
 
         task.initialize()
+        # ttl may have been set after header was created
+        task.header.expires = time.time() + task.header.ttl
         self.tasks[ task.header.taskId ] = task
+        self.deadlines.set( task.header.taskId, task.header.expires )
 
         self.env.clearTemporary( task.header.taskId )
 
+        for l in self.listeners:
+            l.taskAdded( task.header )
+
+    #######################
+    def registerListener( self, listener ):
+        """listener.taskAdded( header ) is called for every new task"""
+        self.listeners.append( listener )
+
     #######################
     def getNextSubTask( self, taskId, estimatedPerformance ):
         if taskId in self.tasks:
@@ -42,10 +67,38 @@ class TaskManager:
                     self.subTask2TaskMapping[ subTaskId ] = taskId
                     return subTaskId, task.srcCode, ed, sd, returnAddress, returnPort
             print "Cannot get next task for estimated performence {}".format( estimatedPerformance )
-            return 0, "", 0, {}, ""
+            return 0, "", {}, {}, "", 0
         else:
             print "Cannot find task {} in my tasks".format( taskId )
-            return 0, "", 0, {}, ""
+            return 0, "", {}, {}, "", 0
+
+    #######################
+    def getContentRefs( self, taskId, srcCode, extraData ):
+        """Puts source code and large extraData values to content store, returns ( srcCodeHash, inline extraData, extraDataHashes )"""
+        srcCodeHash = self.srcCodeHashes.get( taskId )
+
+        if srcCodeHash is None or self.contentStore.get( srcCodeHash ) is None:
+            srcCodeHash = self.contentStore.put( packContent( srcCode ) )
+            self.srcCodeHashes[ taskId ] = srcCodeHash
+
+        if not isinstance( extraData, dict ):
+            return srcCodeHash, extraData, {}
+
+        inlineData      = {}
+        extraDataHashes = {}
+
+        for key, value in extraData.items():
+            packed = packContent( value )
+            if len( packed ) >= self.ContentRefMinSize:
+                extraDataHashes[ key ] = self.contentStore.put( packed )
+            else:
+                inlineData[ key ] = value
+
+        return srcCodeHash, inlineData, extraDataHashes
+
+    #######################
+    def getContent( self, contentHash ):
+        return self.contentStore.get( contentHash )
 
     #######################
     def getTasksHeaders( self ):
@@ -65,16 +118,26 @@ class TaskManager:
             print "It is not my task id {}".format( subTaskId )
             return False
 
+    #######################
+    def computedTaskFileReceived( self, subTaskId, fileName ):
+        result = loadSpooledObject( fileName )
+        os.remove( fileName )
+        return self.computedTaskReceived( subTaskId, result )
+
+    #######################
+    def getResultFileName( self, subTaskId ):
+        taskId = self.subTask2TaskMapping[ subTaskId ]
+        return os.path.join( self.env.getTaskTemporaryDir( taskId ), "{}.result".format( subTaskId ) )
+
     #######################
     def removeOldTasks( self ):
-        for t in self.tasks.values():
-            th = t.header
-            currTime = time.time()
-            th.ttl = th.ttl - ( currTime - th.lastChecking )
-            th.lastChecking = currTime
-            if th.ttl <= 0:
-                print "Task {} dies".format( th.id )
-                del self.tasks[ th.id ]
+        for taskId in self.deadlines.popExpired( time.time() ):
+            print "Task {} dies".format( taskId )
+            del self.tasks[ taskId ]
+
+    #######################
+    def nextExpiry( self ):
+        return self.deadlines.nextDeadline()
 
     #######################
     def getProgresses( self ):
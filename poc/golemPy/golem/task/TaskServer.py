@@ -4,12 +4,34 @@ from TaskManager import TaskManager
 from TaskComputer import TaskComputer
 from TaskSession import TaskSession
 from TaskBase import TaskHeader
+from TaskHeaderIndex import TaskHeaderIndex
 from TaskConnState import TaskConnState
+from StreamTransfer import spoolObject, loadSpooledObject
+from ProtocolStats import ProtocolStats, RttEstimator
+from bloomfilter import BloomFilter
+from deadlinequeue import DeadlineQueue
+from tokenbucket import TokenBucket
+from twisted.internet import reactor
+from collections import OrderedDict
 import random
 import time
 import cPickle
+import os
 
 class TaskServer:
+
+    # Channel without outstanding requests is closed after this time, incoming
+    # side waits twice as long so that it is normally closed by the requester
+    ChannelIdleTimeout = 30.0
+
+    ExpiryInterval          = 60.0  # expiry timer is also woken for every new deadline
+
+    MaxOwnersRtt            = 1024
+    ResultsInterval         = 10.0  # results timer is woken when result is ready or its retry is due
+    ResumeRetryDelay        = 2.0   # interrupted result stream is resumed after this, doubled on every failure
+    ResumeMaxRetryDelay     = 120.0
+    MinTimerInterval        = 0.1   # zero intervals from config would spin
+
     #############################
     def __init__( self, address, configDesc ):
 
@@ -18,33 +40,62 @@ class TaskServer:
         self.address            = address
         self.curPort            = configDesc.startPort
         self.taskHeaders        = {}
+        self.headerIndex        = TaskHeaderIndex() # headers advertised to peers - remote and own
+        self.ownHeaderIds       = set()
+        self.headerDeadlines    = DeadlineQueue()
         self.taskManager        = TaskManager( configDesc.clientUid )
+        self.taskManager.registerListener( self )
         self.taskComputer       = TaskComputer( configDesc.clientUid, self, self.configDesc.estimatedPerformance, self.configDesc.taskRequestInterval )
-        self.taskSeesions       = {}
-        self.taskSeesionsIncoming = []
+        self.taskSessions       = []
+        self.channels           = {}    # ( address, port ) -> session shared by all requests to that node
+        self.connectingChannels = {}    # ( address, port ) -> requests waiting for connection
+        self.legacyPeers        = set() # ( address, port ) of nodes handling one request per connection
 
-        self.lastMessages       = []
+        self.stats              = ProtocolStats()
+        self.capture            = None
+        self.ownersRtt          = OrderedDict() # ( address, port ) -> RttEstimator of task owner, least recently used first
+        self.uploadLimit        = TokenBucket( configDesc.maxUploadRate ) # bulk data of all connections
 
         self.resultsToSend      = {}
+        self.resultsTimer       = None
+        self.expiryTimer        = None
 
         self.__startAccepting()
 
+    #############################
+    def setCapture( self, capture ):
+        """Frames of task sessions opened from now on are appended to CaptureLog"""
+        self.capture = capture
+
     #############################
     def syncNetwork( self ):
         self.taskComputer.run()
         self.__removeOldTasks()
         self.__sendWaitingResults()
+        self.__closeIdleChannels()
+
+    #############################
+    def registerTimers( self, timers ):
+        """Runs periodic work from timer queue, syncNetwork is not needed then"""
+        self.taskComputer.setRequestTimer( timers.callEvery( max( self.MinTimerInterval, self.taskComputer.taskRequestFrequency ), self.taskComputer.run ) )
+        self.expiryTimer = timers.callEvery( self.ExpiryInterval, self.__removeOldTasks )
+        timers.callEvery( self.ChannelIdleTimeout / 3.0, self.__closeIdleChannels )
+        self.resultsTimer = timers.callEvery( self.ResultsInterval, self.__sendWaitingResults )
 
     #############################
     # This method chooses random task from the network to compute on our machine
     def requestTask( self, estimatedPerformance ):
 
         if len( self.taskHeaders.values() ) > 0:
-            tn = random.randrange( 0, len( self.taskHeaders.values() ) )
+            # better of two random owners - prefers close owners but spreads load
+            headers = self.taskHeaders.values()
+            theader = random.choice( headers )
+            other   = random.choice( headers )
 
-            theader = self.taskHeaders.values()[ tn ]
+            if self.__ownerRtt( other ) < self.__ownerRtt( theader ):
+                theader = other
 
-            self.__connectAndSendTaskRequest( theader.taskOwnerAddress, theader.taskOwnerPort, theader.taskId, estimatedPerformance )
+            self.__runOnChannel( theader.taskOwnerAddress, theader.taskOwnerPort, self.__sendTaskRequest, self.__taskRequestFailure, theader.taskId, estimatedPerformance )
 
             return theader.taskId
         else:
@@ -52,77 +103,164 @@ class TaskServer:
 
     #############################
     def requestResource( self, subTaskId, resourceHeader, address, port ):
-        self.__connectAndSendResourceRequest( address, port, subTaskId, resourceHeader )
+        self.__runOnChannel( address, port, self.__sendResourceRequest, self.__resourceRequestFailure, subTaskId, resourceHeader )
         return subTaskId
 
     #############################
     def sendResults( self, subTaskId, result, ownerAddress, ownerPort ):
         
         if subTaskId not in self.resultsToSend:
-            self.resultsToSend[ subTaskId ] = WaitingTaskResult( subTaskId, result, 0.0, 0.0, ownerAddress, ownerPort )
+            spoolFile = os.path.join( self.taskComputer.env.getTaskTemporaryDir( subTaskId ), "result" )
+            try:
+                size, hash = spoolObject( result, spoolFile )
+                self.resultsToSend[ subTaskId ] = WaitingTaskResult( subTaskId, None, 0.0, 0.0, ownerAddress, ownerPort, spoolFile, size, hash )
+            except IOError as ex:
+                print "Cannot spool result of {}, keeping it in memory: {}".format( subTaskId, ex )
+                self.resultsToSend[ subTaskId ] = WaitingTaskResult( subTaskId, result, 0.0, 0.0, ownerAddress, ownerPort )
         else:
             assert False
 
+        if self.resultsTimer:
+            # results come from computing threads
+            reactor.callFromThread( self.resultsTimer.wake )
+
         return True
 
     #############################
     def newConnection(self, session):
 
-        session.taskServer = self
-        session.taskComputer = self.taskComputer
-        session.taskManager = self.taskManager
-
-        self.taskSeesionsIncoming.append( session )
+        self.__initSession( session )
 
     #############################
     def getTasksHeaders( self ):
         ths =  self.taskHeaders.values() + self.taskManager.getTasksHeaders()
 
-        ret = []
+        return [ self.getTaskHeaderRepr( th ) for th in ths ]
 
-        for th in ths:
-            ret.append({    "id"            : th.taskId, 
-                            "address"       : th.taskOwnerAddress,
-                            "port"          : th.taskOwnerPort,
-                            "ttl"           : th.ttl,
-                            "clientId"      : th.clientId })
+    #############################
+    def getTaskHeaderRepr( self, th ):
+        return {    "id"            : th.taskId, 
+                    "address"       : th.taskOwnerAddress,
+                    "port"          : th.taskOwnerPort,
+                    "ttl"           : th.remainingTtl(),
+                    "clientId"      : th.clientId }
+
+    #############################
+    def getTaskChanges( self, epoch, sinceVersion, known = None ):
+        """Returns ( epoch, version, full, headers, removed ) with headers added and ids removed since peer's version"""
+        self.__syncOwnHeaders()
+
+        full, headers, removed = self.headerIndex.changesSince( epoch, sinceVersion, known )
+
+        return self.headerIndex.epoch, self.headerIndex.version, full, [ self.getTaskHeaderRepr( th ) for th in headers ], removed
+
+    #############################
+    def getKnownTasksFilter( self, seed ):
+        known = BloomFilter.forCapacity( len( self.taskHeaders ) + len( self.taskManager.tasks ), seed = seed )
+
+        for taskId in self.taskHeaders:
+            known.add( taskId )
+        for taskId in self.taskManager.tasks:
+            known.add( taskId )
 
-        return ret
+        return known
 
     #############################
     def addTaskHeader( self, thDictRepr ):
         try:
             id = thDictRepr[ "id" ]
-            if id not in self.taskHeaders.keys(): # dont have it
-                if id not in self.taskManager.tasks.keys(): # It is not my task id
+            if id not in self.taskHeaders: # dont have it
+                if id not in self.taskManager.tasks: # It is not my task id
                     print "Adding task {}".format( id )
                     self.taskHeaders[ id ] = TaskHeader( thDictRepr[ "clientId" ], id, thDictRepr[ "address" ], thDictRepr[ "port" ], thDictRepr[ "ttl" ]  )
+                    self.headerIndex.add( self.taskHeaders[ id ] )
+                    self.__setDeadline( self.taskHeaders[ id ] )
+            else:
+                # header refreshed by sync or announcement
+                th = self.taskHeaders[ id ]
+                expires = time.time() + thDictRepr[ "ttl" ]
+                if expires > th.expires:
+                    th.expires = expires
+                    self.__setDeadline( th )
             return True
         except:
             print "Wrong task header received"
             return False
 
+    #############################
+    def taskHeadersWithdrawn( self, taskIds, clientId ):
+        """Peer clientId does not advertise taskIds any more, only its own tasks are removed"""
+        for taskId in taskIds:
+            th = self.taskHeaders.get( taskId )
+            if th and th.clientId == clientId:
+                print "Task {} withdrawn by its owner".format( taskId )
+                self.removeTaskHeader( taskId )
+
     #############################
     def removeTaskHeader( self, taskId ):
         if taskId in self.taskHeaders:
             del self.taskHeaders[ taskId ]
+            self.headerIndex.remove( taskId )
+            self.headerDeadlines.remove( taskId )
+
+    #############################
+    def taskAdded( self, taskHeader ):
+        """Own task added to task manager"""
+        self.__wakeExpiry( taskHeader.expires )
 
     #############################
     def removeTaskSession( self, taskSession ):
-        for tsk in self.taskSeesions.keys():
-            if self.taskSeesions[ tsk ] == taskSession:
-                del self.taskSeesions[ tsk ]
+        if taskSession in self.taskSessions:
+            self.taskSessions.remove( taskSession )
+
+        if taskSession.channelKey and self.channels.get( taskSession.channelKey ) is taskSession:
+            del self.channels[ taskSession.channelKey ]
 
     #############################
-    def setLastMessage( self, type, t, msg, address, port ):
-        if len( self.lastMessages ) >= 5:
-            self.lastMessages = self.lastMessages[ -4: ]
+    def legacyChannel( self, taskSession, requests ):
+        """Channel peer is an old node which handles only one request per connection"""
+        address, port = taskSession.channelKey
+        print "Task owner {}:{} does not support channels".format( address, port )
+
+        self.legacyPeers.add( taskSession.channelKey )
+        if self.channels.get( taskSession.channelKey ) is taskSession:
+            del self.channels[ taskSession.channelKey ]
+
+        for onReady, onFailure, args in requests:
+            self.__runOnChannel( address, port, onReady, onFailure, *args )
+
+    #############################
+    def ownerRttSample( self, ownerKey, rtt ):
+        est = self.ownersRtt.pop( ownerKey, None ) or RttEstimator()
+        est.addSample( rtt )
+        self.ownersRtt[ ownerKey ] = est
+
+        if len( self.ownersRtt ) > self.MaxOwnersRtt:
+            self.ownersRtt.popitem( last = False )
 
-        self.lastMessages.append( [ type, t, address, port, msg ] )
+    #############################
+    def getOwnersRtt( self ):
+        return dict( ( "{}:{}".format( address, port ), est.toDict() ) for ( address, port ), est in self.ownersRtt.items() )
+
+    #############################
+    def getBandwidthStats( self ):
+        """Bulk upload rates in bytes per second, limits of zero mean no limit"""
+        return {    "uploadRate"        : self.uploadLimit.currentRate(),
+                    "maxUploadRate"     : self.configDesc.maxUploadRate,
+                    "maxPeerUploadRate" : self.configDesc.maxPeerUploadRate,
+                    "peers"             : dict( ( "{}:{}".format( s.address, s.port ), s.conn.bulkRate() ) for s in self.taskSessions ) }
+
+    #############################
+    def setLastMessage( self, type, t, msg, address, port ):
+        self.stats.addLastMessage( type, t, msg, address, port )
 
     #############################
     def getLastMessages( self ):
-        return self.lastMessages
+        return self.stats.getLastMessages()
+
+    #############################
+    def getProtocolStats( self ):
+        return self.stats.toDict()
 
     #############################
     def getWaitingTaskResult( self, subTaskId ):
@@ -134,13 +272,44 @@ class TaskServer:
     #############################
     def taskResultSent( self, subTaskId ):
         if subTaskId in self.resultsToSend:
-            del self.resultsToSend[ subTaskId ]
+            res = self.resultsToSend.pop( subTaskId )
+            if res.spoolFile and os.path.exists( res.spoolFile ):
+                os.remove( res.spoolFile )
         else:
             assert False
 
+    #############################
+    def resultSendingInterrupted( self, waitingTaskResult ):
+        waitingTaskResult.lastSendingTrial  = time.time()
+        waitingTaskResult.alreadySending    = False
+
+        if waitingTaskResult.spoolFile:
+            # owner keeps received part, stream resumes from its offset
+            waitingTaskResult.failures  += 1
+            waitingTaskResult.delayTime = min( self.ResumeMaxRetryDelay, self.ResumeRetryDelay * 2 ** ( waitingTaskResult.failures - 1 ) )
+        else:
+            waitingTaskResult.delayTime = self.configDesc.maxResultsSendignDelay
+
+        if self.resultsTimer:
+            self.resultsTimer.wake( waitingTaskResult.delayTime )
+
     #############################
     # PRIVATE SECTION
 
+    #############################
+    def __syncOwnHeaders( self ):
+        current = {}
+        for th in self.taskManager.getTasksHeaders():
+            current[ th.taskId ] = th
+
+        for taskId in self.ownHeaderIds.difference( current ):
+            self.headerIndex.remove( taskId )
+
+        for th in current.itervalues():
+            self.headerIndex.add( th )
+
+        self.ownHeaderIds = set( current )
+
     #############################
     def __startAccepting(self):
         print "Enabling tasks accepting state"
@@ -165,26 +334,80 @@ class TaskServer:
             #FIXME: some graceful terminations should take place here
             sys.exit(0)
 
-    #############################   
-    def __connectAndSendTaskRequest( self, address, port, taskId, estimatedPerformance ):    
-        Network.connect( address, port, TaskSession, self.__connectionForTaskRequestEstablished, self.__connectionForTaskRequestFailure, taskId, estimatedPerformance )
+    #############################
+    def __initSession( self, session ):
+        session.taskServer = self
+        session.taskComputer = self.taskComputer
+        session.taskManager = self.taskManager
+        session.conn.setStats( self.stats )
+        session.conn.setBulkLimits( [ TokenBucket( self.configDesc.maxPeerUploadRate ), self.uploadLimit ] )
 
-    #############################   
-    def __connectAndSendResourceRequest( self, address ,port, subTaskId, resourceHeader ):
-        Network.connect( address, port, TaskSession, self.__connectionForResourceRequestEstablished, self.__connectionForResourceRequestFailure, subTaskId, resourceHeader )
+        if self.capture:
+            session.conn.setCapture( self.capture, "task" )
+        self.taskSessions.append( session )
 
+        if self.configDesc.taskMaxFrameSize > 0:
+            session.conn.setFrameLimits( self.configDesc.taskMaxFrameSize )
 
     #############################
-    def __connectionForTaskRequestEstablished( self, session, taskId, estimatedPerformance ):
+    def __runOnChannel( self, address, port, onReady, onFailure, *args ):
+        """Calls onReady( session, *args ) once channel to given node is ready or onFailure( *args ) if it cannot be opened"""
+        key = ( address, port )
+
+        if key in self.legacyPeers:
+            Network.connect( address, port, TaskSession, self.__legacyConnectionEstablished, self.__legacyConnectionFailure, onReady, onFailure, args )
+        elif key in self.channels:
+            self.channels[ key ].runWhenReady( onReady, onFailure, args )
+        elif key in self.connectingChannels:
+            self.connectingChannels[ key ].append( ( onReady, onFailure, args ) )
+        else:
+            self.connectingChannels[ key ] = [ ( onReady, onFailure, args ) ]
+            Network.connect( address, port, TaskSession, self.__channelEstablished, self.__channelFailure, key )
 
-        session.taskServer = self
-        session.taskComputer = self.taskComputer
-        session.taskManager = self.taskManager
-        self.taskSeesions[ taskId ] = session            
+    #############################
+    def __channelEstablished( self, session, key ):
+        self.__initSession( session )
+        session.channelKey = key
+        self.channels[ key ] = session
+
+        # requests are sent after hello of task owner tells which features it has,
+        # owner answers only hello of the connecting side
+        session.sendHello()
+        session.waitForHello()
+
+        for onReady, onFailure, args in self.connectingChannels.pop( key, [] ):
+            session.runWhenReady( onReady, onFailure, args )
+
+    #############################
+    def __channelFailure( self, key ):
+        print "Cannot connect to {}:{}".format( *key )
+
+        for onReady, onFailure, args in self.connectingChannels.pop( key, [] ):
+            onFailure( *args )
+
+    #############################
+    def __legacyConnectionEstablished( self, session, onReady, onFailure, args ):
+        self.__initSession( session )
+        session.setLegacy()
+        onReady( session, *args )
+
+    #############################
+    def __legacyConnectionFailure( self, onReady, onFailure, args ):
+        onFailure( *args )
+
+    #############################
+    def __closeIdleChannels( self ):
+        for session in list( self.taskSessions ):
+            timeout = self.ChannelIdleTimeout if session.channelKey else 2 * self.ChannelIdleTimeout
+            if session.isChannel() and session.isIdle( timeout ):
+                session.dropped()
+
+    #############################
+    def __sendTaskRequest( self, session, taskId, estimatedPerformance ):
         session.requestTask( taskId, estimatedPerformance )
 
     #############################
-    def __connectionForTaskRequestFailure( self, session, taskId, estimatedPerformance ):
+    def __taskRequestFailure( self, taskId, estimatedPerformance ):
         print "Cannot connect to task {} owner".format( taskId )
         print "Removing task {} from task list".format( taskId )
         
@@ -192,42 +415,22 @@ class TaskServer:
         
         self.removeTaskHeader( taskId )
 
-    #############################   
-    def __connectAndSendTaskResults( self, address, port, waitingTaskResult ):
-        Network.connect( address, port, TaskSession, self.__connectionForTaskResultEstablished, self.__connectionForTaskResultFailure, waitingTaskResult )
-
     #############################
-    def __connectionForTaskResultEstablished( self, session, waitingTaskResult ):
-
-        session.taskServer = self
-        session.taskComputer = self.taskComputer
-        session.taskManager = self.taskManager
-
-        self.taskSeesions[ waitingTaskResult.subTaskId ] = session
-        
-        session.sendReportComputedTask( waitingTaskResult.subTaskId )
+    def __sendTaskResults( self, session, waitingTaskResult ):
+        session.sendReportComputedTask( waitingTaskResult )
 
     #############################
-    def __connectionForTaskResultFailure( self, waitingTaskResult ):
+    def __taskResultFailure( self, waitingTaskResult ):
         print "Cannot connect to task {} owner".format( waitingTaskResult.subTaskId )
-        print "Removing task {} from task list".format( waitingTaskResult.subTaskId )
         
-        waitingTaskResult.lastSendingTrial  = time.time()
-        waitingTaskResult.delayTime         = self.configDesc.maxResultsSendignDelay
-        waitingTaskResult.alreadySending    = False
+        self.resultSendingInterrupted( waitingTaskResult )
 
     #############################
-    def __connectionForResourceRequestEstablished( self, session, subTaskId, resourceHeader ):
-
-        session.taskServer = self
-        session.taskComputer = self.taskComputer
-        session.taskManager = self.taskManager
-        self.taskSeesions[ subTaskId ] = session
-        session.taskId = subTaskId
+    def __sendResourceRequest( self, session, subTaskId, resourceHeader ):
         session.requestResource( subTaskId, resourceHeader )
 
     #############################
-    def __connectionForResourceRequestFailure( self, session, subTaskId, resourceHeader ):
+    def __resourceRequestFailure( self, subTaskId, resourceHeader ):
         print "Cannot connect to task {} owner".format( subTaskId )
         print "Removing task {} from task list".format( subTaskId )
         
@@ -237,30 +440,53 @@ class TaskServer:
          
     #############################
     def __removeOldTasks( self ):
-        for t in self.taskHeaders.values():
-            currTime = time.time()
-            t.ttl = t.ttl - ( currTime - t.lastChecking )
-            t.lastChecking = currTime
-            if t.ttl <= 0:
-                print "Task {} dies".format( t.id )
-                self.removeTaskHeader( t.id )
+        """Returns time to the nearest expiry or None if nothing expires"""
+        for taskId in self.headerDeadlines.popExpired( time.time() ):
+            print "Task {} dies".format( taskId )
+            self.removeTaskHeader( taskId )
 
         self.taskManager.removeOldTasks()
 
+        deadlines = [ d for d in [ self.headerDeadlines.nextDeadline(), self.taskManager.nextExpiry() ] if d is not None ]
+        if deadlines:
+            return min( deadlines ) - time.time()
+
+        return None
+
+    #############################
+    def __ownerRtt( self, th ):
+        # owners never asked are tried first
+        est = self.ownersRtt.get( ( th.taskOwnerAddress, th.taskOwnerPort ) )
+        return est.estimate() if est else 0.0
+
+    #############################
+    def __setDeadline( self, th ):
+        self.headerDeadlines.set( th.taskId, th.expires )
+        self.__wakeExpiry( th.expires )
+
+    #############################
+    def __wakeExpiry( self, expires ):
+        if self.expiryTimer:
+            self.expiryTimer.wake( expires - time.time() )
+
     def __sendWaitingResults( self ):
-        for wtr in self.resultsToSend:
-            waitingTaskResult = self.resultsToSend[ wtr ]
+        """Returns time to the nearest retry or None if there is none"""
+        nextTrial = None
 
+        for waitingTaskResult in self.resultsToSend.values():
             if not waitingTaskResult.alreadySending:
-                if time.time() - waitingTaskResult.lastSendingTrial > waitingTaskResult.delayTime:
-                    subTaskId = waitingTaskResult.subTaskId
-
+                wait = waitingTaskResult.lastSendingTrial + waitingTaskResult.delayTime - time.time()
+                if wait < 0.0:
                     waitingTaskResult.alreadySending = True
-                    self.__connectAndSendTaskResults( waitingTaskResult.ownerAddress, waitingTaskResult.ownerPort, waitingTaskResult )
+                    self.__runOnChannel( waitingTaskResult.ownerAddress, waitingTaskResult.ownerPort, self.__sendTaskResults, self.__taskResultFailure, waitingTaskResult )
+                elif nextTrial is None or wait < nextTrial:
+                    nextTrial = wait
+
+        return nextTrial
 
 class WaitingTaskResult:
     #############################
-    def __init__( self, subTaskId, result, lastSendingTrial, delayTime, ownerAddress, ownerPort  ):
+    def __init__( self, subTaskId, result, lastSendingTrial, delayTime, ownerAddress, ownerPort, spoolFile = None, resultSize = 0, resultHash = None ):
         self.subTaskId          = subTaskId
         self.result             = result
         self.lastSendingTrial   = lastSendingTrial
@@ -268,6 +494,16 @@ class WaitingTaskResult:
         self.ownerAddress       = ownerAddress
         self.ownerPort          = ownerPort
         self.alreadySending     = False
+        self.failures           = 0
+        self.spoolFile          = spoolFile
+        self.resultSize         = resultSize
+        self.resultHash         = resultHash
+
+    #############################
+    def getResult( self ):
+        if self.spoolFile:
+            return loadSpooledObject( self.spoolFile )
+        return self.result
 
 from twisted.internet.protocol import Factory
 from TaskConnState import TaskConnState
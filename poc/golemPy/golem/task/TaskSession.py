@@ -1,17 +1,24 @@
-
-from Message import MessageWantToComputeTask, MessageTaskToCompute, MessageCannotAssignTask, MessageGetResource, MessageResource, MessageReportComputedTask, MessageTaskResult, MessageGetTaskResult
+from Message import MessageHello, MessageWantToComputeTask, MessageTaskToCompute, MessageCannotAssignTask, MessageGetResource, MessageResource, MessageReportComputedTask, MessageTaskResult, MessageGetTaskResult, MessageGetContent, MessageContent, MessageStreamOpen, MessageStreamChunk, MessageStreamAck
 from TaskComputer import TaskComputer
-from TaskConnState import TaskConnState
+from TaskConnState import TaskConnState, FEATURE_CONTENT_CACHE, FEATURE_RESULT_STREAM, FEATURE_CHANNELS
+from StreamTransfer import StreamSender, StreamReceiver, STREAM_KIND_RESULT, STREAM_KIND_RESOURCE
+from simplehash import SimpleHash
+from ProtocolStats import RttEstimator
 import time
 import cPickle as pickle
 import Compress
 import os
 import struct
+from cStringIO import StringIO
 
 class TaskSession:
 
     ConnectionStateType = TaskConnState
 
+    # Task owner which does not send hello in this time is an old node - it
+    # handles one request per connection and sends resources as raw data
+    HelloTimeout = 3.0
+
     ##########################
     def __init__( self, conn ):
         self.conn           = conn
@@ -21,19 +28,84 @@ class TaskSession:
         self.address        = self.conn.transport.getPeer().host
         self.port           = self.conn.transport.getPeer().port
         self.taskId         = 0
+        self.clientUid      = None
+
+        self.channelKey     = None      # ( address, port ) of task owner if we opened this connection
+        self.ready          = False     # peer capabilities are known, requests may be sent
+        self.legacy         = False
+        self.closed         = False
+        self.helloSent      = False
+        self.readyQueue     = []        # ( onReady, onFailure, args ) of requests waiting for ready
+        self.lastActive     = time.time()
+
+        self.nextRequestId      = 1
+        self.taskRequests       = {}    # requestId -> taskId
+        self.resourceRequests   = set() # subTaskIds
+        self.resultReports      = {}    # subTaskId -> WaitingTaskResult
+        self.pendingTasks       = {}    # subTaskId -> MessageTaskToCompute waiting for content
+        self.pendingContent     = {}    # content hash -> data, None until received
+        self.streamSenders      = {}    # streamId -> StreamSender
+        self.streamReceivers    = {}    # streamId -> ( kind, StreamReceiver )
+
+        self.requestTimes       = {}    # ( kind, id ) -> time request was sent
+        self.rtt                = RttEstimator()
+
+    ##########################
+    def sendHello( self ):
+        self.helloSent = True
+        self.__send( MessageHello( self.taskServer.curPort, self.taskServer.configDesc.clientUid ) )
+
+    ##########################
+    def waitForHello( self ):
+        from twisted.internet import reactor
+        reactor.callLater( self.HelloTimeout, self.__helloTimeout )
+
+    ##########################
+    def setLegacy( self ):
+        self.__peerReady( True )
+
+    ##########################
+    def runWhenReady( self, onReady, onFailure, args = () ):
+        if self.closed:
+            onFailure( *args )
+        elif self.ready:
+            onReady( self, *args )
+        else:
+            self.readyQueue.append( ( onReady, onFailure, args ) )
+
+    ##########################
+    def isChannel( self ):
+        return not self.legacy and self.conn.peerSupports( FEATURE_CHANNELS )
+
+    ##########################
+    def isIdle( self, timeout ):
+        busy = self.readyQueue or self.taskRequests or self.resourceRequests or self.resultReports or self.pendingTasks or self.streamSenders or self.streamReceivers
+        return not busy and time.time() - self.lastActive > timeout
 
     ##########################
     def requestTask( self, taskId, performenceIndex ):
-        self.__send( MessageWantToComputeTask( taskId, performenceIndex ) )
+        requestId = self.nextRequestId
+        self.nextRequestId += 1
+
+        self.taskRequests[ requestId ] = taskId
+        self.requestTimes[ ( "task", requestId ) ] = time.time()
+        self.__send( MessageWantToComputeTask( taskId, performenceIndex, requestId ) )
 
     ##########################
     def requestResource( self, taskId, resourceHeader ):
         self.__send( MessageGetResource( taskId, pickle.dumps( resourceHeader ) ) )
-        self.conn.fileMode = True
+
+        if self.legacy:
+            self.taskId = taskId
+            self.conn.fileMode = True
+        else:
+            self.resourceRequests.add( taskId )
 
     ##########################
-    def sendReportComputedTask( self, subTaskId ):
-        self.__send( MessageReportComputedTask( subTaskId ) )
+    def sendReportComputedTask( self, waitingTaskResult ):
+        self.resultReports[ waitingTaskResult.subTaskId ] = waitingTaskResult
+        self.requestTimes[ ( "result", waitingTaskResult.subTaskId ) ] = time.time()
+        self.__send( MessageReportComputedTask( waitingTaskResult.subTaskId ) )
 
     ##########################
     def interpret( self, msg ):
@@ -43,6 +115,7 @@ class TaskSession:
         #print "Receiving from {}:{}: {}".format( self.address, self.port, msg )
 
         self.taskServer.setLastMessage( "<-", time.localtime(), msg, self.address, self.port )
+        self.lastActive = time.time()
 
         type = msg.getType()
 
@@ -50,53 +123,171 @@ class TaskSession:
         #timeString  = time.strftime("%H:%M:%S", localtime)
         #print "{} at {}".format( msg.serialize(), timeString )
 
-        if type == MessageWantToComputeTask.Type:
+        if type == MessageHello.Type:
+            # capabilities are handled by the connection. Accepting side answers hello only -
+            # old requesters switch to raw file data after MessageGetResource and would read it as file size
+            self.clientUid = msg.clientUID
+            if not self.helloSent:
+                self.sendHello()
+            self.__peerReady( not self.conn.peerSupports( FEATURE_CHANNELS ) )
+
+        elif type == MessageWantToComputeTask.Type:
 
             subTaskId, srcCode, extraData, shortDescr, returnAddress, returnPort = self.taskManager.getNextSubTask( msg.taskId, msg.perfIndex )
 
-            if subTaskId != 0:
-                self.conn.sendMessage( MessageTaskToCompute( subTaskId, extraData, shortDescr, srcCode, returnAddress, returnPort ) )
+            if subTaskId == 0:
+                self.conn.sendMessage( MessageCannotAssignTask( msg.taskId, "No more subtasks in {}".format( msg.taskId ), msg.requestId ) )
+            elif self.conn.peerSupports( FEATURE_CONTENT_CACHE ):
+                srcCodeHash, extraData, extraDataHashes = self.taskManager.getContentRefs( msg.taskId, srcCode, extraData )
+                self.conn.sendMessage( MessageTaskToCompute( subTaskId, extraData, shortDescr, "", returnAddress, returnPort, srcCodeHash, extraDataHashes, msg.requestId ) )
             else:
-                self.conn.sendMessage( MessageCannotAssignTask( msg.taskId, "No more subtasks in {}".format( msg.taskId ) ) )
+                self.conn.sendMessage( MessageTaskToCompute( subTaskId, extraData, shortDescr, srcCode, returnAddress, returnPort, requestId = msg.requestId ) )
 
         elif type == MessageTaskToCompute.Type:
-            self.taskComputer.taskGiven(  msg.subTaskId, msg.sourceCode, msg.extraData, msg.shortDescr, msg.returnAddress, msg.returnPort )
-            self.dropped()
+            self.__taskRequestAnswered( msg.requestId )
+
+            missing = self.taskComputer.contentCache.missing( self.__contentHashes( msg ) )
+
+            if missing:
+                self.pendingTasks[ msg.subTaskId ] = msg
+
+                toRequest = [ h for h in missing if h not in self.pendingContent ]
+                self.pendingContent.update( dict.fromkeys( toRequest ) )
+
+                if toRequest:
+                    self.__send( MessageGetContent( toRequest ) )
+            else:
+                self.__taskGiven( msg )
+
+        elif type == MessageGetContent.Type:
+            for h in msg.hashes:
+                self.conn.sendMessage( MessageContent( h, self.taskManager.getContent( h ) ) )
+
+        elif type == MessageContent.Type:
+            if msg.hash not in self.pendingContent:
+                return
+
+            if msg.data is None or not self.taskComputer.contentCache.putWithHash( msg.hash, msg.data ):
+                for subTaskId, task in self.pendingTasks.items():
+                    if msg.hash in self.__contentHashes( task ):
+                        del self.pendingTasks[ subTaskId ]
+                        self.taskComputer.taskRequestRejected( subTaskId, "Cannot get content {}".format( msg.hash ) )
+                self.__releaseContent()
+                self.__exchangeFinished()
+                return
+
+            # cache may be too small to hold it, so keep the body until the task is given
+            self.pendingContent[ msg.hash ] = msg.data
+
+            for task in self.pendingTasks.values():
+                if all( self.pendingContent.get( h ) is not None or self.taskComputer.contentCache.has( h ) for h in self.__contentHashes( task ) ):
+                    self.__taskGiven( task )
 
         elif type == MessageCannotAssignTask.Type:
+            self.__taskRequestAnswered( msg.requestId )
             self.taskComputer.taskRequestRejected( msg.taskId, msg.reason )
             self.taskServer.removeTaskHeader( msg.taskId )
-            self.dropped()
+            self.__exchangeFinished()
 
         elif type == MessageReportComputedTask.Type:
+            delay = -1.0
             if msg.subTaskId in self.taskManager.subTask2TaskMapping:
                 delay = self.taskManager.acceptResultsDelay( self.taskManager.subTask2TaskMapping[ msg.subTaskId ] )
 
-                if delay == -1.0:
-                    self.dropped()
-                elif delay == 0.0:
-                    self.conn.sendMessage( MessageGetTaskResult( msg.subTaskId, delay ) )
-                else:
+            if delay == -1.0:
+                # result is not wanted, old nodes learn it from closed connection
+                if self.isChannel():
                     self.conn.sendMessage( MessageGetTaskResult( msg.subTaskId, delay ) )
-                    self.dropped()
+                self.__exchangeFinished()
+            elif delay == 0.0:
+                self.conn.sendMessage( MessageGetTaskResult( msg.subTaskId, delay ) )
             else:
-                self.dropped()
+                self.conn.sendMessage( MessageGetTaskResult( msg.subTaskId, delay ) )
+                self.__exchangeFinished()
 
         elif type == MessageGetTaskResult.Type:
-            res = self.taskServer.getWaitingTaskResult( msg.subTaskId )
+            self.__rttSample( ( "result", msg.subTaskId ) )
+            res = self.resultReports.get( msg.subTaskId ) or self.taskServer.getWaitingTaskResult( msg.subTaskId )
             if res:
                 if msg.delay == 0.0:
-                    self.__send( MessageTaskResult( res.subTaskId, res.result ) )
+                    if res.spoolFile and self.conn.peerSupports( FEATURE_RESULT_STREAM ):
+                        self.resultReports[ res.subTaskId ] = res
+                        self.__openStream( StreamSender( self.conn, res.subTaskId, STREAM_KIND_RESULT, res.spoolFile, res.resultSize, res.resultHash ) )
+                    else:
+                        self.resultReports.pop( res.subTaskId, None )
+                        self.__send( MessageTaskResult( res.subTaskId, res.getResult() ) )
+                        # task owner closes connection once it has the result
+                        self.taskServer.taskResultSent( res.subTaskId )
+                elif msg.delay < 0.0:
+                    print "Task owner does not accept result of {}".format( res.subTaskId )
+                    self.resultReports.pop( res.subTaskId, None )
                     self.taskServer.taskResultSent( res.subTaskId )
+                    self.__exchangeFinished()
                 else:
-                    res.lastSendingTrial    = time()
+                    self.resultReports.pop( res.subTaskId, None )
+                    res.lastSendingTrial    = time.time()
                     res.delayTime           = msg.delay
                     res.alreadySending      = False
-                    self.dropped()
+                    self.__exchangeFinished()
 
         elif type == MessageTaskResult.Type:
             self.taskManager.computedTaskReceived( msg.subTaskId, msg.result )
-            self.dropped()
+            self.__exchangeFinished()
+
+        elif type == MessageStreamOpen.Type:
+            if msg.kind == STREAM_KIND_RESULT and msg.streamId in self.taskManager.subTask2TaskMapping:
+                fileName = self.taskManager.getResultFileName( msg.streamId )
+            elif msg.kind == STREAM_KIND_RESOURCE and msg.streamId in self.resourceRequests:
+                fileName = self.taskComputer.resourceManager.getResourceStreamFile( msg.streamId )
+            else:
+                print "Unexpected {} stream {}".format( msg.kind, msg.streamId )
+                self.dropped()
+                return
+
+            try:
+                receiver = StreamReceiver( msg.streamId, fileName, msg.size, msg.hash )
+            except ( ValueError, IOError ) as ex:
+                print "Rejecting {} stream {}: {}".format( msg.kind, msg.streamId, ex )
+                self.dropped()
+                return
+
+            self.streamReceivers[ msg.streamId ] = ( msg.kind, receiver )
+            self.__send( receiver.ack() )
+
+            if receiver.complete():
+                self.__streamReceived( msg.streamId )
+
+        elif type == MessageStreamChunk.Type:
+            kind, receiver = self.streamReceivers.get( msg.streamId, ( None, None ) )
+
+            if not receiver or not receiver.chunkReceived( msg.offset, msg.data ):
+                print "Unexpected chunk of stream {} at {}".format( msg.streamId, msg.offset )
+                self.dropped()
+                return
+
+            self.conn.sendMessage( receiver.ack() )
+
+            if receiver.complete():
+                self.__streamReceived( msg.streamId )
+
+        elif type == MessageStreamAck.Type:
+            sender = self.streamSenders.get( msg.streamId )
+            if not sender:
+                return
+
+            try:
+                finished = sender.acked( msg.offset )
+            except ( ValueError, IOError ) as ex:
+                print "Sending stream {} failed: {}".format( msg.streamId, ex )
+                self.dropped()
+                return
+
+            if finished:
+                del self.streamSenders[ msg.streamId ]
+                if sender.kind == STREAM_KIND_RESULT:
+                    self.resultReports.pop( msg.streamId, None )
+                    self.taskServer.taskResultSent( msg.streamId )
+                self.__exchangeFinished()
 
         elif type == MessageGetResource.Type:
             resFilePath = self.taskManager.prepareResource( msg.subTaskId, pickle.loads( msg.resourceHeader ) )
@@ -104,33 +295,179 @@ class TaskSession:
 
             if not resFilePath:
                 print "Task {} has no resource".format( msg.subTaskId )
-                self.conn.transport.write( struct.pack( "!L", 0 ) )
-                self.dropped()
+                if self.isChannel():
+                    self.__openStream( StreamSender( self.conn, msg.subTaskId, STREAM_KIND_RESOURCE, None, 0, SimpleHash.hash_hex( "" ) ) )
+                else:
+                    self.conn.sendStream( StringIO( struct.pack( "!L", 0 ) ) )
+                    self.dropped()
                 return
 
             size = os.path.getsize( resFilePath )
 
             print "Sendig file size:{}".format( size )
 
-            fh = open( resFilePath, 'rb' )
-            data = struct.pack( "!L", size ) + fh.read( 4096 * 1024 )
-            while data:
-                self.conn.transport.write( data )
-                #self.conn.transport.doWrite()
-                print "\rSending progress {}                        ".format( float( fh.tell() ) / size ),
-                data = fh.read( 4096 * 1024 )
-                
-            self.dropped()
+            if self.isChannel():
+                self.__openStream( StreamSender( self.conn, msg.subTaskId, STREAM_KIND_RESOURCE, resFilePath, size, SimpleHash.hash_file_hex( resFilePath ) ) )
+            else:
+                # connection is closed once the whole file is written
+                self.conn.sendStream( StringIO( struct.pack( "!L", size ) ) )
+                self.conn.sendFile( resFilePath )
+                self.dropped()
+
         elif type == MessageResource.Type:
             self.taskComputer.resourceGiven( msg.subTaskId )
-            self.dropped()
+            self.__exchangeFinished()
 
     ##########################
     def dropped( self ):
+        if self.closed:
+            return
+
+        self.closed = True
+
+        for sender in self.streamSenders.values():
+            sender.close()
+        self.streamSenders = {}
+
+        for kind, receiver in self.streamReceivers.values():
+            # received part is kept so next attempt resumes from it
+            receiver.close()
+        self.streamReceivers = {}
+
+        for res in self.resultReports.values():
+            self.taskServer.resultSendingInterrupted( res )
+        self.resultReports = {}
+
+        for taskId in self.taskRequests.values():
+            self.taskComputer.taskRequestRejected( taskId, "Connection closed" )
+        self.taskRequests = {}
+
+        for subTaskId in self.pendingTasks.keys():
+            self.taskComputer.taskRequestRejected( subTaskId, "Connection closed" )
+        self.pendingTasks = {}
+        self.pendingContent = {}
+
+        for subTaskId in self.resourceRequests:
+            self.taskComputer.resourceRequestRejected( subTaskId, "Connection closed" )
+        self.resourceRequests = set()
+
+        for onReady, onFailure, args in self.readyQueue:
+            onFailure( *args )
+        self.readyQueue = []
+
         self.conn.close()
         self.taskServer.removeTaskSession( self )
 
+    ##########################
+    def __peerReady( self, legacy ):
+        if self.ready:
+            return
+
+        self.ready = True
+        self.legacy = legacy
+
+        requests = self.readyQueue
+        self.readyQueue = []
+
+        if legacy and self.channelKey:
+            # old node answers one request and closes connection
+            self.taskServer.legacyChannel( self, requests[ 1: ] )
+            requests = requests[ :1 ]
+
+        for onReady, onFailure, args in requests:
+            onReady( self, *args )
+
+    ##########################
+    def __helloTimeout( self ):
+        if not self.ready and not self.closed:
+            print "Task owner {}:{} did not send hello, using one connection per request".format( self.address, self.port )
+            self.__peerReady( True )
+
+    ##########################
+    def __exchangeFinished( self ):
+        """Closes connection after finished exchange unless it is shared channel"""
+        self.lastActive = time.time()
+
+        if not self.isChannel():
+            self.dropped()
+
+    ##########################
+    def __taskRequestAnswered( self, requestId ):
+        if requestId is None and len( self.taskRequests ) == 1:
+            self.__rttSample( ( "task", self.taskRequests.keys()[ 0 ] ) )
+        else:
+            self.__rttSample( ( "task", requestId ) )
+
+        if requestId is None:
+            self.taskRequests = {} # answer from old node - only one request per connection
+        else:
+            self.taskRequests.pop( requestId, None )
+
+    ##########################
+    def __rttSample( self, key ):
+        sentAt = self.requestTimes.pop( key, None )
+        if sentAt is not None:
+            rtt = time.time() - sentAt
+            self.rtt.addSample( rtt )
+            if self.channelKey:
+                self.taskServer.ownerRttSample( self.channelKey, rtt )
+
+    ##########################
+    def __openStream( self, sender ):
+        self.streamSenders[ sender.streamId ] = sender
+        sender.open()
+
+    ##########################
+    def __streamReceived( self, streamId ):
+        kind, receiver = self.streamReceivers.pop( streamId )
+        ok = receiver.finish()
+
+        if kind == STREAM_KIND_RESULT:
+            if ok:
+                self.taskManager.computedTaskFileReceived( streamId, receiver.fileName )
+            else:
+                print "Result of {} does not match its hash".format( streamId )
+        else:
+            self.resourceRequests.discard( streamId )
+            if ok:
+                self.taskComputer.resourceManager.resourceFileReceived( streamId, receiver.fileName )
+            else:
+                self.taskComputer.resourceRequestRejected( streamId, "Resource does not match its hash" )
+
+        self.__exchangeFinished()
+
+    ##########################
+    def __contentHashes( self, msg ):
+        return set( ( [ msg.sourceCodeHash ] if msg.sourceCodeHash else [] ) + msg.extraDataHashes.values() )
+
+    ##########################
+    def __releaseContent( self ):
+        """Forgets received bodies which no pending task needs"""
+        needed = set()
+        for task in self.pendingTasks.values():
+            needed.update( self.__contentHashes( task ) )
+
+        for h in self.pendingContent.keys():
+            if h not in needed:
+                del self.pendingContent[ h ]
+
+    ##########################
+    def __taskGiven( self, msg ):
+        content = self.taskComputer.resolveContent( msg.sourceCode, msg.sourceCodeHash, msg.extraData, msg.extraDataHashes, self.pendingContent )
+        self.pendingTasks.pop( msg.subTaskId, None )
+        self.__releaseContent()
+
+        if content:
+            srcCode, extraData = content
+            self.taskComputer.taskGiven( msg.subTaskId, srcCode, extraData, msg.shortDescr, msg.returnAddress, msg.returnPort )
+        else:
+            self.taskComputer.taskRequestRejected( msg.subTaskId, "Task content missing" )
+
+        self.__exchangeFinished()
+
+    ##########################
     def __send( self, msg ):
         #print "Sending to {}:{}: {}".format( self.address, self.port, msg )
         self.conn.sendMessage( msg )
-        self.taskServer.setLastMessage( "->", time.localtime(), msg, self.address, self.port )
\ No newline at end of file
+        self.lastActive = time.time()
+        self.taskServer.setLastMessage( "->", time.localtime(), msg, self.address, self.port )
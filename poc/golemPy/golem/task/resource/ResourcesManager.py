@@ -74,6 +74,16 @@ class ResourcesManager:
     def getOutputDir( self, taskId ):
         return self.taskEnvironment.getTaskOutputDir( taskId )
 
+    ###################
+    def getResourceStreamFile( self, taskId ):
+        return os.path.join( self.getTemporaryDir( taskId ), "res" + taskId )
+
+    ###################
+    def resourceFileReceived( self, taskId, fileName ):
+        if os.path.getsize( fileName ) > 0:
+            decompressDir( self.getResourceDir( taskId ), fileName )
+        self.owner.resourceGiven( taskId )
+
 
     def fileDataReceived( self, taskId, data, conn ):
 
@@ -0,0 +1,161 @@
+import sys
+import os
+testDir = os.path.dirname( os.path.abspath( __file__ ) )
+for d in [ ".", "..", "../core" ]:
+    sys.path.append( os.path.join( testDir, d ) )
+
+import unittest
+import tempfile
+import shutil
+import hashlib
+
+from Message import MessageStreamOpen, MessageStreamChunk
+from StreamTransfer import StreamSender, StreamReceiver, spoolObject, loadSpooledObject, STREAM_KIND_RESULT
+
+class FakeConn:
+
+    ############################
+    def __init__( self ):
+        self.sent = []
+
+    ############################
+    def sendMessage( self, msg ):
+        self.sent.append( msg )
+        return True
+
+class StreamTransferTest( unittest.TestCase ):
+
+    ############################
+    def setUp( self ):
+        self.dir = tempfile.mkdtemp()
+        self.source = os.path.join( self.dir, "source" )
+        self.target = os.path.join( self.dir, "target" )
+
+        self.data = "".join( chr( i % 251 ) for i in range( 5 * StreamSender.ChunkSize + 123 ) )
+        with open( self.source, "wb" ) as f:
+            f.write( self.data )
+        self.hash = hashlib.sha1( self.data ).hexdigest()
+
+    ############################
+    def tearDown( self ):
+        shutil.rmtree( self.dir, True )
+
+    ############################
+    def transfer( self, sender, receiver, maxChunks = None ):
+        """Passes chunks from sender to receiver and acks back, returns number of chunks passed"""
+        chunks = 0
+        done = sender.acked( receiver.ack().offset )
+
+        while not done:
+            msgs = [ m for m in sender.conn.sent if isinstance( m, MessageStreamChunk ) ]
+            sender.conn.sent = []
+            if not msgs:
+                break
+
+            for m in msgs:
+                if maxChunks is not None and chunks == maxChunks:
+                    return chunks
+                self.assertTrue( receiver.chunkReceived( m.offset, m.data ) )
+                chunks += 1
+
+            done = sender.acked( receiver.ack().offset )
+
+        return chunks
+
+    ############################
+    def newSender( self ):
+        sender = StreamSender( FakeConn(), u"s1", STREAM_KIND_RESULT, self.source, len( self.data ), self.hash )
+        sender.open()
+        self.assertTrue( isinstance( sender.conn.sent[ 0 ], MessageStreamOpen ) )
+        return sender
+
+    ############################
+    def testTransfer( self ):
+        sender = self.newSender()
+        receiver = StreamReceiver( u"s1", self.target, len( self.data ), self.hash )
+
+        self.assertEqual( receiver.ack().offset, 0 )
+        self.transfer( sender, receiver )
+
+        self.assertTrue( sender.finished() )
+        self.assertTrue( receiver.complete() )
+        self.assertTrue( receiver.finish() )
+
+        with open( self.target, "rb" ) as f:
+            self.assertEqual( f.read(), self.data )
+
+    ############################
+    def testWindow( self ):
+        sender = self.newSender()
+        sender.acked( 0 )
+
+        sent = sum( len( m.data ) for m in sender.conn.sent if isinstance( m, MessageStreamChunk ) )
+        self.assertEqual( sent, min( StreamSender.Window, len( self.data ) ) )
+
+    ############################
+    def testResume( self ):
+        sender = self.newSender()
+        receiver = StreamReceiver( u"s1", self.target, len( self.data ), self.hash )
+        self.assertEqual( self.transfer( sender, receiver, 2 ), 2 )
+
+        # connection lost, both sides close
+        receiver.close()
+        sender.close()
+
+        sender = self.newSender()
+        receiver = StreamReceiver( u"s2", self.target, len( self.data ), self.hash )
+        self.assertEqual( receiver.ack().offset, 2 * StreamSender.ChunkSize )
+
+        self.assertEqual( self.transfer( sender, receiver ), 4 )
+        self.assertTrue( receiver.finish() )
+
+        with open( self.target, "rb" ) as f:
+            self.assertEqual( f.read(), self.data )
+        self.assertFalse( os.path.exists( receiver.partName ) )
+
+    ############################
+    def testChunkOutOfOrder( self ):
+        receiver = StreamReceiver( u"s1", self.target, 10, self.hash )
+
+        self.assertFalse( receiver.chunkReceived( 5, "abcde" ) )
+        self.assertTrue( receiver.chunkReceived( 0, "abcde" ) )
+        self.assertFalse( receiver.chunkReceived( 5, "abcdef" ) )
+        self.assertEqual( receiver.ack().offset, 5 )
+        receiver.close()
+
+    ############################
+    def testHashMismatch( self ):
+        sender = self.newSender()
+        receiver = StreamReceiver( u"s1", self.target, len( self.data ), hashlib.sha1( "other" ).hexdigest() )
+        self.transfer( sender, receiver )
+
+        self.assertTrue( receiver.complete() )
+        self.assertFalse( receiver.finish() )
+        self.assertFalse( os.path.exists( receiver.partName ) )
+        self.assertFalse( os.path.exists( self.target ) )
+
+    ############################
+    def testMalformedStream( self ):
+        for size, hash in [ ( 10, "../../etc/passwd" ), ( 10, self.hash.upper() ), ( 10, None ), ( -1, self.hash ), ( "10", self.hash ) ]:
+            self.assertRaises( ValueError, StreamReceiver, u"s1", self.target, size, hash )
+
+        self.assertEqual( os.listdir( self.dir ), [ "source" ] )
+
+    ############################
+    def testAckBeyondSize( self ):
+        sender = self.newSender()
+        self.assertRaises( ValueError, sender.acked, len( self.data ) + 1 )
+        sender.close()
+
+    ############################
+    def testSpool( self ):
+        obj = { "result" : [ 1, 2, u"three" ] }
+        size, hash = spoolObject( obj, self.target )
+
+        self.assertEqual( size, os.path.getsize( self.target ) )
+        with open( self.target, "rb" ) as f:
+            self.assertEqual( hash, hashlib.sha1( f.read() ).hexdigest() )
+        self.assertEqual( loadSpooledObject( self.target ), obj )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+import sys
+import os
+testDir = os.path.dirname( os.path.abspath( __file__ ) )
+for d in [ ".", "resource", "..", "../..", "../core", "../network", "../manager", "../vm" ]:
+    sys.path.append( os.path.join( testDir, d ) )
+
+import unittest
+import tempfile
+import shutil
+
+from twisted.internet import reactor
+from twisted.internet.task import Clock
+
+import timerqueue
+import TaskComputer as taskcomputer
+from timerqueue import TimerQueue
+from TaskComputer import TaskComputer, AssignedSubTask
+
+class ClockTime:
+    """time module replacement reading the test clock"""
+
+    ############################
+    def __init__( self, clock ):
+        self.clock = clock
+
+    ############################
+    def time( self ):
+        return self.clock.seconds()
+
+class FakeTaskServer:
+
+    ############################
+    def __init__( self, clock ):
+        self.clock      = clock
+        self.requests   = []
+        self.results    = []
+
+    ############################
+    def requestTask( self, estimatedPerformance ):
+        self.requests.append( self.clock.seconds() )
+        return "task"
+
+    ############################
+    def sendResults( self, subTaskId, result, ownerAddress, ownerPort ):
+        self.results.append( subTaskId )
+
+class FakeTaskThread:
+
+    ############################
+    def __init__( self, taskComputer, subTaskId, srcCode, extraData, shortDescr, resPath, tmpPath ):
+        self.subTaskId  = subTaskId
+        self.result     = { "data" : subTaskId }
+
+    ############################
+    def start( self ):
+        pass
+
+class TaskComputerTest( unittest.TestCase ):
+
+    RequestInterval = 5.0
+
+    ############################
+    def setUp( self ):
+        self.clock = Clock()
+        self.clock.advance( 1000.0 )
+        self.saved = ( timerqueue.reactor, timerqueue.time, taskcomputer.time )
+        timerqueue.reactor = self.clock
+        timerqueue.time = taskcomputer.time = ClockTime( self.clock )
+
+        # computing environment keeps files in working directory
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir( self.dir )
+
+        self.server = FakeTaskServer( self.clock )
+        self.computer = TaskComputer( u"node", self.server, 1000.0, self.RequestInterval )
+        self.computer.taskThreadType = FakeTaskThread
+
+        self.queue = TimerQueue()
+        self.computer.setRequestTimer( self.queue.callEvery( self.RequestInterval, self.computer.run ) )
+
+    ############################
+    def tearDown( self ):
+        self.queue.cancelAll()
+        timerqueue.reactor, timerqueue.time, taskcomputer.time = self.saved
+        os.chdir( self.cwd )
+        shutil.rmtree( self.dir, True )
+
+    ############################
+    def testRunReturnsTimeToNextRequest( self ):
+        self.queue.cancelAll()
+        self.computer.lastTaskRequest = self.clock.seconds() - 2.0
+
+        self.assertAlmostEqual( self.computer.run(), 3.0 )
+        self.assertEqual( self.server.requests, [] )
+
+        self.clock.advance( 3.0 )
+        self.assertEqual( self.computer.run(), None )
+        self.assertEqual( self.server.requests, [ self.clock.seconds() ] )
+
+        # waiting for answer
+        self.assertEqual( self.computer.run(), None )
+        self.assertEqual( len( self.server.requests ), 1 )
+
+    ############################
+    def testRejectedRequestIsRepeatedWhenAllowed( self ):
+        self.clock.advance( self.RequestInterval )
+        first = self.server.requests[ 0 ]
+
+        self.clock.advance( 1.0 )
+        self.computer.taskRequestRejected( "task", "No more subtasks" )
+
+        self.clock.advance( first + self.RequestInterval - self.clock.seconds() )
+        self.assertEqual( self.server.requests, [ first, first + self.RequestInterval ] )
+
+    ############################
+    def testFinishedComputationWakesRequest( self ):
+        self.clock.advance( self.RequestInterval )
+        self.assertEqual( len( self.server.requests ), 1 )
+
+        self.computer.assignedSubTasks[ "subtask" ] = AssignedSubTask( "", {}, "", "10.0.0.2", 40103 )
+        self.assertTrue( self.computer.resourceGiven( "subtask" ) )
+
+        # long computation, nothing is requested meanwhile
+        for i in range( 10 ):
+            self.clock.advance( 3.3 )
+        self.assertEqual( len( self.server.requests ), 1 )
+
+        self.computer.taskComputed( self.computer.currentComputations[ 0 ] )
+        reactor.runUntilCurrent()   # wake is passed from computing thread
+        self.clock.advance( 0.0 )
+
+        self.assertEqual( self.server.results, [ "subtask" ] )
+        self.assertEqual( self.server.requests[ 1: ], [ self.clock.seconds() ] )
+
+if __name__ == "__main__":
+    unittest.main()
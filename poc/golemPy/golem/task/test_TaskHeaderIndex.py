@@ -0,0 +1,102 @@
+import sys
+import os
+testDir = os.path.dirname( os.path.abspath( __file__ ) )
+sys.path.append( testDir )
+
+import unittest
+
+from TaskBase import TaskHeader
+from TaskHeaderIndex import TaskHeaderIndex
+
+class TaskHeaderIndexTest( unittest.TestCase ):
+
+    ############################
+    def setUp( self ):
+        self.idx = TaskHeaderIndex()
+        for i in range( 5 ):
+            self.add( i )
+
+    ############################
+    def add( self, i ):
+        return self.idx.add( TaskHeader( "node", "task{}".format( i ), "127.0.0.1", 40102, 600.0 ) )
+
+    ############################
+    def ids( self, headers ):
+        return sorted( h.taskId for h in headers )
+
+    ############################
+    def testUpToDate( self ):
+        self.assertEqual( self.idx.changesSince( self.idx.epoch, self.idx.version ), ( False, [], [] ) )
+
+    ############################
+    def testDelta( self ):
+        v = self.idx.version
+        self.assertTrue( self.idx.remove( "task1" ) )
+        self.assertTrue( self.add( 9 ) )
+        self.assertFalse( self.add( 9 ) )
+        self.assertFalse( self.idx.remove( "missing" ) )
+
+        full, headers, removed = self.idx.changesSince( self.idx.epoch, v )
+        self.assertFalse( full )
+        self.assertEqual( self.ids( headers ), [ "task9" ] )
+        self.assertEqual( removed, [ "task1" ] )
+
+        self.assertEqual( self.idx.changesSince( self.idx.epoch, v + 1 )[ 2 ], [] )
+
+    ############################
+    def testReaddedTaskIsNotRemoved( self ):
+        v = self.idx.version
+        self.idx.remove( "task2" )
+        self.add( 2 )
+
+        full, headers, removed = self.idx.changesSince( self.idx.epoch, v )
+        self.assertEqual( self.ids( headers ), [ "task2" ] )
+        self.assertEqual( removed, [] )
+        self.assertTrue( "task2" in self.idx )
+
+    ############################
+    def testOtherEpoch( self ):
+        full, headers, removed = self.idx.changesSince( "old epoch", self.idx.version )
+        self.assertTrue( full )
+        self.assertEqual( self.ids( headers ), [ "task{}".format( i ) for i in range( 5 ) ] )
+        self.assertEqual( removed, [] )
+
+        self.assertNotEqual( TaskHeaderIndex().epoch, self.idx.epoch )
+
+    ############################
+    def testVersionFromFuture( self ):
+        self.assertTrue( self.idx.changesSince( self.idx.epoch, self.idx.version + 1 )[ 0 ] )
+
+    ############################
+    def testForgottenTombstones( self ):
+        self.idx.MaxTombstones = 2
+        v = self.idx.version
+
+        for i in range( 3 ):
+            self.idx.remove( "task{}".format( i ) )
+
+        self.assertEqual( len( self.idx.tombstones ), 2 )
+
+        # the oldest removal is forgotten, peer which may not have seen it gets the full list
+        full, headers, removed = self.idx.changesSince( self.idx.epoch, v )
+        self.assertTrue( full )
+        self.assertEqual( self.ids( headers ), [ "task3", "task4" ] )
+
+        full, headers, removed = self.idx.changesSince( self.idx.epoch, v + 1 )
+        self.assertFalse( full )
+        self.assertEqual( sorted( removed ), [ "task1", "task2" ] )
+
+    ############################
+    def testKnownFilter( self ):
+        full, headers, removed = self.idx.changesSince( "", 0, set( [ "task0", "task3" ] ) )
+        self.assertTrue( full )
+        self.assertEqual( self.ids( headers ), [ "task1", "task2", "task4" ] )
+
+        v = self.idx.version
+        self.add( 7 )
+        self.add( 8 )
+        full, headers, removed = self.idx.changesSince( self.idx.epoch, v, set( [ "task7" ] ) )
+        self.assertEqual( self.ids( headers ), [ "task8" ] )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+import sys
+import os
+testDir = os.path.dirname( os.path.abspath( __file__ ) )
+for d in [ ".", "resource", "..", "../..", "../core", "../network", "../manager", "../vm" ]:
+    sys.path.append( os.path.join( testDir, d ) )
+
+import unittest
+import tempfile
+import shutil
+import struct
+import cPickle as pickle
+
+from twisted.internet.address import IPv4Address
+
+from Message import Message, MessageHello, MessageGetResource, CODEC_PICKLE, initMessages
+from ClientConfigDescriptor import ClientConfigDescriptor
+from TaskConnState import TaskConnState
+from TaskSession import TaskSession
+from TaskServer import TaskServer
+
+class FakeTransport:
+
+    ############################
+    def __init__( self ):
+        self.producer   = None
+        self.lost       = False
+        self.written    = []
+
+    ############################
+    def write( self, data ):
+        self.written.append( data )
+
+    ############################
+    def writeSequence( self, seq ):
+        self.written.extend( seq )
+
+    ############################
+    def loseConnection( self ):
+        self.lost = True
+
+    ############################
+    def getPeer( self ):
+        return IPv4Address( "TCP", "10.0.0.2", 40103 )
+
+    ############################
+    def registerProducer( self, producer, streaming ):
+        self.producer = producer
+
+    ############################
+    def unregisterProducer( self ):
+        self.producer = None
+
+class FakeTask:
+
+    ############################
+    def __init__( self, resFilePath ):
+        self.resFilePath = resFilePath
+
+    ############################
+    def prepareResourceDelta( self, subTaskId, resourceHeader ):
+        return self.resFilePath
+
+class TaskSessionHelloTest( unittest.TestCase ):
+
+    ############################
+    def setUp( self ):
+        initMessages()
+
+        # computing environment of task server keeps files in working directory
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir( self.dir )
+
+        cfg = ClientConfigDescriptor()
+        cfg.clientUid               = u"owner"
+        cfg.estimatedPerformance    = 1000.0
+        cfg.taskRequestInterval     = 5.0
+        self.server = TaskServer( "127.0.0.1", cfg )
+
+        self.resource = os.path.join( self.dir, "resource.zip" )
+        with open( self.resource, "wb" ) as f:
+            f.write( "resource data " * 1000 )
+
+        self.server.taskManager.tasks[ "task" ] = FakeTask( self.resource )
+        self.server.taskManager.subTask2TaskMapping[ "subtask" ] = "task"
+
+    ############################
+    def tearDown( self ):
+        os.chdir( self.cwd )
+        shutil.rmtree( self.dir, True )
+
+    ############################
+    def accept( self ):
+        conn = TaskConnState( self.server )
+        conn.makeConnection( FakeTransport() )
+        return conn
+
+    ############################
+    def frame( self, msg ):
+        data = msg.serialize( CODEC_PICKLE )
+        return struct.pack( "!L", len( data ) ) + data
+
+    ############################
+    def written( self, conn ):
+        while conn.sendQueue or conn.bulkQueue or conn.bulkStreams:
+            conn.flush()
+        return "".join( conn.transport.written )
+
+    ############################
+    def testOldRequesterGetsRawFile( self ):
+        conn = self.accept()
+        self.assertEqual( self.written( conn ), "" )
+
+        # old requester reads raw file right after MessageGetResource
+        conn.dataReceived( self.frame( MessageGetResource( "subtask", pickle.dumps( None ) ) ) )
+        data = self.written( conn )
+
+        ( size, ) = struct.unpack( "!L", data[ :4 ] )
+        self.assertEqual( size, os.path.getsize( self.resource ) )
+        with open( self.resource, "rb" ) as f:
+            self.assertEqual( data[ 4: ], f.read() )
+        self.assertTrue( conn.transport.lost )
+
+    ############################
+    def testHelloIsAnswered( self ):
+        conn = self.accept()
+        conn.dataReceived( self.frame( MessageHello( 40103, u"requester", features = [] ) ) )
+        data = self.written( conn )
+
+        ( size, ) = struct.unpack( "!L", data[ :4 ] )
+        msg = Message.deserializeMessage( data[ 4 : 4 + size ] )
+        self.assertEqual( msg.getType(), MessageHello.Type )
+        self.assertEqual( msg.clientUID, u"owner" )
+        self.assertEqual( len( data ), 4 + size )
+
+        # only one hello on connection
+        conn.dataReceived( self.frame( MessageHello( 40103, u"requester", features = [] ) ) )
+        self.assertEqual( self.written( conn ), data )
+
+    ############################
+    def testConnectingSideSendsHello( self ):
+        conn = TaskConnState()
+        conn.makeConnection( FakeTransport() )
+        session = TaskSession( conn )
+        conn.setSession( session )
+
+        self.server._TaskServer__channelEstablished( session, ( "10.0.0.2", 40103 ) )
+        data = self.written( conn )
+
+        msg = Message.deserializeMessage( data[ 4: ] )
+        self.assertEqual( msg.getType(), MessageHello.Type )
+        session.dropped()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import sys
+import os
+testDir = os.path.dirname( os.path.abspath( __file__ ) )
+for d in [ ".", "core" ]:
+    sys.path.append( os.path.join( testDir, d ) )
+
+import unittest
+
+from Message import Message, MessageHello, MessagePing, MessageDisconnect, MessageTasks, MessageTaskResult, CODEC_PICKLE, CODEC_BINARY, initMessages
+from databuffer import DataBuffer
+from binarycodec import isBinaryFrame, LazyValue
+
+class MessageTest( unittest.TestCase ):
+
+    ############################
+    def setUp( self ):
+        initMessages()
+
+    ############################
+    def roundTrip( self, msg, codec ):
+        data = msg.serialize( codec )
+        ret = Message.deserializeMessage( data )
+
+        self.assertEqual( ret.getType(), msg.getType() )
+        self.assertEqual( ret.dictRepr(), msg.dictRepr() )
+        return data, ret
+
+    ############################
+    def testHello( self ):
+        msg = MessageHello( 40102, u"uid", 1, 2, CODEC_BINARY, [ u"zlib" ], 4096, [ u"taskSync" ] )
+
+        for codec in [ CODEC_PICKLE, CODEC_BINARY ]:
+            data, ret = self.roundTrip( msg, codec )
+            self.assertEqual( isBinaryFrame( data ), codec == CODEC_BINARY )
+            self.assertEqual( ret.features, [ u"taskSync" ] )
+
+    ############################
+    def testEmptyMessage( self ):
+        for codec in [ CODEC_PICKLE, CODEC_BINARY ]:
+            self.roundTrip( MessagePing(), codec )
+
+    ############################
+    def testTasks( self ):
+        tasks = [ { "id" : u"task{}".format( i ), "address" : u"10.0.0.1", "port" : 40103, "ttl" : 600.0, "clientId" : u"node" } for i in range( 3 ) ]
+        data, ret = self.roundTrip( MessageTasks( tasks ), CODEC_BINARY )
+
+        self.assertTrue( isBinaryFrame( data ) )
+
+    ############################
+    def testPickleFallback( self ):
+        # old nodes send task headers with other keys, values not fitting the schema are pickled
+        for tasks in [ [ { "id" : u"task", "address" : u"10.0.0.1", "port" : 40103 } ],
+                       [ { "id" : u"task", "address" : u"10.0.0.1", "port" : -1, "ttl" : 600.0, "clientId" : u"node" } ] ]:
+            data, ret = self.roundTrip( MessageTasks( tasks ), CODEC_BINARY )
+            self.assertFalse( isBinaryFrame( data ) )
+
+        data, ret = self.roundTrip( MessageDisconnect( 3 ), CODEC_BINARY )
+        self.assertFalse( isBinaryFrame( data ) )
+
+    ############################
+    def testLazyResult( self ):
+        data = MessageTaskResult( u"subtask", { "data" : [ 1, 2 ] } ).serialize( CODEC_BINARY )
+        ret = Message.deserializeMessage( data )
+
+        self.assertTrue( isinstance( ret._result, LazyValue ) )
+        self.assertEqual( ret.result, { "data" : [ 1, 2 ] } )
+        self.assertEqual( ret._result, { "data" : [ 1, 2 ] } )
+
+    ############################
+    def testMalformedBinaryFrame( self ):
+        data = MessageHello( 40102, u"uid" ).serialize( CODEC_BINARY )
+
+        self.assertEqual( Message.deserializeMessage( data[ :-3 ] ), None )
+        self.assertEqual( Message.deserializeMessage( data[ 0 ] + "\xff" * 12 ), None )
+
+    ############################
+    def testBuffer( self ):
+        db = DataBuffer()
+        msgs = [ MessagePing(), MessageDisconnect( u"reason" ), MessageHello( 40102, u"uid" ) ]
+
+        for m in msgs:
+            m.serializeToBuffer( db, CODEC_BINARY )
+
+        self.assertEqual( [ m.getType() for m in Message.deserialize( db ) ], [ m.getType() for m in msgs ] )
+        self.assertEqual( db.dataSize(), 0 )
+
+if __name__ == "__main__":
+    unittest.main()
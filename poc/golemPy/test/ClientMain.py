@@ -68,6 +68,18 @@ def main():
     configDesc.estimatedPerformance   = estimatedPerformance
     configDesc.nodeSnapshotInterval   = nodeSnapshotInterval
     configDesc.maxResultsSendignDelay = cfg.getMaxResultsSendingDelay()
+    configDesc.p2pMaxFrameSize        = cfg.getP2PMaxFrameSize()
+    configDesc.taskMaxFrameSize       = cfg.getTaskMaxFrameSize()
+    configDesc.useDht                 = cfg.getUseDht()
+    configDesc.useLanDiscovery        = cfg.getUseLanDiscovery()
+    configDesc.lanDiscoveryGroup      = cfg.getLanDiscoveryGroup()
+    configDesc.lanDiscoveryPort       = cfg.getLanDiscoveryPort()
+    configDesc.usePeerCache           = cfg.getUsePeerCache()
+    configDesc.maxUploadRate          = cfg.getMaxUploadRate()
+    configDesc.maxPeerUploadRate      = cfg.getMaxPeerUploadRate()
+    configDesc.captureFile            = cfg.getCaptureFile()
+    configDesc.captureMaxFileSize     = cfg.getCaptureMaxFileSize()
+    configDesc.captureMaxFiles        = cfg.getCaptureMaxFiles()
 
     print "Adding tasks {}".format( addTasks )
     print "Creating public client interface with uuid: {}".format( clientUid )
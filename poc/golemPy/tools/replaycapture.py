@@ -0,0 +1,233 @@
+import sys
+import os
+toolsDir = os.path.dirname( os.path.abspath( __file__ ) )
+for d in [ "..", "../golem", "../golem/core", "../golem/network", "../golem/task", "../golem/task/resource", "../golem/manager", "../golem/vm" ]:
+    sys.path.append( os.path.join( toolsDir, d ) )
+
+import time
+import json
+import struct
+import argparse
+
+from twisted.internet.address import IPv4Address
+from twisted.internet.error import ConnectionDone
+from twisted.python.failure import Failure
+
+from Message import initMessages
+from ClientConfigDescriptor import ClientConfigDescriptor
+from capturelog import readCapture, RECORD_OPEN, RECORD_IN, RECORD_OUT, RECORD_CLOSE
+from NetConnState import NetConnState
+from TaskConnState import TaskConnState
+from ProtocolStats import DIRECTION_IN
+
+class ReplayTransport:
+    """Transport of replayed connection, whatever handlers send is dropped"""
+
+    ############################
+    def __init__( self, address, port ):
+        self.address    = address
+        self.port       = port
+        self.producer   = None
+        self.lost       = False
+        self.written    = 0
+
+    ############################
+    def write( self, data ):
+        self.written += len( data )
+
+    ############################
+    def writeSequence( self, seq ):
+        for data in seq:
+            self.write( data )
+
+    ############################
+    def loseConnection( self ):
+        self.lost = True
+
+    ############################
+    def abortConnection( self ):
+        self.lost = True
+
+    ############################
+    def getPeer( self ):
+        return IPv4Address( "TCP", self.address, self.port )
+
+    ############################
+    def getHost( self ):
+        return IPv4Address( "TCP", "127.0.0.1", 0 )
+
+    ############################
+    def registerProducer( self, producer, streaming ):
+        self.producer = producer
+
+    ############################
+    def unregisterProducer( self ):
+        self.producer = None
+
+class CaptureReplay:
+    """
+    Feeds received frames of captured sessions back to real PeerSessions and
+    TaskSessions of local P2PService and TaskServer, through the same frame
+    parser, decoder and interpret as on the wire. Every captured session is
+    replayed as incoming connection, frames sent by the node are only
+    counted. Records are replayed at recorded pace divided by speed, zero
+    speed replays as fast as possible. Replaying node has no tasks of the
+    recorded one, so when its handlers drop a session the rest of session
+    frames is skipped and counted.
+    """
+
+    ############################
+    def __init__( self, fileName, speed, kinds ):
+        self.fileName   = fileName
+        self.speed      = speed
+        self.kinds      = kinds
+        self.conns      = {}    # session id -> ConnectionState
+        self.sessions   = 0
+        self.framesIn   = 0
+        self.bytesIn    = 0
+        self.framesOut  = 0
+        self.bytesOut   = 0
+        self.skipped    = 0
+        self.lag        = 0.0   # the worst delay behind recorded pace
+
+    ############################
+    def run( self ):
+        from twisted.internet import reactor
+        from P2PService import P2PService
+        from TaskServer import TaskServer
+
+        initMessages()
+
+        cfg = ClientConfigDescriptor()
+        cfg.clientUid               = u"replay"
+        cfg.estimatedPerformance    = 1000.0
+        cfg.taskRequestInterval     = 5.0
+
+        self.p2pservice = P2PService( "127.0.0.1", cfg )
+        self.taskServer = TaskServer( "127.0.0.1", cfg )
+        self.p2pservice.setTaskServer( self.taskServer )
+
+        first = None
+        start = time.time()
+
+        for recordType, timestamp, sessionId, payload in readCapture( self.fileName ):
+            if first is None:
+                first = timestamp
+
+            if self.speed > 0.0:
+                due = start + ( timestamp - first ) / self.speed
+                now = time.time()
+                if due > now:
+                    time.sleep( due - now )
+                else:
+                    self.lag = max( self.lag, now - due )
+
+            if recordType == RECORD_OPEN:
+                self.__close( sessionId )
+                self.__open( sessionId, payload )
+            elif recordType == RECORD_IN:
+                self.__frame( sessionId, payload )
+            elif recordType == RECORD_OUT:
+                self.framesOut += 1
+                self.bytesOut += len( payload ) + 4
+            elif recordType == RECORD_CLOSE:
+                self.__close( sessionId )
+
+            # sends and timeouts scheduled by handlers
+            reactor.runUntilCurrent()
+
+        for sessionId in self.conns.keys():
+            self.__close( sessionId )
+
+        return self.__report( time.time() - start )
+
+    ############################
+    def __open( self, sessionId, payload ):
+        kind, address, port = payload.split( " " )
+        if kind not in self.kinds:
+            return
+
+        if kind == "p2p":
+            conn = NetConnState( self.p2pservice.p2pServer )
+        else:
+            conn = TaskConnState( self.taskServer )
+
+        conn.makeConnection( ReplayTransport( address, int( port ) ) )
+        self.conns[ sessionId ] = conn
+        self.sessions += 1
+
+    ############################
+    def __frame( self, sessionId, payload ):
+        conn = self.conns.get( sessionId )
+        if conn is None or not conn.opened:
+            self.skipped += 1
+            return
+
+        self.framesIn += 1
+        self.bytesIn += len( payload ) + 4
+        conn.dataReceived( struct.pack( "!L", len( payload ) ) + payload )
+
+        if conn.transport.lost:
+            self.__close( sessionId )
+
+    ############################
+    def __close( self, sessionId ):
+        conn = self.conns.pop( sessionId, None )
+        if conn is not None and conn.opened:
+            conn.connectionLost( Failure( ConnectionDone() ) )
+
+    ############################
+    def __report( self, elapsed ):
+        messages = {}
+        for service, stats in [ ( "p2p", self.p2pservice.getProtocolStats() ), ( "task", self.taskServer.getProtocolStats() ) ]:
+            for ( direction, name ), s in stats.items():
+                if direction == DIRECTION_IN:
+                    messages[ "{} {}".format( service, name ) ] = {     "count"         : s[ "count" ],
+                                                                        "bytes"         : s[ "bytes" ],
+                                                                        "errors"        : s[ "errors" ],
+                                                                        "decodeUs"      : self.__us( s[ "codecTime" ] ),
+                                                                        "handleUs"      : self.__us( s[ "handleTime" ] ) }
+
+        return {    "sessions"          : self.sessions,
+                    "framesIn"          : self.framesIn,
+                    "bytesIn"           : self.bytesIn,
+                    "framesOut"         : self.framesOut,
+                    "bytesOut"          : self.bytesOut,
+                    "skippedFrames"     : self.skipped,
+                    "elapsed"           : elapsed,
+                    "framesPerSecond"   : self.framesIn / elapsed if elapsed > 0.0 else 0.0,
+                    "maxLag"            : self.lag,
+                    "messages"          : messages }
+
+    ############################
+    def __us( self, timeStats ):
+        return {    "mean"  : 1e6 * timeStats[ "total" ] / timeStats[ "count" ] if timeStats[ "count" ] else 0.0,
+                    "p50"   : 1e6 * timeStats[ "p50" ],
+                    "p99"   : 1e6 * timeStats[ "p99" ],
+                    "max"   : 1e6 * timeStats[ "max" ] }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser( description = "Replays frames received by a node from its capture file, prints JSON report" )
+    parser.add_argument( "capture", help = "capture file, rotated files next to it are replayed first" )
+    parser.add_argument( "--speed", type = float, default = 0.0, help = "1 - recorded pace, 10 - ten times faster, 0 - as fast as possible" )
+    parser.add_argument( "--kind", choices = [ "p2p", "task", "all" ], default = "all", help = "sessions to replay" )
+    parser.add_argument( "--profile", type = int, default = 0, help = "print this many top functions of cProfile to stderr" )
+    args = parser.parse_args()
+
+    kinds = [ "p2p", "task" ] if args.kind == "all" else [ args.kind ]
+    replay = CaptureReplay( args.capture, args.speed, kinds )
+
+    # handlers are verbose, keep stdout for the report
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+
+    if args.profile:
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        report = profiler.runcall( replay.run )
+        pstats.Stats( profiler, stream = sys.stderr ).sort_stats( "cumulative" ).print_stats( args.profile )
+    else:
+        report = replay.run()
+
+    stdout.write( json.dumps( report, indent = 2, sort_keys = True ) + "\n" )